@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Mergeable count states for the summaries computed by the scripts: answer distributions, cross-tabs and multi-select counts.
+# Each state only holds counts. It can be built from any part of the data (a chunk of an export, a wave, a shard
+# processed by another process) and states of different parts are merged by adding them up, in any order.
+# Normalized views (proportions) are derived from the counts when they're read rather than computed in a second pass.
+# States can be stored as json (to_dict()/from_dict()), e.g. along with an incrementally ingested dataset (see wave_ingest.py).
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from functools import reduce
+
+from multi_select import indicator_matrix, selection_sizes
+
+
+# How often each combination of the values of columns occurs, e.g. the answer distribution of a Likert item (one column),
+# a source/target cross-tab (two columns) or a per-country x per-wave breakdown of an item (three columns).
+# Rows missing any of the values are left out (as value_counts() does).
+class ValueCounts:
+    def __init__(self, columns, counts=None):
+        self.columns = list(columns)
+        if counts is None:
+            counts = pd.Series([], index=pd.MultiIndex.from_tuples([], names=self.columns), dtype='int64')
+        self.counts = counts
+
+    @classmethod
+    def from_frame(cls, dataFrame, columns):
+        counts = dataFrame.groupby(list(columns), observed=True, dropna=True).size()
+        return cls(columns, as_multi_index(counts, columns))
+
+    @classmethod
+    def from_column(cls, col):
+        return cls.from_frame(col.to_frame(), [col.name])
+
+    def merge(self, other):
+        if self.columns != other.columns:
+            raise ValueError(f'cannot merge counts of {other.columns} into counts of {self.columns}')
+        return ValueCounts(self.columns, self.counts.add(other.counts, fill_value=0).astype('int64'))
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    def total(self):
+        return int(self.counts.sum())
+
+    # Counts (or proportions) of the values of a single column, most frequent first (as value_counts() would give them).
+    # For states of several columns, the counts of column are summed over all the others.
+    def distribution(self, column=None, normalize=False):
+        column = column if column is not None else self.columns[0]
+        return to_distribution(self.counts.groupby(level=column, observed=True).sum(), column, normalize)
+
+    # The counts summed over all but columns, e.g. the per-country counts of a per-country x per-wave state.
+    def marginal(self, columns):
+        counts = self.counts.groupby(level=list(columns), observed=True).sum()
+        return ValueCounts(columns, as_multi_index(counts, columns))
+
+    # Cross-tab with the values of rowColumns as rows and those of the remaining columns as columns (as pd.crosstab()).
+    # normalize: False, 'all', 'index' (each row sums to 1) or 'columns' (each column sums to 1)
+    def table(self, rowColumns=None, normalize=False):
+        rowColumns = list(rowColumns) if rowColumns is not None else self.columns[:1]
+        colColumns = [col for col in self.columns if col not in rowColumns]
+        table = self.counts.unstack(colColumns, fill_value=0) if colColumns else self.counts.to_frame('count')
+        if normalize in (True, 'all'):
+            return table/table.to_numpy().sum()
+        if normalize == 'index':
+            return table.div(table.sum(axis=1), axis=0)
+        if normalize == 'columns':
+            return table/table.sum(axis=0)
+        return table
+
+    def to_dict(self):
+        rows = [[to_builtin(value) for value in values]+[int(count)] for (values, count) in self.counts.items()]
+        return {'columns': self.columns, 'counts': rows}
+
+    @classmethod
+    def from_dict(cls, state):
+        columns = state['columns']
+        if not state['counts']:
+            return cls(columns)
+        index = pd.MultiIndex.from_tuples([tuple(row[:-1]) for row in state['counts']], names=columns)
+        return cls(columns, pd.Series([row[-1] for row in state['counts']], index=index, dtype='int64'))
+
+
+# numpy scalars (e.g. the values of integer columns) as python values, so they can be stored as json
+def to_builtin(value):
+    return value.item() if hasattr(value, 'item') else value
+
+
+def as_multi_index(counts, columns):
+    if not isinstance(counts.index, pd.MultiIndex):
+        counts.index = pd.MultiIndex.from_arrays([counts.index], names=list(columns))
+    return counts.astype('int64')
+
+
+# Counts of a select-all-that-apply column (see multi_select.py): how often each option was selected by respondents
+# that selected 1, 2, ... options (bySize, size x option) and how often each pair of options was selected together
+# (cooccurrence, option x option). The per-option and per-size counts are derived from bySize.
+class MultiSelectCounts:
+    def __init__(self, name, bySize=None, cooccurrence=None):
+        self.name = name
+        self.bySize = bySize if bySize is not None else pd.DataFrame(dtype='int64')
+        self.cooccurrence = cooccurrence if cooccurrence is not None else pd.DataFrame(dtype='int64')
+
+    # options: answer options of the question, if known (see multi_select.indicator_matrix())
+    # Both counts are products of sparse matrices, so only the (small) results are ever dense.
+    @classmethod
+    def from_column(cls, col, options=None):
+        multiSelect = indicator_matrix(col, options)
+        matrix = multiSelect.matrix
+        (sizes, sizeRows) = np.unique(selection_sizes(multiSelect), return_inverse=True)
+        # (sizes x respondents) indicator of how many options each respondent selected
+        bySizeMatrix = sp.csr_matrix((np.ones(len(sizeRows), dtype=np.int64), (sizeRows.ravel(), np.arange(len(sizeRows)))),
+                                     shape=(len(sizes), len(sizeRows)))
+        answered = sizes > 0
+        bySize = pd.DataFrame((bySizeMatrix @ matrix).toarray()[answered], index=sizes[answered], columns=multiSelect.options)
+        cooccurrence = pd.DataFrame((matrix.T @ matrix).toarray(), index=multiSelect.options, columns=multiSelect.options)
+        return cls(col.name, bySize, cooccurrence)
+
+    def merge(self, other):
+        bySize = self.bySize.add(other.bySize, fill_value=0).fillna(0).astype('int64')
+        cooccurrence = self.cooccurrence.add(other.cooccurrence, fill_value=0).fillna(0).astype('int64')
+        return MultiSelectCounts(self.name, bySize, cooccurrence)
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    # How often each option was selected, most frequent first. normalize: share of all selections.
+    def option_counts(self, normalize=False):
+        return to_distribution(self.bySize.sum(axis=0), self.name, normalize)
+
+    # How many respondents selected 1, 2, ... options
+    def size_counts(self, normalize=False):
+        sizes = self.bySize.sum(axis=1)//self.bySize.index.to_series()
+        return to_distribution(sizes, self.name, normalize)
+
+    # option_counts() among the respondents that selected exactly i options, for i = 1..max (size -> counts).
+    def option_counts_by_size(self):
+        maxSize = int(self.bySize.index.max()) if len(self.bySize) else 0
+        return {i: to_distribution(self.bySize.loc[i] if i in self.bySize.index else pd.Series(dtype='int64'), self.name)
+                for i in range(1, maxSize+1)}
+
+    def to_dict(self):
+        return {
+                'name': self.name,
+                'bySize': self.bySize.to_dict(orient='split'),
+                'cooccurrence': self.cooccurrence.to_dict(orient='split')
+                }
+
+    @classmethod
+    def from_dict(cls, state):
+        frames = [pd.DataFrame(**state[key]).astype('int64') for key in ('bySize', 'cooccurrence')]
+        return cls(state['name'], *frames)
+
+
+def to_distribution(counts, name, normalize=False):
+    dist = counts[counts > 0].astype('int64').sort_values(ascending=False, kind='stable')
+    dist.index.name = name
+    if normalize:
+        return (dist/dist.sum()).rename('proportion')
+    return dist.rename('count')
+
+
+# Merge any number of states (of the same kind), e.g. those of the chunks of an export.
+def merge_all(states):
+    return reduce(lambda a, b: a.merge(b), states)
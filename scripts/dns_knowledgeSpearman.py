@@ -3,105 +3,191 @@
 # -*- coding: utf8 -*-
 
 import pandas as pd, numpy as np
-from scipy import stats
 import argparse
 
+from frame_join import describe_dropped, join_on_key
+from instrumentation import add_arguments as add_instrumentation_arguments, configure as configure_instrumentation, stage
+from likert_encoding import ascending_scale, codeKnowledgeLevels, dnsKnowledgeScale, knowledgeLevelScale, likertScales, encode_ranks, simplify_codes
+from rank_correlation import spearman_resampling, correlation_matrix, correlation_pairs
+from result_cache import ResultCache, defaultCacheDir, scale_params
+from sdns_dataset import load_full_dataset
+
 
 # Assumes df is a two-column dataframe w/the 2 
-def compute_spearman(mFrame):
+# Returns a rank_correlation.SpearmanResult: rho and its asymptotic p-value (as given by stats.spearmanr)
+# along with a bootstrap confidence interval and a permutation p-value computed from `resamples` resamples.
+def compute_spearman(mFrame, resamples=10000, confidence=0.95, seed=None, workers=1):
     estimate = mFrame['Q3.2'].to_numpy()
     assessed = mFrame['simplified_code1'].to_numpy()
-    rho,pval = stats.spearmanr(estimate,assessed)
-    print(f'rho = {rho} \n pval = {pval}') 
-    # return (rho,pval)
+    return spearman_resampling(estimate, assessed, resamples=resamples, confidence=confidence, seed=seed, workers=workers)
 
 
+# group assigned codes by the level of DNS knowledge they denote (see likert_encoding.codeKnowledgeLevels)
 def simplify_coding(mergedFrame):
-    return  mergedFrame['Code 1'].apply(lambda x: simplify_helper(x))
-
-
-
-
-def simplify_helper(code):
-    if code in set(['sdns','protocol_unclear','don\'t_know','identifies_pc_by_ip','missing_details',np.nan]):
-        return 'Low'
-    elif code in set(['navigation_to_website','maps_website_to_Internet_name','maps_ip_to_domain','translates_domains_for_browsers']):
-        return 'Medium'
-    elif code == 'maps_website_to_ip':
-        return 'Med-High'
-    elif code in set(['maps_domain_to_ip','query_dns_server','query_recursive_dns']):
-        return 'High'
-    else:
-        return code
-
+    return simplify_codes(mergedFrame['Code 1'])
 
-def assemble_dataframe(fullDfFile, dnsCodeFile):
-    dataFrame = pd.read_csv(fullDfFile, index_col=0)
-    dnsCodesFrame = pd.read_csv(dnsCodeFile)
-    dnsCodesFrame.drop(columns=['Q3.3', 'Code 2', 'Code 3', 'Unnamed: 5'],inplace=True)
-    dnsCodesFrame.drop([0],inplace=True)
-    overlapSet = set(dnsCodesFrame['ResponseId']).intersection(set(dataFrame['ResponseId']))
-    includedCodes = dnsCodesFrame['ResponseId'].apply(lambda x: x in overlapSet)
-    includedData = dataFrame['ResponseId'].apply(lambda y: y in overlapSet)
 
-    dnsCodesMapping = dnsCodesFrame.where(includedCodes).dropna(how='all')
-    mappingData = dataFrame.where(includedData).dropna(how='all')
+# columns: the columns of the full dataset to include alongside the codes for Q3.3 (default: Q3.2)
+# The ResponseIds of the codes and responses that were left out are kept in attrs['dropped'] (see frame_join.join_on_key()).
+def assemble_dataframe(fullDfFile, dnsCodeFile, columns=None):
+    columns = ['Q3.2'] if columns is None else columns
+    # only load the columns needed for the analysis (see load_full_dataset)
+    with stage('load_full_dataset') as s:
+        dataFrame = s.record(load_full_dataset(fullDfFile, ['ResponseId']+columns))
+    with stage('read_codes') as s:
+        dnsCodesFrame = pd.read_csv(dnsCodeFile, usecols=['ResponseId','Code 1'])
+        dnsCodesFrame.drop([0],inplace=True)
+        s.record(dnsCodesFrame)
 
     #Q3.1 Corresponds to question S7 in the paper, Q3.2 corresponds with S8 in the paper.  
-    mergedFrame = dnsCodesMapping.merge(mappingData[['ResponseId','Q3.2']],how='inner',on='ResponseId')
+    with stage('join_codes') as s:
+        (mergedFrame, _) = join_on_key(dnsCodesFrame, dataFrame, 'ResponseId', columns)
+        s.record(mergedFrame)
     return mergedFrame
 
 
 
-def mainMap_helper(mVal):
-    if mVal in {'Low', 'I definitely do not know'}:
-        return 1
-    elif mVal in {'Medium','I\'m not sure I know'}:
-        return 2
-    elif mVal in {'Med-High', 'I somewhat know'}:
-        return 3
-    elif mVal in {'High','I definitely know'}:
-        return 4
-    else:
-        return mVal
-
-
-
-
-
+# assemble_dataframe() along with the simplified codes (simplified_code1)
+def assemble_simplified(fullDfFile, dnsCodeFile, columns=None):
+    mergedFrame = assemble_dataframe(fullDfFile, dnsCodeFile, columns)
+    mergedFrame['simplified_code1'] = simplify_coding(mergedFrame)
+    return mergedFrame
 
 
+# Cached version of assemble_simplified(): it's only recomputed if either input file or the grouping of codes changes.
+def load_merged_frame(fullDfFile, dnsCodeFile, columns=None, cache=None):
+    columns = ['Q3.2'] if columns is None else columns
+    cache = ResultCache(None) if cache is None else cache
+    params = {'columns': columns, 'codeKnowledgeLevels': codeKnowledgeLevels, 'levels': list(knowledgeLevelScale.categories)}
+    return cache.cached('dns_knowledgeSpearman.assemble_simplified', [fullDfFile, dnsCodeFile], params,
+                        assemble_simplified, fullDfFile, dnsCodeFile, columns)
 
 
 #Quick and Dirty: Getting the values in for now. Will correct to have the results read in rather than recomputed here. 
-def parse_inputs():
+def parse_inputs(args=None):
     desc = 'dns_knowledgeSpearman.py: Measures the Spearman Rank of correlation between participants estimates of their knowledge about how DNS works, and the categories to which they were assigned in dns_understanding_alluvium.py'
     parser = argparse.ArgumentParser(description=desc)
     parser.add_argument('-f',
                         dest='fullDfFile',
                         type=str,
                         default='data/fullDataset_post_drops.csv',
-                        help='indicates the (relative or complete) filepath for the full dataset\'s DF exported as a csv (default: \'data/fullDataset_post_drops.csv\')')
+                        help='indicates the (relative or complete) filepath for the full dataset\'s DF exported as a csv, or converted to a .parquet dataset by sdns_dataset.py (default: \'data/fullDataset_post_drops.csv\')')
     parser.add_argument('-d',
                         dest='dnsCodesFile',
                         type=str,
                         default='data/Response_Coding-deidentified - Q3.3-Primary.csv',
                         help='(full or relative) filepath to csv w/open coded values for Q3.3 responses (i.e. free-text description of DNS functionality) (default: \'data/Response_Coding-deidentified - Q3.3-Primary.csv\')')
-    return parser.parse_args()
-
-
-
-
-
-def main():
-    params = parse_inputs()
-    mergedFrame = assemble_dataframe(params.fullDfFile, params.dnsCodesFile)
-    mergedFrame['simplified_code1'] = simplify_coding(mergedFrame)
-    numericMframe = mergedFrame[['Q3.2','simplified_code1']].applymap(lambda x:mainMap_helper(x))
-    # rho,pval = 
-    compute_spearman(numericMframe)
-    # print('Spearman rank values: ')
-    # print(f'rho = {rho} \n pval = {pval}')
+    parser.add_argument('-m',
+                        dest='matrix',
+                        action='store_true',
+                        help='Correlation-matrix mode: compute the rank correlation between all pairs of ordinal items (the Likert items in likert_encoding.likertScales and the simplified Q3.3 codes) instead of only Q3.2 vs. the simplified Q3.3 codes. All items are ranked from their least to their most positive answer (agreement, trust, familiarity, knowledge); the output lists the ends of each item\'s scale.')
+    parser.add_argument('-k',
+                        dest='method',
+                        choices=['spearman','kendall'],
+                        default='spearman',
+                        help='rank correlation coefficient used in correlation-matrix mode (default: spearman)')
+    parser.add_argument('-a',
+                        dest='correction',
+                        choices=['holm','bonferroni','fdr_bh','none'],
+                        default='holm',
+                        help='multiple-comparison correction applied to the p-values in correlation-matrix mode (default: holm)')
+    parser.add_argument('-o',
+                        dest='outfile',
+                        type=str,
+                        default=None,
+                        help='In correlation-matrix mode, also write the results (one row per pair of items) to this csv file.')
+    parser.add_argument('-r',
+                        dest='resamples',
+                        type=int,
+                        default=10000,
+                        help='number of bootstrap resamples (for the confidence interval) and of permutations (for the permutation p-value) (default: 10000)')
+    parser.add_argument('-c',
+                        dest='confidence',
+                        type=float,
+                        default=0.95,
+                        help='confidence level of the bootstrap confidence interval (default: 0.95)')
+    parser.add_argument('-s',
+                        dest='seed',
+                        type=int,
+                        default=None,
+                        help='seed for the random number generator, for reproducible intervals and p-values (default: none)')
+    parser.add_argument('-w',
+                        dest='workers',
+                        type=int,
+                        default=1,
+                        help='number of processes the resamples are split across (default: 1)')
+    parser.add_argument('-C',
+                        dest='cacheDir',
+                        type=str,
+                        default=defaultCacheDir,
+                        help=f'Directory in which intermediate frames and results are cached, keyed by the content of the input files and the parameters of the analysis (default: {defaultCacheDir})')
+    parser.add_argument('-n',
+                        dest='noCache',
+                        action='store_true',
+                        help='Recompute everything without reading or writing the cache.')
+    add_instrumentation_arguments(parser)
+    return parser.parse_args(args)
+
+
+
+
+
+# Scales of the items of the correlation matrix, each running from its least to its most positive answer
+# (see likert_encoding.ascending_scale()), so that a positive coefficient means the same for every pair of items.
+def matrix_scales():
+    return {col: ascending_scale(scale) for (col, scale) in {**likertScales, 'simplified_code1':knowledgeLevelScale}.items()}
+
+
+# The lowest and highest answer of the scale of each item of pairs (see correlation_pairs()), i.e. the direction of its ranks.
+def add_scale_ends(pairs, scales):
+    ends = {col: f'{scale.categories[0]} .. {scale.categories[-1]}' for (col, scale) in scales.items()}
+    return pairs.assign(scale1=pairs['column1'].map(ends), scale2=pairs['column2'].map(ends))
+
+
+# All-pairs rank correlation between the ordinal items of the full dataset and the simplified Q3.3 codes.
+def compute_correlation_matrix(fullDfFile, dnsCodesFile, method='spearman', correction='holm', cache=None):
+    cache = ResultCache(None) if cache is None else cache
+    mergedFrame = load_merged_frame(fullDfFile, dnsCodesFile, list(likertScales.keys()), cache)
+    scales = matrix_scales()
+    params = {'method': method, 'correction': correction, 'scales': scale_params(scales), 'codeKnowledgeLevels': codeKnowledgeLevels}
+    return cache.cached('dns_knowledgeSpearman.correlation_matrix', [fullDfFile, dnsCodesFile], params,
+                        correlation_matrix, mergedFrame, scales, method, correction)
+
+
+def main(args=None):
+    params = parse_inputs(args)
+    configure_instrumentation(params)
+    cache = ResultCache(None if params.noCache else params.cacheDir)
+    if params.matrix:
+        with stage('compute_correlation_matrix'):
+            result = compute_correlation_matrix(params.fullDfFile, params.dnsCodesFile, params.method, params.correction, cache)
+        pairs = add_scale_ends(correlation_pairs(result), matrix_scales())
+        print('ranks run from the least to the most positive answer of each item (scale1/scale2: lowest .. highest), '
+              'i.e. a positive coefficient means higher answers to one item go with higher answers to the other')
+        print(pairs.to_string())
+        if params.outfile:
+            pairs.to_csv(params.outfile, index=False)
+        return
+    with stage('load_merged_frame') as s:
+        mergedFrame = s.record(load_merged_frame(params.fullDfFile, params.dnsCodesFile, cache=cache))
+    if 'dropped' in mergedFrame.attrs:
+        print(describe_dropped(mergedFrame.attrs['dropped'], {'left': 'coded response(s)', 'right': 'survey response(s)'}))
+    # rank both columns on their respective scales (1: least knowledge, 4: most knowledge)
+    scales = {'Q3.2':dnsKnowledgeScale, 'simplified_code1':knowledgeLevelScale}
+    with stage('encode_ranks') as s:
+        numericMframe = s.record(encode_ranks(mergedFrame, scales))
+    with stage('compute_spearman'):
+        if params.seed is None:
+            # unseeded resampling is meant to differ between runs, so it isn't cached
+            result = compute_spearman(numericMframe, params.resamples, params.confidence, params.seed, params.workers)
+        else:
+            statParams = {'resamples': params.resamples, 'confidence': params.confidence, 'seed': params.seed, 'workers': params.workers,
+                          'scales': scale_params(scales), 'codeKnowledgeLevels': codeKnowledgeLevels}
+            result = cache.cached('dns_knowledgeSpearman.compute_spearman', [params.fullDfFile, params.dnsCodesFile], statParams,
+                                  compute_spearman, numericMframe, params.resamples, params.confidence, params.seed, params.workers)
+    print('Spearman rank values: ')
+    print(f'rho = {result.rho} \n pval = {result.pval}')
+    print(f' {result.confidence:.0%} bootstrap CI = [{result.ciLow}, {result.ciHigh}] \n permutation pval = {result.permPval} \n (n = {result.n}, {result.resamples} resamples)')
 
 
 
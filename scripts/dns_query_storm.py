@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Replays a storm of DNS test queries (A/AAAA queries for <nonce>.smartdnsstudy.com, some with an EDNS
+# client subnet) against a name server, e.g. dns_responder.py on localhost, and reports the rate it was
+# answered at, the answers lost and the latency of the answers.
+# Queries are sent over UDP from several sockets, which can be bound to distinct loopback addresses
+# (127.0.0.2, 127.0.0.3, ...) to stand in for distinct resolvers. By default the storm is closed-loop:
+# a fixed number of queries is kept outstanding (-c), and every answer (or timeout) releases the next query,
+# which measures the rate the server sustains. With a target rate (-r) queries are sent at that rate
+# regardless of the answers, as during a recruitment spike, which measures the answers lost at that rate.
+
+import asyncio
+import random
+import struct
+import time
+
+from argparse import ArgumentParser
+from array import array
+from collections import Counter, namedtuple
+
+from dns_responder import defaultZone, encode_name, optionECS, typeA, typeAAAA, typeOPT
+
+
+StormResult = namedtuple('StormResult', ['sent', 'answered', 'lost', 'rcodes', 'seconds', 'latencies'])
+
+
+
+# Queries (with an id of 0) for random nonces of nonceLength digits; ecsShare of them carry an EDNS client subnet
+# (a random /24) and aaaaShare of them are AAAA queries.
+def build_queries(count, zone=defaultZone, nonceLength=5, ecsShare=0.1, aaaaShare=0.2, seed=None):
+    rng = random.Random(seed)
+    zoneName = encode_name(zone)
+    queries = list()
+    for _ in range(count):
+        nonce = str(rng.randrange(10**(nonceLength-1), 10**nonceLength)).encode('ascii')
+        qtype = typeAAAA if rng.random() < aaaaShare else typeA
+        ecs = rng.random() < ecsShare
+        query = struct.pack('>HHHHHH', 0, 0x0100, 1, 0, 0, 1 if ecs else 0)+bytes([len(nonce)])+nonce+zoneName+struct.pack('>HH', qtype, 1)
+        if ecs:
+            option = struct.pack('>HBB', 1, 24, 0)+bytes(rng.randrange(256) for _ in range(3))
+            options = struct.pack('>HH', optionECS, len(option))+option
+            query += b'\x00'+struct.pack('>HHIH', typeOPT, 1232, 0, len(options))+options
+        queries.append(query)
+    return queries
+
+
+class StormProtocol(asyncio.DatagramProtocol):
+    def __init__(self, storm):
+        self.storm = storm
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        self.storm.answer(data, self.transport)
+
+
+class Storm:
+    def __init__(self, queries, total, closedLoop):
+        self.queries = queries
+        self.total = total
+        self.closedLoop = closedLoop
+        self.pending = dict()
+        self.nextId = 0
+        self.sent = 0
+        self.answered = 0
+        self.lost = 0
+        self.rcodes = Counter()
+        self.latencies = array('d')
+        self.done = asyncio.Event()
+
+    def send(self, transport):
+        if self.sent >= self.total:
+            return
+        if len(self.pending) > 0xffff:
+            # every id is taken by an outstanding query
+            (self.sent, self.lost) = (self.sent+1, self.lost+1)
+            return
+        while self.nextId in self.pending:
+            self.nextId = (self.nextId+1) & 0xffff
+        queryId = self.nextId
+        self.nextId = (self.nextId+1) & 0xffff
+        transport.sendto(struct.pack('>H', queryId)+self.queries[self.sent % len(self.queries)][2:])
+        self.pending[queryId] = time.perf_counter()
+        self.sent += 1
+
+    def answer(self, data, transport):
+        if len(data) < 12:
+            return
+        (queryId, flags) = struct.unpack_from('>HH', data)
+        sentAt = self.pending.pop(queryId, None)
+        if sentAt is None:
+            return
+        self.latencies.append(time.perf_counter()-sentAt)
+        self.answered += 1
+        self.rcodes[flags & 0xf] += 1
+        if self.closedLoop:
+            self.send(transport)
+        self.check_done()
+
+    # Count the queries outstanding for longer than timeout as lost; returns their number.
+    def expire(self, timeout):
+        deadline = time.perf_counter()-timeout
+        expired = [queryId for (queryId, sentAt) in self.pending.items() if sentAt < deadline]
+        for queryId in expired:
+            del self.pending[queryId]
+        self.lost += len(expired)
+        self.check_done()
+        return len(expired)
+
+    def check_done(self):
+        if self.sent >= self.total and not self.pending:
+            self.done.set()
+
+
+async def expire_periodically(storm, transports, timeout):
+    while not storm.done.is_set():
+        await asyncio.sleep(timeout/4)
+        expired = storm.expire(timeout)
+        for _ in range(expired if storm.closedLoop else 0):
+            storm.send(random.choice(transports))
+
+
+async def send_at_rate(storm, transports, rate, tick=0.005):
+    start = time.perf_counter()
+    while storm.sent < storm.total:
+        due = min(int((time.perf_counter()-start)*rate), storm.total)
+        while storm.sent < due:
+            storm.send(transports[storm.sent % len(transports)])
+        await asyncio.sleep(tick)
+
+
+# Replay total queries against host:port from sockets bound to the given local addresses; rate: queries per
+# second (0: closed-loop with concurrency queries outstanding). Queries unanswered after timeout seconds are lost.
+async def run_storm(queries, host, port, total, localAddresses=None, sockets=4, rate=0, concurrency=256, timeout=1.0):
+    localAddresses = ['127.0.0.1'] if localAddresses is None else localAddresses
+    loop = asyncio.get_running_loop()
+    storm = Storm(queries, total, rate == 0)
+    transports = list()
+    for i in range(sockets):
+        (transport, _) = await loop.create_datagram_endpoint(lambda: StormProtocol(storm), local_addr=(localAddresses[i % len(localAddresses)], 0),
+                                                             remote_addr=(host, port))
+        transports.append(transport)
+    start = time.perf_counter()
+    expirer = loop.create_task(expire_periodically(storm, transports, timeout))
+    if rate:
+        await send_at_rate(storm, transports, rate)
+    else:
+        for i in range(min(concurrency, total)):
+            storm.send(transports[i % len(transports)])
+    while not storm.done.is_set():
+        try:
+            await asyncio.wait_for(storm.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            storm.expire(timeout)
+    seconds = time.perf_counter()-start
+    expirer.cancel()
+    for transport in transports:
+        transport.close()
+    return StormResult(storm.sent, storm.answered, storm.lost, storm.rcodes, seconds, storm.latencies)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q*len(ordered)), len(ordered)-1)] if ordered else float('nan')
+
+
+def format_result(result):
+    rcodes = ', '.join(f'{n} rcode {rcode}' for (rcode, n) in sorted(result.rcodes.items()))
+    latency = ' / '.join(f'{percentile(result.latencies, q)*1000:.2f}' for q in (0.5, 0.99, 1.0))
+    return (f'{result.sent} queries in {result.seconds:.2f} s: {result.answered} answered ({result.answered/result.seconds:.0f}/s), '
+            f'{result.lost} lost ({rcodes})\nlatency p50 / p99 / max: {latency} ms')
+
+
+
+
+
+def parse_inputs(args=None):
+    desc = 'dns_query_storm.py: replays a storm of DNS test queries (for <nonce>.smartdnsstudy.com) against a name server, e.g. dns_responder.py on localhost, and reports the rate they were answered at, the queries lost and the latency of the answers.'
+    parser = ArgumentParser(description=desc)
+    parser.add_argument('-s',
+                        dest='server',
+                        type=str,
+                        default='127.0.0.1',
+                        help='address of the name server (default: 127.0.0.1)')
+    parser.add_argument('-P',
+                        dest='port',
+                        type=int,
+                        default=53,
+                        help='port of the name server (default: 53)')
+    parser.add_argument('-z',
+                        dest='zone',
+                        type=str,
+                        default=defaultZone,
+                        help=f'zone of the queries (default: {defaultZone})')
+    parser.add_argument('-n',
+                        dest='total',
+                        type=int,
+                        default=100000,
+                        help='number of queries sent (default: 100000)')
+    parser.add_argument('-N',
+                        dest='nonces',
+                        type=int,
+                        default=20000,
+                        help='number of distinct queries (nonces) the queries cycle through (default: 20000)')
+    parser.add_argument('-l',
+                        dest='nonceLength',
+                        type=int,
+                        default=5,
+                        help='number of digits of a nonce (default: 5, like random_id)')
+    parser.add_argument('-r',
+                        dest='rate',
+                        type=float,
+                        default=0,
+                        help='queries per second sent regardless of the answers (default: 0, i.e. keep -c queries outstanding)')
+    parser.add_argument('-c',
+                        dest='concurrency',
+                        type=int,
+                        default=256,
+                        help='number of queries kept outstanding (without -r; default: 256)')
+    parser.add_argument('-k',
+                        dest='sockets',
+                        type=int,
+                        default=4,
+                        help='number of sockets the queries are sent from (default: 4)')
+    parser.add_argument('-R',
+                        dest='resolvers',
+                        type=int,
+                        default=1,
+                        help='number of loopback addresses (127.0.0.1, 127.0.0.2, ...) the sockets are bound to, to stand in for distinct resolvers (default: 1)')
+    parser.add_argument('-e',
+                        dest='ecsShare',
+                        type=float,
+                        default=0.1,
+                        help='share of the queries with an EDNS client subnet (default: 0.1)')
+    parser.add_argument('-t',
+                        dest='timeout',
+                        type=float,
+                        default=1.0,
+                        help='seconds after which an unanswered query is lost (default: 1)')
+    parser.add_argument('-S',
+                        dest='seed',
+                        type=int,
+                        default=None,
+                        help='seed for the random nonces (default: none)')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    params = parse_inputs(args)
+    queries = build_queries(params.nonces, params.zone, params.nonceLength, params.ecsShare, seed=params.seed)
+    localAddresses = [f'127.0.0.{i+1}' for i in range(params.resolvers)] if params.server.startswith('127.') else ['0.0.0.0']
+    result = asyncio.run(run_storm(queries, params.server, params.port, params.total, localAddresses, max(params.sockets, params.resolvers),
+                                   params.rate, params.concurrency, params.timeout))
+    print(format_result(result))
+
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Authoritative name server for the hidden DNS test (see the README), for running the test locally:
+# every name under the zone (i.e. <nonce>.smartdnsstudy.com) exists and resolves to the given address(es),
+# and every query for the zone is recorded along with the resolver that asked.
+# Queries are answered over UDP and TCP by a single asyncio event loop. Answers are assembled from the
+# question of the query and records built once at startup, so a query costs a few slices and a send.
+# Queries are recorded as fixed size binary records (see recordFormat) appended to a file in batches
+# (once batchSize records are pending, and every flushInterval seconds); the file is never synced, the
+# records are left to the page cache. A file starts with a header (recordMagic and the record size), and
+# records of later runs are appended to it. resolver_logs.py reads record files like query logs.
+# Only the server itself lives here (it needs the standard library only); dns_query_storm.py replays
+# query storms against it.
+
+import asyncio
+import os
+import signal
+import socket
+import struct
+import time
+
+from argparse import ArgumentParser
+from os.path import dirname as os_dirname
+
+
+defaultZone = 'smartdnsstudy.com'
+
+# time: seconds since the epoch; resolver, ecs: IPv6 (IPv4 mapped to ::ffff:0:0/96) address of the resolver and
+# of the EDNS client subnet (zeros if none); qtype; ecsFamily: 0 (no client subnet), 1 (IPv4) or 2 (IPv6);
+# ecsPrefix: source prefix length of the client subnet; transport: 0 (UDP) or 1 (TCP);
+# nonce: the label left of the zone (lower cased, empty for the zone itself), padded with zeros
+recordFormat = '<d16s16sHBBB32s'
+recordSize = struct.calcsize(recordFormat)
+recordMagic = b'SDNSQRY\x01'
+headerFormat = '<8sII'
+headerSize = struct.calcsize(headerFormat)
+
+typeA = 1
+typeNS = 2
+typeSOA = 6
+typeAAAA = 28
+typeOPT = 41
+optionECS = 8
+
+rcodeFormErr = 1
+rcodeNotImp = 4
+rcodeRefused = 5
+
+ipv4MappedPrefix = b'\x00'*10+b'\xff\xff'
+ednsPayloadSize = 1232
+
+
+
+# Name in wire format (lower cased), e.g. smartdnsstudy.com -> b'\x0dsmartdnsstudy\x03com\x00'
+def encode_name(name):
+    labels = [label.encode('ascii').lower() for label in name.strip('.').split('.') if label]
+    return b''.join(bytes([len(label)])+label for label in labels)+b'\x00'
+
+
+def address_bytes(text):
+    if ':' in text:
+        return socket.inet_pton(socket.AF_INET6, text.split('%')[0])
+    return ipv4MappedPrefix+socket.inet_pton(socket.AF_INET, text)
+
+
+# The (16 byte) address of an EDNS client subnet option, or None if the option is malformed.
+def client_subnet(option):
+    if len(option) < 4:
+        return None
+    (family, sourcePrefix) = struct.unpack_from('>HB', option)
+    address = option[4:]
+    if family == 1 and len(address) <= 4 and sourcePrefix <= 32:
+        return (family, sourcePrefix, ipv4MappedPrefix+address.ljust(4, b'\x00'))
+    if family == 2 and len(address) <= 16 and sourcePrefix <= 128:
+        return (family, sourcePrefix, address.ljust(16, b'\x00'))
+    return None
+
+
+# OPT record of a query (at offset position): its version and client subnet option (if any), or None if it isn't one.
+def parse_opt(data, position):
+    if data[position:position+3] != b'\x00\x00\x29' or len(data) < position+11:
+        return None
+    (version, rdLength) = (data[position+6], struct.unpack_from('>H', data, position+9)[0])
+    (subnet, option, position) = (None, None, position+11)
+    end = min(position+rdLength, len(data))
+    while position+4 <= end:
+        (code, length) = struct.unpack_from('>HH', data, position)
+        if code == optionECS:
+            option = data[position+4:position+4+length]
+            subnet = client_subnet(option)
+        position += 4+length
+    return (version, subnet, option)
+
+
+class QueryRecorder:
+    def __init__(self, path, batchSize=4096):
+        if os_dirname(path):
+            os.makedirs(os_dirname(path), exist_ok=True)
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(struct.pack(headerFormat, recordMagic, recordSize, 0))
+        else:
+            check_header(path)
+        self.batchBytes = batchSize*recordSize
+        self.pending = bytearray()
+        self.records = 0
+
+    def record(self, resolver, nonce, qtype, subnet, transport):
+        (family, prefix, address) = subnet or (0, 0, b'')
+        self.pending += struct.pack(recordFormat, time.time(), resolver, address, qtype, family, prefix, transport, nonce)
+        self.records += 1
+        if len(self.pending) >= self.batchBytes:
+            self.flush()
+
+    # Hand the pending records to the kernel (not to the disk).
+    def flush(self):
+        if self.pending:
+            self.file.write(self.pending)
+            self.file.flush()
+            self.pending = bytearray()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+# Raise a ValueError unless path starts with the header of a record file.
+def check_header(path):
+    with open(path, 'rb') as f:
+        header = f.read(headerSize)
+    if len(header) < headerSize or struct.unpack(headerFormat, header)[:2] != (recordMagic, recordSize):
+        raise ValueError(f'{path} is not a query record file (of this version)')
+
+
+def is_record_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(recordMagic)) == recordMagic
+
+
+# Answers the queries for zone: every name under it resolves to ipv4 (A) and ipv6 (AAAA), if given;
+# the zone itself also has a SOA and NS record.
+class Responder:
+    def __init__(self, zone, ipv4=None, ipv6=None, ttl=60, recorder=None):
+        self.zone = encode_name(zone)
+        self.recorder = recorder
+        self.counts = {'answered': 0, 'refused': 0, 'malformed': 0}
+        rr = lambda rtype, rdata, pointer=0xc00c: struct.pack('>HHHIH', pointer, rtype, 1, ttl, len(rdata))+rdata
+        self.answers = dict()
+        if ipv4:
+            self.answers[typeA] = rr(typeA, socket.inet_pton(socket.AF_INET, ipv4))
+        if ipv6:
+            self.answers[typeAAAA] = rr(typeAAAA, socket.inet_pton(socket.AF_INET6, ipv6))
+        # SOA and NS of the zone, as records following a pointer to the zone name (filled in per query)
+        nameServer = b'\x03ns1'+self.zone
+        soa = nameServer+b'\x0ahostmaster'+self.zone+struct.pack('>IIIII', 1, 3600, 600, 86400, ttl)
+        self.soa = struct.pack('>HHIH', typeSOA, 1, ttl, len(soa))+soa
+        self.ns = struct.pack('>HHIH', typeNS, 1, ttl, len(nameServer))+nameServer
+
+    # The response (bytes) to the query data from resolver (16 byte address), or None to drop it.
+    def respond(self, data, resolver, transport=0):
+        if len(data) < 12:
+            return None
+        (queryId, flags, qdCount, anCount, nsCount, arCount) = struct.unpack_from('>HHHHHH', data)
+        if flags & 0x8000:
+            return None
+        opcode = (flags >> 11) & 0xf
+        responseFlags = 0x8000 | (flags & 0x7900)
+        if opcode != 0:
+            return self.error(queryId, responseFlags, rcodeNotImp)
+        # question: name (labels of at most 63 bytes, so lower casing leaves the lengths as they are), type and class
+        position = 12
+        try:
+            while data[position]:
+                if data[position] > 63:
+                    raise IndexError
+                position += data[position]+1
+        except IndexError:
+            self.counts['malformed'] += 1
+            return self.error(queryId, responseFlags, rcodeFormErr)
+        questionEnd = position+5
+        if qdCount != 1 or questionEnd > len(data):
+            self.counts['malformed'] += 1
+            return self.error(queryId, responseFlags, rcodeFormErr)
+        name = data[12:position+1].lower()
+        qtype = struct.unpack_from('>H', data, position+1)[0]
+        # the nonce is the last label before the zone, which has to start at a label
+        zoneStart = len(name)-len(self.zone)
+        (offset, nonce) = (0, b'')
+        while offset < zoneStart:
+            (nonce, offset) = (name[offset+1:offset+1+name[offset]], offset+1+name[offset])
+        if offset != zoneStart or not name.endswith(self.zone):
+            self.counts['refused'] += 1
+            return struct.pack('>HHHHHH', queryId, responseFlags | rcodeRefused, 1, 0, 0, 0)+data[12:questionEnd]
+        opt = parse_opt(data, questionEnd) if arCount and not anCount and not nsCount else None
+        if self.recorder is not None:
+            self.recorder.record(resolver, nonce, qtype, opt[1] if opt else None, transport)
+        self.counts['answered'] += 1
+        zonePointer = struct.pack('>H', 0xc000 | (12+zoneStart))
+        (answers, authority) = (b'', b'')
+        if qtype in self.answers:
+            answers = self.answers[qtype]
+        elif zoneStart == 0 and qtype in (typeSOA, typeNS):
+            answers = zonePointer+(self.soa if qtype == typeSOA else self.ns)
+        else:
+            authority = zonePointer+self.soa
+        additional = self.opt_record(opt) if opt else b''
+        if opt and opt[0] != 0:
+            # BADVERS (16): the upper bits of the rcode go into the OPT record
+            return struct.pack('>HHHHHH', queryId, responseFlags | 0x0400, 1, 0, 0, 1)+data[12:questionEnd]+self.opt_record(opt, 1)
+        return (struct.pack('>HHHHHH', queryId, responseFlags | 0x0400, 1, 1 if answers else 0, 1 if authority else 0, 1 if additional else 0)
+                +data[12:questionEnd]+answers+authority+additional)
+
+    def error(self, queryId, responseFlags, rcode):
+        return struct.pack('>HHHHHH', queryId, responseFlags | rcode, 0, 0, 0, 0)
+
+    # OPT record of a response; the client subnet option is echoed with a scope of 0 (the answer is the same for all subnets).
+    def opt_record(self, opt, extendedRcode=0):
+        (_, subnet, option) = opt
+        options = b''
+        if subnet is not None:
+            echoed = option[:3]+b'\x00'+option[4:]
+            options = struct.pack('>HH', optionECS, len(echoed))+echoed
+        return b'\x00'+struct.pack('>HHBBHH', typeOPT, ednsPayloadSize, extendedRcode, 0, 0, len(options))+options
+
+
+
+# Queries over UDP are read straight off a non-blocking socket registered with the event loop: each time it
+# is readable, all datagrams queued on it (up to batchSize) are answered, rather than one per wakeup as by
+# asyncio's datagram transports. An answer the socket can't take right away is dropped (the resolver retries).
+class UdpServer:
+    def __init__(self, responder, host, port, batchSize=256):
+        self.responder = responder
+        self.batchSize = batchSize
+        self.addressKeys = dict()
+        self.socket = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2**22)
+        self.socket.bind((host, port))
+        self.socket.setblocking(False)
+        self.dropped = 0
+
+    def start(self, loop):
+        loop.add_reader(self.socket.fileno(), self.read_ready)
+
+    def read_ready(self):
+        (recvfrom, sendto, respond, addressKeys) = (self.socket.recvfrom, self.socket.sendto, self.responder.respond, self.addressKeys)
+        for _ in range(self.batchSize):
+            try:
+                (data, address) = recvfrom(4096)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                continue
+            # resolvers repeat, so their addresses are converted once
+            resolver = addressKeys.get(address[0])
+            if resolver is None:
+                if len(addressKeys) > 2**20:
+                    addressKeys.clear()
+                resolver = addressKeys[address[0]] = address_bytes(address[0])
+            response = respond(data, resolver, 0)
+            if response is not None:
+                try:
+                    sendto(response, address)
+                except OSError:
+                    self.dropped += 1
+
+    def close(self, loop):
+        loop.remove_reader(self.socket.fileno())
+        self.socket.close()
+
+
+# Queries over TCP are prefixed with their length; a connection may carry any number of them.
+async def serve_tcp(responder, reader, writer):
+    resolver = address_bytes(writer.get_extra_info('peername')[0])
+    try:
+        while True:
+            length = struct.unpack('>H', await reader.readexactly(2))[0]
+            response = responder.respond(await reader.readexactly(length), resolver, 1)
+            if response is not None:
+                writer.write(struct.pack('>H', len(response))+response)
+                await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def flush_periodically(recorder, interval):
+    while True:
+        await asyncio.sleep(interval)
+        recorder.flush()
+
+
+async def serve(responder, host, port, flushInterval=1.0):
+    loop = asyncio.get_running_loop()
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    udpServer = UdpServer(responder, host, port)
+    udpServer.start(loop)
+    tcpServer = await asyncio.start_server(lambda r, w: serve_tcp(responder, r, w), host, port, family=family)
+    stopped = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopped.set)
+    flusher = loop.create_task(flush_periodically(responder.recorder, flushInterval)) if responder.recorder else None
+    print(f'serving {host} port {port} (UDP and TCP)')
+    await stopped.wait()
+    if flusher:
+        flusher.cancel()
+    udpServer.close(loop)
+    tcpServer.close()
+    responder.counts['dropped'] = udpServer.dropped
+
+
+
+
+
+def parse_inputs(args=None):
+    desc = 'dns_responder.py: authoritative name server for the hidden DNS test, for running it locally: answers A/AAAA queries for every name under the zone (e.g. <nonce>.smartdnsstudy.com) and records each query (time, nonce, resolver and EDNS client subnet) to a binary record file readable by resolver_logs.py.'
+    parser = ArgumentParser(description=desc)
+    parser.add_argument('-o',
+                        dest='recordFile',
+                        type=str,
+                        required=True,
+                        help='file the queries are recorded to (records are appended if it exists)')
+    parser.add_argument('-z',
+                        dest='zone',
+                        type=str,
+                        default=defaultZone,
+                        help=f'zone the server is authoritative for (default: {defaultZone})')
+    parser.add_argument('-4',
+                        dest='ipv4',
+                        type=str,
+                        default='127.0.0.1',
+                        help='address of the A records of the zone (default: 127.0.0.1)')
+    parser.add_argument('-6',
+                        dest='ipv6',
+                        type=str,
+                        default=None,
+                        help='address of the AAAA records of the zone (default: none, i.e. AAAA queries get no answer)')
+    parser.add_argument('-b',
+                        dest='host',
+                        type=str,
+                        default='127.0.0.1',
+                        help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('-P',
+                        dest='port',
+                        type=int,
+                        default=53,
+                        help='port to listen on, UDP and TCP (default: 53)')
+    parser.add_argument('-t',
+                        dest='ttl',
+                        type=int,
+                        default=60,
+                        help='TTL of the records (default: 60)')
+    parser.add_argument('-B',
+                        dest='batchSize',
+                        type=int,
+                        default=4096,
+                        help='number of records written at once (default: 4096)')
+    parser.add_argument('-F',
+                        dest='flushInterval',
+                        type=float,
+                        default=1.0,
+                        help='seconds after which pending records are written regardless (default: 1)')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    params = parse_inputs(args)
+    recorder = QueryRecorder(params.recordFile, params.batchSize)
+    responder = Responder(params.zone, params.ipv4, params.ipv6, params.ttl, recorder)
+    try:
+        asyncio.run(serve(responder, params.host, params.port, params.flushInterval))
+    finally:
+        recorder.close()
+        counts = ', '.join(f'{n} {kind}' for (kind, n) in responder.counts.items())
+        print(f'{counts}; {recorder.records} queries recorded to {params.recordFile}')
+
+
+
+if __name__=='__main__':
+    main()
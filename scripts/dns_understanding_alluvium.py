@@ -8,26 +8,32 @@
 
 
 import pandas as pd, numpy as np
-import plotly.graph_objects as go
 import argparse
 
+from concurrent.futures import ProcessPoolExecutor
+from os import makedirs as os_makedirs
+from os.path import join as os_join
 
+from frame_join import describe_dropped, join_on_key
+from instrumentation import add_arguments as add_instrumentation_arguments, configure as configure_instrumentation, stage
+from likert_encoding import agreeScale, trustScale, knowledgeLevelScale, codeKnowledgeLevels, encode_codes, simplify_codes
+from result_cache import ResultCache, defaultCacheDir, scale_params
+from sdns_dataset import load_full_dataset
 
 
-def assemble_dataframe(fullDfFile, dnsCodeFile):
-    dataFrame = pd.read_csv(fullDfFile, index_col=0)#'data/fullDataset_post_drops.csv'
-    dnsCodesFrame = pd.read_csv(dnsCodeFile)#'data/Response_Coding-deidentified - Q3.3-Primary.csv'
 
-    #drop unneeded cols and header row from dnsCodesFrame
-    dnsCodesFrame.drop(columns=['Q3.3', 'Code 2', 'Code 3', 'Unnamed: 5'],inplace=True)
-    dnsCodesFrame.drop([0],inplace=True)
-    overlapSet = set(dnsCodesFrame['ResponseId']).intersection(set(dataFrame['ResponseId']))
 
-    includedCodes = dnsCodesFrame['ResponseId'].apply(lambda x: x in overlapSet)
-    includedData = dataFrame['ResponseId'].apply(lambda y: y in overlapSet)
+# The ResponseIds of the codes and responses that were left out are kept in attrs['dropped'] (see frame_join.join_on_key()).
+def assemble_dataframe(fullDfFile, dnsCodeFile):
+    # only load the columns needed for the analysis (see load_full_dataset)
+    with stage('load_full_dataset') as s:
+        dataFrame = s.record(load_full_dataset(fullDfFile, ['ResponseId',' ',' .1','Q4.5','Q9.1','Q29_2']))#'data/fullDataset_post_drops.csv'
+    with stage('read_codes') as s:
+        dnsCodesFrame = pd.read_csv(dnsCodeFile, usecols=['ResponseId','Code 1'])#'data/Response_Coding-deidentified - Q3.3-Primary.csv'
 
-    dnsCodesMapping = dnsCodesFrame.where(includedCodes).dropna(how='all')
-    mappingData = dataFrame.where(includedData).dropna(how='all')
+        #drop header row from dnsCodesFrame (unneeded cols are skipped while reading)
+        dnsCodesFrame.drop([0],inplace=True)
+        s.record(dnsCodesFrame)
 
     # important cols for analysis:
     # ' ': 'Smart DNS provides additional security when browsing the internet.' (Agree/Disagree - Likert)
@@ -39,223 +45,94 @@ def assemble_dataframe(fullDfFile, dnsCodeFile):
     # NOTE: It may also be worth considering code values given for Q4.6 in which participants explain answer given in Q4.5
 
     # Merge primary codes for Q3.3 w/other needed columns only (i.e. exclude other dataFrame cols)
-    mergedFrame = dnsCodesMapping.merge(mappingData[['ResponseId',' ',' .1','Q4.5','Q9.1','Q29_2']],how='inner',on='ResponseId')
+    with stage('join_codes') as s:
+        (mergedFrame, _) = join_on_key(dnsCodesFrame, dataFrame, 'ResponseId', [' ',' .1','Q4.5','Q9.1','Q29_2'])
+        s.record(mergedFrame)
     return mergedFrame
 
 
 
 # group assigned codes by level of familiarity with/understanding of DNS they (roughly) denote. 
 # See paper's appendix (TODO: determine appendix and whether it appears in paper or extended version) for detailed description and breakdown of codes and their groupings.
+# The grouping itself is declared in likert_encoding.codeKnowledgeLevels
 
 def simplify_coding(mergedFrame):
-    return  mergedFrame['Code 1'].apply(lambda x: simplify_helper(x))
-
-
-def simplify_helper(code):
-    if code in set(['sdns','protocol_unclear','don\'t_know','identifies_pc_by_ip','missing_details',np.nan]):
-        return 'Low'
-    elif code in set(['navigation_to_website','maps_website_to_Internet_name','maps_ip_to_domain','translates_domains_for_browsers']):
-        return 'Medium'
-    elif code == 'maps_website_to_ip':
-        return 'Med-High'
-    elif code in set(['maps_domain_to_ip','query_dns_server','query_recursive_dns']):
-        return 'High'
-    else:
-        return code
-
-
-# Build up constructor fields and then initialize graph object (go)
-def build_sdnsTrustworthiness_plot(mergedFrame):
-    riskMap ={
-             'Very trustworthy':0, 'Slightly trustworthy':1,
-             'Neither trustworthy nor untrustworthy':2, 
-             'Slightly untrustworthy':3, 'Very untrustworthy':4
-           }
-    dnsKnowledgeMap = {
-           'Low': 5, 'Medium': 6,
-           'Med-High': 7, 'High': 8
-           }
-    
-    labelList = [
-           'Very Trustworthy', 'Slightly Trustworthy',
-           'Neither',
-           'Slightly Untrustworthy','Very Untrustworthy',
-           'Low', 'Medium',
-           'Med-High','High'
-           ]
-    
-    # stringDist is a series where the index is of the form  source,target     <count>
-    # where source is the starting (or input) val (in this case from Q9.1),
-    # target is the output or outcome val (in this case originating from the groupings for Q3.3),
-    # and <count> is the number of times a mapping from source to target appeared in the concatenated frame
-    # (i.e. in mergedFrame['Q9.1'].str.cat(simplify_coding(mergedFrame),sep=',') ).
-    stringDist =  mergedFrame['Q9.1'].str.cat(simplify_coding(mergedFrame),sep=',').value_counts()
-    
-    # split off the index and make it into a data-frame
-    srcDests = stringDist.index.to_series(index=[x for x in range(0,stringDist.size)])
-    srcDests = srcDests.str.split(',',expand=True)
-    
-    # map the names to their numerical values (given in riskMap), same idea for targets
-    sourceList = srcDests[0].map(riskMap).to_list()
-    targetList = srcDests[1].map(dnsKnowledgeMap).to_list()#destination links to join/map to
-    valueList = stringDist.to_list()#relative thicknesses of links
-    #colors of the nodes within the diagram listed in columnwise order (i.e. order within col 1(source) followed by that in col2(target), etc.)
-    # in this case: the same ordering as that of labelList
-    node_colors = [
-            '#053061','#4393c3',
-            '#efa882','#d6604d',
-            '#b2182b','#67001f',
-            '#b2182b','#efa882',
-            '#053061',
-            ]
-    colorDict = {
-           0:'#053061', 1:'#4393c3',
-           2:'#efa882', 3:'#d6604d',
-           4:'#b2182b', 5:'#67001f'
-           } 
-    # A total of 14 links. Link Coloring will be based on source's color
-    # Links go 
-    # 1 (Slightly Trustworthy): 5 (Low)
-    # 0 (Very Trustworthy) : 8 (High)
-    # 1 (Slightly Trustworthy) : 7 (Med-High)
-    # 1 (Slightly Trustworthy) : 8 (High)
-    # 0 (Very Trustworthy) : 7 (Med-High)
-    # 0 (Very Trustworthy) : 5 (Low)
-    # 1 (Slightly Trustworthy): 6 (Medium)
-    # 2 (Niether) : 5 (Low)
-    # 2 (Niether) : 7 (Med-High)
-    # 3 (Slightly Untrustworthy) : 8 (High)
-    # 0 (Very Trustworthy) : 6 (Medium)
-    # 3 (Slightly Untrustworthy) : 7 (Med-High)
-    # 3 (Slightly Untrustworthy) : 5 (Low)
-    # 2 (Niether) : 8 (High)
-    
-    link_colors = [colorDict[x] for x in sourceList] 
-
-    node_x=[0.1, 0.1, 0.1, 0.1, 0.9, 0.9, 0.9, 0.9]
-    node_y=[0.1 ,0.3, 0.5, 0.7, 0.1, 0.3, 0.5, 0.7]
-    #controls size, color and font of node labels within the graph
-    txtFont = go.sankey.Textfont(size=15)
-    linkDict = dict(source=sourceList, target=targetList, value=valueList, color=link_colors)
-    nodeDict = dict(label=labelList, pad=50, thickness=30, x=node_x, y=node_y, color=node_colors)
-    graphData = go.Sankey(arrangement='snap',link=linkDict,node=nodeDict,textfont=txtFont)
-    fig = go.Figure(data=[graphData])
-    fig.update_layout(title_text='SDNS Trustworthiness vs. DNS Knowledge', font_size=20)
-    fig.show()
-    fig.write_image('figures/sdnsAlluvians/trustworthyVDns.pdf',format=pdf,scale=1.0)#todo: make this a passed in parameter rather than hard-coded
-    return
-
-
-
-# ' ' Smart DNS provides additional security when browsing the internet. (agree/disagree-Likert) 
-# Build up constructor fields and then initialize graph object (go)
-def build_sdnsSecurity_plot(mergedFrame):
-    impactMap ={
-        'Strongly agree':0, 'Agree':1,
-        'Somewhat agree':2,'Neither agree nor disagree':3, 
-        'Somewhat disagree':4, 'Disagree':5,
-        'Strongly disagree':6
-    }
-    dnsKnowledgeMap = {
-        'Low': 7, 'Medium': 8,
-        'Med-High': 9, 'High': 10
-        }
-
-    labelList = [
-        'Strongly Agree', 'Agree',
-        'Somewhat Agree','Neither Agree Nor Disagree',
-        'Somewhat Disagree','Disagree',
-        'Strongly Disagree',
-        'Low', 'Medium',
-        'Med-High','High'
-        ]
+    return simplify_codes(mergedFrame['Code 1'])
 
-    # See <fx'n name> (line )  for an explanation of the fields  
-    stringDist =  mergedFrame[' '].str.cat(simplify_coding(mergedFrame),sep=',').value_counts()
 
-    # split off the index and make it into a data-frame
-    srcDests = stringDist.index.to_series(index=[x for x in range(0,stringDist.size)])
-    srcDests = srcDests.str.split(',',expand=True)
-
-    # map the names to their numerical values (given in impactMap), same idea for targets
-    sourceList = srcDests[0].map(impactMap).to_list()
-    targetList = srcDests[1].map(dnsKnowledgeMap).to_list()#destination links to join/map to
-    valueList = stringDist.to_list()#relative thicknesses of links
-    #colors of the nodes within the diagram listed in columnwise order (i.e. order within col 1(source) followed by that in col2(target), etc.)
-    # in this case: the same ordering as that of labelList
-    node_colors = [
-        '#67001f','#a42747',
-        '#f4a582','#fddbc7',
-        '#92c5de','#2166ac',
-        '#053061','#67001f',
-        '#efa882','#92c5de',
-        '#053061'
-        ]
+# assemble_dataframe() along with the simplified codes (simplified_code1)
+def assemble_simplified(fullDfFile, dnsCodeFile):
+    mergedFrame = assemble_dataframe(fullDfFile, dnsCodeFile)
+    mergedFrame['simplified_code1'] = simplify_coding(mergedFrame)
+    return mergedFrame
 
-    node_x=[0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.9, 0.9, 0.9, 0.9]
-    node_y=[0.1 ,0.2, 0.3, 0.5, 0.6, 0.7, 0.1, 0.3, 0.4, 0.6]
-
-    
-    # [2, 0, 2, 1, 1, 0, 2, 1, 5, 1, 0, 3, 4, 5, 3, 2, 4, 3, 0]#TODO: Fix node colors accordingly
-    # A total of 19 links. Link Coloring will be based on source's color
-    colorDict = {
-        0:'#67001f', 1:'#a42747',
-        2:'#f4a582', 3:'#fddbc7',
-        4:'#92c5de', 5:'#2166ac',
-        6:'#053061'
-        }
 
-    link_colors = [colorDict[x] for x in sourceList]
+# Cached version of assemble_simplified(): it's only recomputed if either input file or the grouping of codes changes.
+def load_merged_frame(fullDfFile, dnsCodeFile, cache=None):
+    cache = ResultCache(None) if cache is None else cache
+    params = {'codeKnowledgeLevels': codeKnowledgeLevels, 'levels': list(knowledgeLevelScale.categories)}
+    return cache.cached('dns_understanding_alluvium.assemble_simplified', [fullDfFile, dnsCodeFile], params,
+                        assemble_simplified, fullDfFile, dnsCodeFile)
+
+
+# Link weights of an alluvium through columns (in order), where each column is answered on the
+# corresponding scale in scales. Links only connect consecutive columns.
+# Nodes are numbered column by column (i.e. the nodes of columns[1] follow all those of columns[0], etc.),
+# each in the order of its scale.
+# Link weights are computed by counting (source code, target code) pairs directly,
+# responses missing either value are left out.
+def compute_links(mergedFrame, columns, scales):
+    codes = [encode_codes(mergedFrame[col], scale) for (col, scale) in zip(columns, scales)]
+    sizes = [len(scale.categories) for scale in scales]
+    offsets = np.cumsum([0]+sizes)
+    sourceList, targetList, valueList = list(), list(), list()
+    for i in range(len(columns)-1):
+        (src, tgt) = (codes[i], codes[i+1])
+        valid = (src >= 0) & (tgt >= 0)
+        pairCounts = np.bincount(src[valid]*sizes[i+1] + tgt[valid], minlength=sizes[i]*sizes[i+1])
+        pairs = np.flatnonzero(pairCounts)
+        sourceList.extend((pairs // sizes[i+1] + offsets[i]).tolist())
+        targetList.extend((pairs % sizes[i+1] + offsets[i+1]).tolist())
+        valueList.extend(pairCounts[pairs].tolist())
+    return (sourceList, targetList, valueList)
+
+
+# Build an alluvium (sankey diagram) through any number of categorical columns.
+# labelList and nodeColors are listed columnwise (i.e. the nodes of col 1 (source) followed by those of col 2 (target), etc.)
+# and default to the scales' categories and plotly's colors respectively.
+# Link coloring is based on the source node's color.
+# links: the result of compute_links() for columns and scales, if already known (e.g. cached, see main()).
+# plotly is only imported here and in render_batch(), so the rest of this script (e.g. assemble_dataframe()) loads without it.
+def build_alluvium(mergedFrame, columns, scales, title, labelList=None, nodeColors=None, nodeX=None, nodeY=None, pad=40, fontSize=15, links=None):
+    import plotly.graph_objects as go
+    (sourceList, targetList, valueList) = links if links is not None else compute_links(mergedFrame, columns, scales)
+    if labelList is None:
+        labelList = [label for scale in scales for label in scale.categories]
+    linkDict = dict(source=sourceList, target=targetList, value=valueList)
+    nodeDict = dict(label=labelList, pad=pad, thickness=30)
+    if nodeColors is not None:
+        linkDict['color'] = [nodeColors[x] for x in sourceList]
+        nodeDict['color'] = nodeColors
+    if nodeX is not None:
+        nodeDict['x'] = nodeX
+        nodeDict['y'] = nodeY
     #controls size, color and font of node labels within the graph
-    txtFont = go.sankey.Textfont(size=15)
-    linkDict = dict(source=sourceList, target=targetList, value=valueList, color=link_colors)
-    nodeDict = dict(label=labelList, pad=40, x=node_x, y=node_y,thickness=30, color=node_colors)
+    txtFont = go.sankey.Textfont(size=fontSize)
     graphData = go.Sankey(arrangement='snap',link=linkDict,node=nodeDict,textfont=txtFont)
     fig = go.Figure(data=[graphData])
-    fig.update_layout(title_text='SDNS Improves Sec. v. DNS Knowledge', font_size=20)
-    fig.show()
-    fig.write_image('figures/sdnsAlluvians/improvesSecVDns.pdf')#todo: make this a passed in parameter rather than hard-coded
-    return
-
+    fig.update_layout(title_text=title, font_size=20)
+    return fig
 
 
-
-def build_sdnsPrivacy_plot(mergedFrame):
-    impactMap ={
-        'Strongly agree':0, 'Agree':1,
-        'Somewhat agree':2,'Neither agree nor disagree':3,
-        'Somewhat disagree':4, 'Disagree':5,
-        'Strongly disagree':6
-        }
-    dnsKnowledgeMap = {
-        'Low': 7, 'Medium': 8,
-        'Med-High': 9, 'High': 10
-        }
-
-    labelList = [
+agreeLabels = [
         'Strongly Agree', 'Agree',
         'Somewhat Agree','Neither Agree Nor Disagree',
         'Somewhat Disagree','Disagree',
-        'Strongly Disagree',
-        'Low', 'Medium',
-        'Med-High','High'
+        'Strongly Disagree'
         ]
 
-        # See <fx'n name> (line )  for an explanation of the fields  
-    stringDist =  mergedFrame[' .1'].str.cat(simplify_coding(mergedFrame),sep=',').value_counts()
-
-    # split off the index and make it into a data-frame
-    srcDests = stringDist.index.to_series(index=[x for x in range(0,stringDist.size)])
-    srcDests = srcDests.str.split(',',expand=True)
-
-    # map the names to their numerical values (given in impactMap), same idea for targets
-    sourceList = srcDests[0].map(impactMap).to_list()
-    targetList = srcDests[1].map(dnsKnowledgeMap).to_list()#destination links to join/map to
-    valueList = stringDist.to_list()#relative thicknesses of links
-    
-    #colors of the nodes within the diagram listed in columnwise order (i.e. order within col 1(source) followed by that in col2(target), etc.)
-    # in this case: the same ordering as that of labelList
-    node_colors = [
+# colors of the agree/disagree nodes followed by those of the DNS knowledge levels
+agreeColors = [
         '#67001f','#a42747',
         '#f4a582','#fddbc7',
         '#92c5de','#2166ac',
@@ -264,68 +141,153 @@ def build_sdnsPrivacy_plot(mergedFrame):
         '#053061'
         ]
 
-    node_x=[0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.9, 0.9, 0.9, 0.9]
-    node_y=[0.1 ,0.2, 0.3, 0.5, 0.6, 0.7, 0.1, 0.3, 0.4, 0.6]
-
-    colorDict = { 
-        0:'#67001f', 1:'#a42747',
-        2:'#f4a582', 3:'#fddbc7',
-        4:'#92c5de', 5:'#2166ac',
-        6:'#053061'
+# The alluvia of the paper. All of them map a Likert item (source) to the level of DNS knowledge
+# denoted by participants' (grouped) primary code for Q3.3 (target).
+# Q9.1: 'How trustworthy do you find these services overall?'
+# ' ': 'Smart DNS provides additional security when browsing the internet.'
+# ' .1': 'Smart DNS provides additional privacy when browsing the internet.'
+sdnsPlots = {
+        'trustworthyVDns': dict(
+            columns=['Q9.1','simplified_code1'],
+            scales=[trustScale, knowledgeLevelScale],
+            title='SDNS Trustworthiness vs. DNS Knowledge',
+            labelList=[
+                'Very Trustworthy', 'Slightly Trustworthy',
+                'Neither',
+                'Slightly Untrustworthy','Very Untrustworthy',
+                'Low', 'Medium',
+                'Med-High','High'
+                ],
+            nodeColors=[
+                '#053061','#4393c3',
+                '#efa882','#d6604d',
+                '#b2182b','#67001f',
+                '#b2182b','#efa882',
+                '#053061',
+                ],
+            nodeX=[0.1, 0.1, 0.1, 0.1, 0.9, 0.9, 0.9, 0.9],
+            nodeY=[0.1 ,0.3, 0.5, 0.7, 0.1, 0.3, 0.5, 0.7],
+            pad=50, fontSize=15),
+        'improvesSecVDns': dict(
+            columns=[' ','simplified_code1'],
+            scales=[agreeScale, knowledgeLevelScale],
+            title='SDNS Improves Sec. v. DNS Knowledge',
+            labelList=agreeLabels+['Low', 'Medium', 'Med-High','High'],
+            nodeColors=agreeColors,
+            nodeX=[0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.9, 0.9, 0.9, 0.9],
+            nodeY=[0.1 ,0.2, 0.3, 0.5, 0.6, 0.7, 0.1, 0.3, 0.4, 0.6],
+            pad=40, fontSize=15),
+        'improvesPrivVDns': dict(
+            columns=[' .1','simplified_code1'],
+            scales=[agreeScale, knowledgeLevelScale],
+            title='SDNS Improves Priv. v. DNS Knowledge',
+            labelList=agreeLabels+['Low', 'Medium', 'Med-High','High'],
+            nodeColors=agreeColors,
+            nodeX=[0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.9, 0.9, 0.9, 0.9],
+            nodeY=[0.1 ,0.2, 0.3, 0.5, 0.6, 0.7, 0.1, 0.3, 0.4, 0.6],
+            pad=40, fontSize=20)
         }
 
-    link_colors = [colorDict[x] for x in sourceList]
-
-    # A total of 18 links. Link Coloring will be based on source's color
-    # link_colors = [
-    #     '#67001f', '#a42747',
-    #     '#f4a582', '#a42747',
-    #     '#a42747', '#67001f',
-    #     '#f4a582', '#a42747',
-    #     '#fddbc7', '#2166ac',
-    #     '#92c5de', '#2166ac',
-    #     '#67001f', '#f4a582',
-    #     '#fddbc7', '#fddbc7',
-    #     '#67001f', '#f4a582'
-    #     ]
-    #controls size, color and font of node labels within the graph
-    txtFont = go.sankey.Textfont(size=20)
-    linkDict = dict(source=sourceList, target=targetList, value=valueList, color=link_colors)
-    nodeDict = dict(label=labelList, pad=40, x=node_x, y=node_y,thickness=30, color=node_colors)
-    graphData = go.Sankey(arrangement='snap',link=linkDict,node=nodeDict,textfont=txtFont)
-    fig = go.Figure(data=[graphData])
-    fig.update_layout(title_text='SDNS Improves Priv. v. DNS Knowledge', font_size=20)
-    fig.show()
-    fig.write_image('figures/sdnsAlluvians/improvesPrivVDns.pdf')#todo: make this a passed in parameter rather than hard-coded
-    return
+# Write a batch of figures (given as dicts, see render_figures()) to paths through a single image export session.
+# Older plotly versions have no batch export; their (kaleido) export process is kept alive between calls anyway.
+def render_batch(figDicts, paths):
+    import plotly.io as pio
+    if hasattr(pio, 'write_images'):
+        pio.write_images(figDicts, paths)
+    else:
+        for (figDict, path) in zip(figDicts, paths):
+            pio.write_image(figDict, path)
+    return len(paths)
 
 
+# Write each figure in figures (name -> go.Figure) to outDir/<name>.<fmt> for every format in formats.
+# Rendering a figure is done through one long-lived export process rather than starting one per figure.
+# With workers > 1 the figures are split into that many batches, each rendered by its own process (and export session).
+def render_figures(figures, outDir, formats=None, workers=1):
+    formats = ['pdf'] if formats is None else formats
+    os_makedirs(outDir, exist_ok=True)
+    figDicts, paths = list(), list()
+    for (name, fig) in figures.items():
+        for fmt in formats:
+            figDicts.append(fig.to_dict())
+            paths.append(os_join(outDir, name+'.'+fmt))
+    if workers <= 1 or len(paths) <= 1:
+        return render_batch(figDicts, paths)
+    batchBounds = np.linspace(0, len(paths), min(workers, len(paths))+1).astype(int)
+    batches = [(figDicts[lo:hi], paths[lo:hi]) for (lo, hi) in zip(batchBounds[:-1], batchBounds[1:])]
+    with ProcessPoolExecutor(max_workers=len(batches)) as pool:
+        return sum(pool.map(render_batch, *zip(*batches)))
 
 
 
 
-def parse_inputs():
+def parse_inputs(args=None):
     desc = 'dns_understanding_alluvium.py: Data analysis file -constructs Alluvium plots between users\' understanding/familiarity w/DNS and their beliefs on SDNS\'s impact on their security/privacy'
     parser = argparse.ArgumentParser(description=desc)
     parser.add_argument('-f',
                         dest='fullDfFile',
                         type=str,
                         default='data/fullDataset_post_drops.csv',
-                        help='indicates the (relative or complete) filepath for the full dataset\'s DF exported as a csv (default: \'data/fullDataset_post_drops.csv\')')
+                        help='indicates the (relative or complete) filepath for the full dataset\'s DF exported as a csv, or converted to a .parquet dataset by sdns_dataset.py (default: \'data/fullDataset_post_drops.csv\')')
     parser.add_argument('-d',
                         dest='dnsCodesFile',
                         type=str,
                         default='data/Response_Coding-deidentified - Q3.3-Primary.csv',
                         help='(full or relative) filepath to csv w/open coded values for Q3.3 responses (i.e. free-text description of DNS functionality) (default: \'data/Response_Coding-deidentified - Q3.3-Primary.csv\')')
-    return parser.parse_args()
-
-
-def main():
-    params = parse_inputs()
-    mergedFrame = assemble_dataframe(params.fullDfFile, params.dnsCodesFile)
-    build_sdnsTrustworthiness_plot(mergedFrame)
-    build_sdnsSecurity_plot(mergedFrame)
-    build_sdnsPrivacy_plot(mergedFrame)
+    parser.add_argument('-b',
+                        dest='batch',
+                        action='store_true',
+                        help='Headless batch mode: only write the figures to disk without displaying them (i.e. without opening a browser).')
+    parser.add_argument('-o',
+                        dest='outDir',
+                        type=str,
+                        default='figures/sdnsAlluvians',
+                        help='Directory the figures are written to, it is created if it doesn\'t exist (default: \'figures/sdnsAlluvians\')')
+    parser.add_argument('-t',
+                        dest='formats',
+                        nargs='+',
+                        default=['pdf'],
+                        help='Image format(s) each figure is written in, e.g. -t pdf png svg (default: pdf)')
+    parser.add_argument('-w',
+                        dest='workers',
+                        type=int,
+                        default=1,
+                        help='Number of processes figures are rendered with (default: 1, i.e. all figures are rendered through a single export process)')
+    parser.add_argument('-C',
+                        dest='cacheDir',
+                        type=str,
+                        default=defaultCacheDir,
+                        help=f'Directory in which the merged data and link weights are cached, keyed by the content of the input files and the scales/code grouping used. Changing only the styling of a figure reuses them (default: {defaultCacheDir})')
+    parser.add_argument('-n',
+                        dest='noCache',
+                        action='store_true',
+                        help='Recompute everything without reading or writing the cache.')
+    add_instrumentation_arguments(parser)
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    params = parse_inputs(args)
+    configure_instrumentation(params)
+    cache = ResultCache(None if params.noCache else params.cacheDir)
+    with stage('load_merged_frame') as s:
+        mergedFrame = s.record(load_merged_frame(params.fullDfFile, params.dnsCodesFile, cache))
+    if 'dropped' in mergedFrame.attrs:
+        print(describe_dropped(mergedFrame.attrs['dropped'], {'left': 'coded response(s)', 'right': 'survey response(s)'}))
+    figures = dict()
+    for (name, plotSpec) in sdnsPlots.items():
+        (columns, scales) = (plotSpec['columns'], plotSpec['scales'])
+        linkParams = {'columns': columns, 'scales': scale_params(dict(zip(columns, scales))), 'codeKnowledgeLevels': codeKnowledgeLevels}
+        with stage(f'compute_links ({name})'):
+            links = cache.cached('dns_understanding_alluvium.compute_links', [params.fullDfFile, params.dnsCodesFile], linkParams,
+                                 compute_links, mergedFrame, columns, scales)
+        with stage(f'build_alluvium ({name})'):
+            figures[name] = build_alluvium(mergedFrame, links=links, **plotSpec)
+    if not params.batch:
+        for fig in figures.values():
+            fig.show()
+    with stage('render_figures') as s:
+        s.record(rows=render_figures(figures, params.outDir, params.formats, params.workers))
 
 
 
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Selection of the rows of several frames that share a key (e.g. ResponseId, PROLIFIC_PID), as done before
+# joining the coded responses to the survey data (see the assemble_dataframe() of the analysis scripts) and
+# the prescreen responses to the main survey (see remove_disqualified.match_participants()).
+# Keys are matched once on hashed indexes, and only the matching rows are taken from each frame:
+# masking the other rows out (where(mask).dropna(how='all')) copies the whole frame, upcasts its columns
+# (e.g. ints to floats) and has to scan it for all-NaN rows.
+# The keys that were dropped from each frame are reported, so dropped responses don't go unnoticed.
+
+import pandas as pd
+
+from functools import reduce
+
+
+# Keys present in column key of dataFrame (missing keys never match)
+def key_index(dataFrame, key):
+    return pd.Index(dataFrame[key].dropna()).unique()
+
+
+# Rows of dataFrame whose key is in keys (a pd.Index), with their dtypes and index labels.
+def select_keys(dataFrame, key, keys):
+    return dataFrame[keys.get_indexer(dataFrame[key]) >= 0]
+
+
+# Restrict each of frames (name -> DataFrame) to the rows whose key appears in all of them.
+# Returns the selected frames (name -> DataFrame) and the keys dropped from each (name -> pd.Index).
+def select_matching(frames, key):
+    keys = {name: key_index(frame, key) for (name, frame) in frames.items()}
+    matched = reduce(lambda a, b: a.intersection(b), keys.values())
+    selected = {name: select_keys(frame, key, matched) for (name, frame) in frames.items()}
+    dropped = {name: frameKeys.difference(matched) for (name, frameKeys) in keys.items()}
+    return (selected, dropped)
+
+
+# Inner join of left and right on key, where only columns of right (besides key) are included.
+# The rows of both frames are selected (see select_matching()) before they're merged, so the merge
+# only ever sees matching rows. Returns the joined frame and the keys dropped from each side
+# ({'left': pd.Index, 'right': pd.Index}); the latter are also kept in the frame's attrs['dropped']
+# (as lists, so they are kept along with cached frames).
+def join_on_key(left, right, key, columns=None):
+    if columns is not None:
+        right = right[[key]+[col for col in columns if col != key]]
+    (selected, dropped) = select_matching({'left': left, 'right': right}, key)
+    joined = selected['left'].merge(selected['right'], how='inner', on=key)
+    joined.attrs['dropped'] = {side: keys.tolist() for (side, keys) in dropped.items()}
+    return (joined, dropped)
+
+
+# One line summary of the keys dropped by join_on_key() (e.g. the attrs['dropped'] of a joined frame),
+# naming each side (e.g. {'left': 'coded response(s)', 'right': 'survey response(s)'}).
+def describe_dropped(dropped, sideNames, keyName='ResponseId'):
+    parts = [f'{len(dropped[side])} {sideNames[side]}' for side in ('left', 'right')]
+    return f'dropped {parts[0]} and {parts[1]} without a matching {keyName}'
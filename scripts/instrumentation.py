@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Stage-level instrumentation of the scripts: the main() of each script wraps its steps (reading an export,
+# matching participants, assembling the merged frame, writing figures, ...) in stage(), which records
+# the stage's wall time, the number of rows and memory usage of the frame it produced (if it records one),
+# and the resident set size of the process (current and peak) when it finishes. Stages can be nested.
+# Recording is always on and costs next to nothing; what is recorded is only reported if asked for
+# (see add_arguments()): as a table printed when the script exits (-st), as a Chrome trace
+# (-tr, open it in chrome://tracing or https://ui.perfetto.dev) and/or as cProfile statistics of
+# selected stages (-pr), written to <stage>.prof and summarized on the console.
+
+import atexit
+import cProfile
+import io
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+
+from collections import namedtuple
+from contextlib import contextmanager
+from os.path import dirname as os_dirname, join as os_join
+
+
+# start: seconds since the epoch; depth: nesting level of the stage (0 for top-level stages)
+StageRecord = namedtuple('StageRecord', ['name', 'start', 'seconds', 'depth', 'rows', 'frameBytes', 'rssBytes', 'peakRssBytes', 'pid'])
+
+records = list()
+settings = {'report': False, 'traceFile': None, 'profileStages': set(), 'profileDir': '.', 'depth': 0, 'registered': False}
+
+
+
+# Current resident set size of this process in bytes, or None if unknown (i.e. not on Linux).
+def current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*resource.getpagesize()
+    except OSError:
+        return None
+
+
+# Peak resident set size of process pid in bytes (VmHWM), or None if unknown (e.g. the process is gone, not Linux).
+# The peak of the rusage of a process (ru_maxrss) is of no use for the scripts: on Linux it carries over the peak of
+# the process it was forked from (e.g. sdns_pipeline.py), even across exec.
+def peak_rss(pid='self'):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])*1024
+    except OSError:
+        return None
+    return None
+
+
+def frame_bytes(dataFrame):
+    return int(dataFrame.memory_usage(index=True, deep=True).sum())
+
+
+# Handle of a running stage, for recording what it produced.
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.frameBytes = None
+
+    # rows: number of rows produced (defaults to the length of dataFrame). The memory usage of dataFrame
+    # (which takes a pass over its text columns) is only measured if a report or trace was asked for.
+    def record(self, dataFrame=None, rows=None):
+        self.rows = rows if rows is not None else (len(dataFrame) if dataFrame is not None else None)
+        if dataFrame is not None and is_reporting():
+            self.frameBytes = frame_bytes(dataFrame)
+        return dataFrame
+
+
+def is_reporting():
+    return settings['report'] or settings['traceFile'] is not None
+
+
+def is_profiled(name):
+    return name in settings['profileStages'] or 'all' in settings['profileStages']
+
+
+# Time the enclosed block as stage name, e.g.
+#   with stage('read_export') as s:
+#       dataFrame = s.record(read_export(...)[0])
+@contextmanager
+def stage(name):
+    handle = Stage(name)
+    profiler = cProfile.Profile() if is_profiled(name) else None
+    depth = settings['depth']
+    settings['depth'] += 1
+    start = time.time()
+    startCounter = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield handle
+    finally:
+        if profiler:
+            profiler.disable()
+        seconds = time.perf_counter()-startCounter
+        settings['depth'] = depth
+        records.append(StageRecord(name, start, seconds, depth, handle.rows, handle.frameBytes, current_rss(), peak_rss(), os.getpid()))
+        if profiler:
+            save_profile(name, profiler)
+
+
+# Record a stage that was timed elsewhere (e.g. in a worker process, see sdns_pipeline.py).
+def record_stage(name, start, seconds, rows=None, depth=0, pid=None):
+    records.append(StageRecord(name, start, seconds, depth, rows, None, None, None, pid or os.getpid()))
+
+
+def save_profile(name, profiler, numLines=15):
+    path = os_join(settings['profileDir'], ''.join(c if c.isalnum() or c in '._-' else '_' for c in name)+'.prof')
+    profiler.dump_stats(path)
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(numLines)
+    print(f'profile of stage {name!r} (written to {path}):', file=sys.stderr)
+    print(summary.getvalue(), file=sys.stderr)
+
+
+def mib(numBytes):
+    return f'{numBytes/2**20:.1f}' if numBytes is not None else '-'
+
+
+# Table of the recorded stages, in the order they started.
+def format_report(stageRecords):
+    lines = [f'{"stage":<40} {"seconds":>9} {"rows":>10} {"frame MiB":>10} {"RSS MiB":>9} {"peak MiB":>9}']
+    for r in sorted(stageRecords, key=lambda r: r.start):
+        name = '  '*r.depth+r.name
+        rows = str(r.rows) if r.rows is not None else '-'
+        lines.append(f'{name:<40} {r.seconds:>9.3f} {rows:>10} {mib(r.frameBytes):>10} {mib(r.rssBytes):>9} {mib(r.peakRssBytes):>9}')
+    return '\n'.join(lines)
+
+
+# The recorded stages as Chrome trace events: one complete ('X') event per stage and
+# a counter ('C') event of the process' memory at the end of each stage.
+def trace_events(stageRecords):
+    events = list()
+    for r in stageRecords:
+        args = {key: value for (key, value) in (('rows', r.rows), ('frameBytes', r.frameBytes)) if value is not None}
+        events.append({'name': r.name, 'cat': 'stage', 'ph': 'X', 'ts': r.start*1e6, 'dur': r.seconds*1e6,
+                       'pid': r.pid, 'tid': 0, 'args': args})
+        if r.rssBytes is not None:
+            events.append({'name': 'memory', 'ph': 'C', 'ts': (r.start+r.seconds)*1e6, 'pid': r.pid,
+                           'args': {'rss MiB': r.rssBytes/2**20, 'peak MiB': (r.peakRssBytes or 0)/2**20}})
+    return events
+
+
+def write_trace(path, stageRecords):
+    if os_dirname(path):
+        os.makedirs(os_dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': trace_events(stageRecords), 'displayTimeUnit': 'ms'}, f)
+
+
+# Report the recorded stages as configured by configure(); runs when the script exits.
+def report():
+    if settings['report'] and records:
+        print(format_report(records), file=sys.stderr)
+    if settings['traceFile']:
+        write_trace(settings['traceFile'], records)
+
+
+def add_arguments(parser):
+    parser.add_argument('-st',
+                        dest='stageReport',
+                        action='store_true',
+                        help='print the time, row count and memory usage of each stage of the script (to stderr) when it finishes')
+    parser.add_argument('-tr',
+                        dest='traceFile',
+                        type=str,
+                        default=None,
+                        help='write the stages of the script to this file as a Chrome trace (json; open in chrome://tracing or https://ui.perfetto.dev)')
+    parser.add_argument('-pr',
+                        dest='profileStages',
+                        nargs='+',
+                        default=[],
+                        help='run the given stages (or \'all\') under cProfile; the statistics are written to <stage>.prof (next to the trace, if any) and summarized on stderr')
+    return parser
+
+
+# Configure reporting from the arguments added by add_arguments(). When several scripts run in one process
+# (see sdns.py), each configures it in turn: what any of them asked for is reported once, when the process exits.
+def configure(params):
+    settings['report'] = settings['report'] or params.stageReport
+    settings['traceFile'] = params.traceFile or settings['traceFile']
+    settings['profileStages'] |= set(params.profileStages)
+    settings['profileDir'] = os_dirname(settings['traceFile']) if settings['traceFile'] and os_dirname(settings['traceFile']) else '.'
+    if not settings['registered']:
+        atexit.register(report)
+        settings['registered'] = True
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Inter-rater reliability (IRR) of the qualitative coding: agreement between the primary and the secondary coder
+# of each free-text question, computed from their coding csvs and kept in analysis/qualitative_analysis/SDNS_irr_tracking.csv.
+# Responses are matched by ResponseId (see frame_join.py); responses only one of the coders coded are left out.
+# Agreement is measured as
+#   kappa       Cohen's kappa of the primary codes (Code 1)
+#   alpha       Krippendorff's alpha (nominal) of the primary codes
+#   alphaMulti  Krippendorff's alpha of the sets of codes (Code 1..3) assigned to each response, with the
+#               MASI (default) or Jaccard distance between sets
+# each with a percentile bootstrap confidence interval (responses resampled with replacement).
+# Codes are factorized once; the confusion matrices (kappa, alpha) and the counts of each set of codes (alphaMulti)
+# of all resamples are computed together with a single bincount per chunk of (resamples x n) draws.
+
+import numpy as np
+import pandas as pd
+
+from argparse import ArgumentParser
+from collections import namedtuple
+from os.path import exists as os_exists, join as os_join
+
+from frame_join import join_on_key
+from qual_store import codeCols, read_coding
+
+
+IrrResult = namedtuple('IrrResult', ['question', 'round', 'metric', 'value', 'ciLow', 'ciHigh', 'n', 'resamples', 'confidence'])
+
+metrics = ['kappa', 'alpha', 'alphaMulti']
+
+# the free-text questions that were coded (see scrub_records.qualCols)
+codedQuestions = ['Q2.2','Q3.3','Q4.6','Q6.2','Q6.4','Q9.2','Q10.3','Q11.3','Q11.5']
+coders = ['Primary', 'Secondary']
+
+defaultPattern = 'Response_Coding-deidentified - {question}-{coder}.csv'
+defaultTrackingFile = 'analysis/qualitative_analysis/SDNS_irr_tracking.csv'
+
+# upper bound on the number of cells (resamples x n) held in memory per chunk
+maxChunkCells = 2**22
+
+
+
+# Path of the coding csv of question by coder in round (pattern may refer to {question}, {coder} and {round}).
+def coding_path(codesDir, pattern, question, coder, round):
+    return os_join(codesDir, pattern.format(question=question, coder=coder, round=round))
+
+
+# Join the codings of both coders on ResponseId: the codes of the primary coder (Code 1..3) followed by
+# those of the secondary coder (Secondary Code 1..3). Responses either coder gave no code are left out.
+# Returns the joined codings and the number of responses only coded by the primary ('left') or secondary ('right') coder.
+def join_codings(primaryFile, secondaryFile):
+    (primary, _) = read_coding(primaryFile)
+    (secondary, _) = read_coding(secondaryFile)
+    secondary = secondary.rename(columns={col: 'Secondary '+col for col in codeCols})
+    for frame in (primary, secondary):
+        frame.dropna(subset=[col for col in frame.keys() if col != 'ResponseId'], how='all', inplace=True)
+    (joined, dropped) = join_on_key(primary, secondary, 'ResponseId')
+    return (joined, {side: len(keys) for (side, keys) in dropped.items()})
+
+
+# Encode the codings of both coders against a shared dictionary of codes.
+# Returns the primary codes of each coder (int, -1 if missing) and the sets of codes each coder assigned to each
+# response (n x numCodes bool matrices), along with the dictionary.
+def encode_codings(joined):
+    primaryCols = [col for col in codeCols if col in joined]
+    secondaryCols = ['Secondary '+col for col in codeCols if 'Secondary '+col in joined]
+    dictionary = pd.Index(pd.unique(joined[primaryCols+secondaryCols].stack().dropna())).sort_values()
+    sets = list()
+    for cols in (primaryCols, secondaryCols):
+        codes = np.column_stack([dictionary.get_indexer(joined[col]) for col in cols])
+        codeSet = np.zeros((len(joined), len(dictionary)), dtype=bool)
+        (rows, slots) = np.nonzero(codes >= 0)
+        codeSet[rows, codes[rows, slots]] = True
+        sets.append(codeSet)
+    firstCodes = (dictionary.get_indexer(joined['Code 1']), dictionary.get_indexer(joined['Secondary Code 1']))
+    return (firstCodes, sets, dictionary)
+
+
+# Confusion matrices (resamples x k x k) of codes a (rows) and b (columns) of each row of idx (resamples x n
+# indices of the responses drawn). Responses with a missing code (-1) are left out.
+def confusion_matrices(a, b, k, idx):
+    (ai, bi) = (a[idx], b[idx])
+    cells = (ai*k+bi+(np.arange(len(idx))*k*k)[:, None])[(ai >= 0) & (bi >= 0)]
+    return np.bincount(cells, minlength=len(idx)*k*k).reshape(len(idx), k, k)
+
+
+# Cohen's kappa of each confusion matrix (resamples x k x k); NaN where the expected agreement is 1.
+def cohen_kappa(confusion):
+    n = confusion.sum(axis=(1, 2)).astype(float)
+    observed = np.trace(confusion, axis1=1, axis2=2)/n
+    expected = (confusion.sum(axis=2)*confusion.sum(axis=1)).sum(axis=1)/n**2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (observed-expected)/(1-expected)
+
+
+# Krippendorff's alpha (nominal, two coders) of each confusion matrix (resamples x k x k), from the coincidences
+# of the codes (the confusion matrix plus its transpose); NaN where all codes are the same.
+def nominal_alpha(confusion):
+    coincidences = confusion+confusion.transpose(0, 2, 1)
+    n = coincidences.sum(axis=(1, 2)).astype(float)
+    disagreements = n-np.trace(coincidences, axis1=1, axis2=2)
+    codeTotals = coincidences.sum(axis=2).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return 1-(n-1)*disagreements/(n**2-(codeTotals**2).sum(axis=1))
+
+
+# Distances between the sets of codes setsA and setsB (u x k and v x k bool matrices): all pairs (u x v).
+# jaccard: 1 - |A & B|/|A | B|; masi: 1 - jaccard similarity * monotonicity (1 if A == B, 2/3 if one is a
+# subset of the other, 1/3 if they otherwise overlap, 0 if they don't).
+def set_distances(setsA, setsB, distance='masi'):
+    (a, b) = (setsA.astype(np.int32), setsB.astype(np.int32))
+    shared = a @ b.T
+    (sizeA, sizeB) = (a.sum(axis=1)[:, None], b.sum(axis=1)[None, :])
+    union = sizeA+sizeB-shared
+    with np.errstate(invalid='ignore', divide='ignore'):
+        similarity = np.where(union > 0, shared/union, 1.0)
+    if distance == 'masi':
+        monotonicity = np.select([(shared == sizeA) & (shared == sizeB), shared == np.minimum(sizeA, sizeB), shared > 0], [1, 2/3, 1/3], 0)
+        similarity = similarity*monotonicity
+    elif distance != 'jaccard':
+        raise ValueError(f'unknown distance {distance!r} (jaccard or masi)')
+    return 1-similarity
+
+
+# Krippendorff's alpha (two coders, no missing values) of the sets of codes setsA and setsB (n x k bool matrices)
+# for each row of idx (resamples x n). The distinct sets are found once, so each resample only needs
+# the counts of each distinct set (one bincount) and the distances between the pairs it drew.
+def set_alpha(setsA, setsB, idx, distance='masi'):
+    (distinct, inverse) = np.unique(np.vstack([setsA, setsB]), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    (valuesA, valuesB) = (inverse[:len(setsA)], inverse[len(setsA):])
+    distances = set_distances(distinct, distinct, distance)
+    (numResamples, u) = (len(idx), len(distinct))
+    rowOffsets = (np.arange(numResamples)*u)[:, None]
+    counts = np.bincount(np.concatenate([(valuesA[idx]+rowOffsets).ravel(), (valuesB[idx]+rowOffsets).ravel()]),
+                         minlength=numResamples*u).reshape(numResamples, u).astype(float)
+    n = 2*idx.shape[1]
+    observed = distances[valuesA[idx], valuesB[idx]].mean(axis=1)
+    expected = np.einsum('ru,uv,rv->r', counts, distances, counts)/(n*(n-1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return 1-observed/expected
+
+
+# All metrics (metric -> array) for the resamples given by idx (resamples x n indices of the responses drawn).
+def irr_metrics(firstCodes, sets, numCodes, idx, distance='masi'):
+    confusion = confusion_matrices(firstCodes[0], firstCodes[1], numCodes, idx)
+    return {'kappa': cohen_kappa(confusion), 'alpha': nominal_alpha(confusion), 'alphaMulti': set_alpha(sets[0], sets[1], idx, distance)}
+
+
+# IRR of the codings in primaryFile and secondaryFile (see join_codings()): each metric with a percentile
+# bootstrap confidence interval from `resamples` resamples. Returns the IrrResults (metric -> IrrResult)
+# and the number of responses only coded by either coder.
+def compute_irr(primaryFile, secondaryFile, question=None, round=None, resamples=1000, confidence=0.95, seed=None, distance='masi'):
+    (joined, dropped) = join_codings(primaryFile, secondaryFile)
+    (firstCodes, sets, dictionary) = encode_codings(joined)
+    n = len(joined)
+    values = irr_metrics(firstCodes, sets, len(dictionary), np.arange(n)[None, :], distance) if n else {metric: [np.nan] for metric in metrics}
+    boot = {metric: list() for metric in metrics}
+    if n > 1 and resamples > 0:
+        rng = np.random.default_rng(seed)
+        chunkSize = max(1, maxChunkCells // n)
+        for start in range(0, resamples, chunkSize):
+            idx = rng.integers(0, n, size=(min(chunkSize, resamples-start), n))
+            for (metric, chunkValues) in irr_metrics(firstCodes, sets, len(dictionary), idx, distance).items():
+                boot[metric].append(chunkValues)
+    tail = (1-confidence)/2
+    results = dict()
+    for metric in metrics:
+        bootValues = np.concatenate(boot[metric]) if boot[metric] else np.array([np.nan])
+        (ciLow, ciHigh) = np.nanquantile(bootValues, [tail, 1-tail]) if not np.isnan(bootValues).all() else (np.nan, np.nan)
+        results[metric] = IrrResult(question, round, metric, float(values[metric][0]), float(ciLow), float(ciHigh), n,
+                                    resamples if boot[metric] else 0, confidence)
+    return (results, dropped)
+
+
+# IRR values are entered with (at most) two decimals, e.g. 0.87 or 1
+def format_irr(value):
+    return f'{value:.2f}'.rstrip('0').rstrip('.') if not np.isnan(value) else ''
+
+
+# The IRR tracking table (Question, Primary, Secondary, IRR Round 1, IRR Round 2, ...) as text, with a row for each
+# of questions (existing rows are kept, in their order).
+def read_tracking(path, questions, numRounds=1):
+    if os_exists(path):
+        table = pd.read_csv(path, dtype=str, keep_default_na=False)
+    else:
+        table = pd.DataFrame(columns=['Question']+coders)
+    for round in range(1, numRounds+1):
+        if f'IRR Round {round}' not in table:
+            table[f'IRR Round {round}'] = ''
+    missing = [question for question in questions if question not in set(table['Question'])]
+    if missing:
+        table = pd.concat([table, pd.DataFrame({'Question': missing})], ignore_index=True).fillna('')
+    return table.set_index('Question', drop=False)
+
+
+# Compute the IRR of every question and round whose codings by both coders exist and enter metric into the tracking table
+# (the status of a coder is set to 'Done' once their coding exists). Cells of codings that don't exist are left as they are.
+# Returns the updated table and all IrrResults.
+def update_tracking(table, codesDir, pattern, questions, rounds, metric='kappa', resamples=1000, confidence=0.95, seed=None, distance='masi'):
+    results = list()
+    for question in questions:
+        for round in rounds:
+            paths = {coder: coding_path(codesDir, pattern, question, coder, round) for coder in coders}
+            for coder in coders:
+                if os_exists(paths[coder]):
+                    table.loc[question, coder] = 'Done'
+            if not all(os_exists(path) for path in paths.values()):
+                print(f'{question} (round {round}): no coding by {" or ".join(coder for coder in coders if not os_exists(paths[coder]))}')
+                continue
+            (questionResults, dropped) = compute_irr(paths['Primary'], paths['Secondary'], question, round, resamples, confidence, seed, distance)
+            if dropped['left'] or dropped['right']:
+                print(f'{question} (round {round}): left out {dropped["left"]} response(s) only coded by the primary and {dropped["right"]} only coded by the secondary coder')
+            table.loc[question, f'IRR Round {round}'] = format_irr(questionResults[metric].value)
+            results.extend(questionResults.values())
+    return (table.reset_index(drop=True), results)
+
+
+def results_frame(results):
+    return pd.DataFrame(results, columns=IrrResult._fields)
+
+
+
+
+def parse_inputs(args=None):
+    desc = 'irr.py: computes the inter-rater reliability (Cohen\'s kappa, Krippendorff\'s alpha of the primary codes and of the sets of codes) of the primary and secondary coding of each free-text question, with bootstrap confidence intervals, and enters it into the IRR tracking table.'
+    parser = ArgumentParser(description=desc)
+    parser.add_argument('-d',
+                        dest='codesDir',
+                        type=str,
+                        default='data',
+                        help='directory of the coding csvs (default: data)')
+    parser.add_argument('-p',
+                        dest='pattern',
+                        type=str,
+                        default=defaultPattern,
+                        help=f'file name of the coding csvs, in terms of {{question}}, {{coder}} (Primary or Secondary) and {{round}} (default: \'{defaultPattern}\')')
+    parser.add_argument('-q',
+                        dest='questions',
+                        nargs='+',
+                        default=codedQuestions,
+                        help=f'questions to compute the IRR of (default: {" ".join(codedQuestions)})')
+    parser.add_argument('-r',
+                        dest='rounds',
+                        type=int,
+                        nargs='+',
+                        default=[1],
+                        help='round(s) of coding the codings belong to, e.g. -r 1 2 with a pattern containing {round} (default: 1)')
+    parser.add_argument('-t',
+                        dest='trackingFile',
+                        type=str,
+                        default=defaultTrackingFile,
+                        help=f'IRR tracking table to update (default: {defaultTrackingFile})')
+    parser.add_argument('-m',
+                        dest='metric',
+                        choices=metrics,
+                        default='kappa',
+                        help='metric entered into the tracking table (default: kappa)')
+    parser.add_argument('-D',
+                        dest='distance',
+                        choices=['masi', 'jaccard'],
+                        default='masi',
+                        help='distance between sets of codes for alphaMulti (default: masi)')
+    parser.add_argument('-b',
+                        dest='resamples',
+                        type=int,
+                        default=1000,
+                        help='number of bootstrap resamples for the confidence intervals (default: 1000)')
+    parser.add_argument('-c',
+                        dest='confidence',
+                        type=float,
+                        default=0.95,
+                        help='confidence level of the bootstrap confidence intervals (default: 0.95)')
+    parser.add_argument('-s',
+                        dest='seed',
+                        type=int,
+                        default=0,
+                        help='seed for the bootstrap resampling (default: 0)')
+    parser.add_argument('-o',
+                        dest='outfile',
+                        type=str,
+                        default=None,
+                        help='if specified, write all metrics and their confidence intervals to this csv')
+    parser.add_argument('-n',
+                        dest='dryRun',
+                        action='store_true',
+                        help='only print the results, without updating the tracking table')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    params = parse_inputs(args)
+    table = read_tracking(params.trackingFile, params.questions, max(params.rounds))
+    (table, results) = update_tracking(table, params.codesDir, params.pattern, params.questions, params.rounds, params.metric,
+                                       params.resamples, params.confidence, params.seed, params.distance)
+    report = results_frame(results)
+    if not report.empty:
+        print(report.to_string(index=False))
+    if params.outfile:
+        report.to_csv(params.outfile, index=False)
+    if not params.dryRun:
+        table.to_csv(params.trackingFile, index=False)
+
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Shared definitions of the answer scales used in the survey, and vectorized encoding of whole columns onto them.
+# Each scale is declared once as an ordered pd.CategoricalDtype. Encoding a column is a single
+# astype() (i.e. a hash lookup in C per cell rather than a python function call per cell),
+# and the category codes give the position of each answer within its scale.
+
+import pandas as pd, numpy as np
+
+
+# Agree/Disagree - 7 point Likert, e.g. ' ', ' .1', Q4.5
+agreeScale = pd.CategoricalDtype([
+        'Strongly agree', 'Agree',
+        'Somewhat agree', 'Neither agree nor disagree',
+        'Somewhat disagree', 'Disagree',
+        'Strongly disagree'
+        ], ordered=True)
+
+# Trustworthy/Untrustworthy - 5 point Likert, Q9.1
+trustScale = pd.CategoricalDtype([
+        'Very trustworthy', 'Slightly trustworthy',
+        'Neither trustworthy nor untrustworthy',
+        'Slightly untrustworthy', 'Very untrustworthy'
+        ], ordered=True)
+
+# Q3.1: How familiar are you with the Domain Name System (DNS)?
+familiarityScale = pd.CategoricalDtype([
+        'Extremely familiar', 'Very familiar',
+        'Moderately familiar', 'Slightly familiar',
+        'Not familiar at all'
+        ], ordered=True)
+
+# Q3.2: Do you know how the Domain Name System (DNS) works? (self-rated DNS knowledge, least to most)
+dnsKnowledgeScale = pd.CategoricalDtype([
+        'I definitely do not know', 'I\'m not sure I know',
+        'I somewhat know', 'I definitely know'
+        ], ordered=True)
+
+# Level of understanding of DNS denoted by the codes assigned to Q3.3 (least to most)
+knowledgeLevelScale = pd.CategoricalDtype(['Low', 'Medium', 'Med-High', 'High'], ordered=True)
+
+# group assigned codes by level of familiarity with/understanding of DNS they (roughly) denote.
+# Responses without a code are treated as 'Low' (see simplify_codes()).
+codeKnowledgeLevels = {
+        'sdns': 'Low', 'protocol_unclear': 'Low',
+        'don\'t_know': 'Low', 'identifies_pc_by_ip': 'Low',
+        'missing_details': 'Low',
+        'navigation_to_website': 'Medium', 'maps_website_to_Internet_name': 'Medium',
+        'maps_ip_to_domain': 'Medium', 'translates_domains_for_browsers': 'Medium',
+        'maps_website_to_ip': 'Med-High',
+        'maps_domain_to_ip': 'High', 'query_dns_server': 'High',
+        'query_recursive_dns': 'High'
+        }
+
+# Scales declared (as they are presented in the survey and drawn in the figures) from the most to the least positive
+# answer. All other scales run from the least to the most (knowledge). Rank correlations are computed on scales running
+# from the least to the most positive answer (see ascending_scale()), so the sign of a correlation means the same for
+# every pair of items.
+descendingScales = (agreeScale, trustScale, familiarityScale)
+
+# Likert columns of the full dataset and the scale each one is answered on.
+# ' ': Smart DNS provides additional security when browsing the internet.
+# ' .1': Smart DNS provides additional privacy when browsing the internet.
+# Q4.5: Using Smart DNS is a risk to my security and privacy.
+# Q9.1: How trustworthy do you find these services overall?
+likertScales = {
+        ' ': agreeScale, ' .1': agreeScale, 'Q4.5': agreeScale,
+        'Q9.1': trustScale,
+        'Q3.1': familiarityScale, 'Q3.2': dnsKnowledgeScale
+        }
+
+
+
+# scale ordered from its least to its most positive answer (i.e. reversed if it's one of descendingScales).
+def ascending_scale(scale):
+    if any(scale == descending for descending in descendingScales):
+        return pd.CategoricalDtype(list(scale.categories)[::-1], ordered=True)
+    return scale
+
+
+# Encode col onto scale as an ordered categorical. Values that are not part of the scale become NaN.
+def encode_column(col, scale):
+    return col.astype(scale)
+
+
+# Position (0-based) of each answer in col within scale, -1 for missing values.
+def encode_codes(col, scale):
+    return encode_column(col, scale).cat.codes.to_numpy()
+
+
+# 1-based ranks of each answer in col within scale (NaN for missing values), i.e. a numeric version of the
+# column that is suitable for rank correlation.
+def rank_values(col, scale):
+    codes = encode_codes(col, scale).astype(float)
+    codes[codes < 0] = np.nan
+    return pd.Series(codes + 1, index=col.index, name=col.name)
+
+
+# Apply rank_values() to each col in scales (col -> scale), returning a numeric frame.
+def encode_ranks(dataFrame, scales):
+    return pd.DataFrame({col: rank_values(dataFrame[col], scale) for (col, scale) in scales.items()})
+
+
+# Map the codes assigned to Q3.3 (e.g. 'Code 1') to the level of DNS knowledge they denote (see codeKnowledgeLevels).
+# Uncoded responses are 'Low', codes that aren't part of codeKnowledgeLevels become NaN.
+def simplify_codes(codeCol):
+    levels = codeCol.map(codeKnowledgeLevels).astype(knowledgeLevelScale)
+    levels[codeCol.isna()] = 'Low'
+    return levels
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Counting engine for select-all-that-apply (multi-select) columns, e.g. Q6.3, Q7.3, Q7.4, Q9.
+# Qualtrics exports the options a participant selected as one comma-separated cell. Each distinct cell value
+# is tokenized once and the column is turned into a sparse indicator matrix (respondent x option),
+# from which all distributions are computed with a few matrix operations.
+# Tokenizing against the question's answer options (see qsf_schema.py) keeps options that contain commas
+# themselves (e.g. 'Congo, Republic of the...') in one piece; text that isn't a known option is split on commas.
+
+import re
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from collections import namedtuple
+
+
+# matrix: sparse (csr) indicator matrix, one row per respondent in index and one column per option in options.
+# answered: whether the respondent selected anything at all (i.e. the cell wasn't empty).
+MultiSelect = namedtuple('MultiSelect', ['matrix', 'options', 'index', 'answered', 'name'])
+
+
+
+# Regex matching any of options as a whole selection (i.e. followed by a comma or the end of the cell).
+# Longer options are tried first, so an option that is a prefix of another one doesn't cut it short.
+def option_pattern(options):
+    if not options:
+        return None
+    alternatives = '|'.join(re.escape(option) for option in sorted(set(options), key=len, reverse=True))
+    return re.compile(f'({alternatives})(?=,|$)')
+
+
+# Split a multi-select cell into the selected options.
+def split_selections(value, pattern=None):
+    if pattern is None:
+        return value.split(',')
+    selections = list()
+    pos = 0
+    while pos <= len(value):
+        match = pattern.match(value, pos)
+        if match:
+            end = match.end()
+        else:
+            end = value.find(',', pos)
+            end = len(value) if end < 0 else end
+        selections.append(value[pos:end])
+        pos = end+1
+    return selections
+
+
+def unique_options(options):
+    return list(dict.fromkeys(options or []))
+
+
+# Build the indicator matrix of col. options (e.g. the question's choices from its schema) fixes the order of
+# the first columns of the matrix; other selections (e.g. carried forward choices) are added in order of appearance.
+def indicator_matrix(col, options=None):
+    pattern = option_pattern(options)
+    (codes, uniques) = pd.factorize(col, use_na_sentinel=True)
+    optionIds = {option: i for (i, option) in enumerate(unique_options(options))}
+    (rows, cols) = (list(), list())
+    for (u, value) in enumerate(uniques):
+        for selection in dict.fromkeys(split_selections(value, pattern)):
+            rows.append(u)
+            cols.append(optionIds.setdefault(selection, len(optionIds)))
+    # empty cells (NaN) all map to an extra all-zero row
+    uniqueMatrix = sp.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                                 shape=(len(uniques)+1, len(optionIds)))
+    answered = codes >= 0
+    codes[~answered] = len(uniques)
+    return MultiSelect(uniqueMatrix[codes], list(optionIds), col.index, answered, col.name)
+
+
+# Number of options selected by each respondent (0 if the cell was empty).
+def selection_sizes(multiSelect):
+    return np.asarray(multiSelect.matrix.sum(axis=1)).ravel()
+
+
+def to_counts(counts, labels, name, normalize=False):
+    dist = pd.Series(counts, index=pd.Index(labels, name=name), name='count')
+    dist = dist[dist > 0].sort_values(ascending=False, kind='stable')
+    if normalize:
+        dist = (dist/dist.sum()).rename('proportion')
+    return dist
+
+
+# How often each option was selected, most frequent first.
+# normalize: share of all selections (as explode().value_counts(normalize=True) would give).
+def option_counts(multiSelect, normalize=False, rows=None):
+    matrix = multiSelect.matrix if rows is None else multiSelect.matrix[rows]
+    counts = np.asarray(matrix.sum(axis=0)).ravel()
+    return to_counts(counts, multiSelect.options, multiSelect.name, normalize)
+
+
+# How many respondents selected 1, 2, ... options (respondents who didn't answer are left out).
+def size_counts(multiSelect, normalize=False):
+    sizes = selection_sizes(multiSelect)[multiSelect.answered]
+    return pd.Series(sizes, name=multiSelect.name).value_counts(normalize=normalize)
+
+
+# option_counts() among the respondents that selected exactly i options, for i = 1..max (size -> counts).
+def option_counts_by_size(multiSelect):
+    sizes = selection_sizes(multiSelect)
+    maxSize = sizes.max() if len(sizes) else 0
+    return {i: option_counts(multiSelect, rows=np.flatnonzero(sizes == i)) for i in range(1, int(maxSize)+1)}
+
+
+# Option x option matrix of how many respondents selected both (the diagonal holds option_counts()).
+def cooccurrence(multiSelect):
+    matrix = multiSelect.matrix
+    counts = (matrix.T @ matrix).toarray()
+    return pd.DataFrame(counts, index=multiSelect.options, columns=multiSelect.options)
+
+
+# All distributions of a multi-select column at once.
+def select_many_stats(col, options=None):
+    multiSelect = indicator_matrix(col, options)
+    ret = {
+            'optionCounts': option_counts(multiSelect),
+            'optionCountsNorm': option_counts(multiSelect, normalize=True),
+            'sizeCounts': size_counts(multiSelect),
+            'sizeCountsNorm': size_counts(multiSelect, normalize=True),
+            'optionCountsBySize': option_counts_by_size(multiSelect),
+            'cooccurrence': cooccurrence(multiSelect)
+            }
+    return ret
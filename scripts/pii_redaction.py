@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Redaction of personal information pasted into free-text answers (e.g. Q2.2, Q3.3, Q4.6, Q9.2, Q9_15_TEXT):
+# email addresses, URLs, IPv4/IPv6 (e.g. resolver) addresses, phone numbers and Prolific-ID-like tokens.
+# Each kind of PII has a compiled pattern and a cheap check whether a text can contain it at all (see piiGuards),
+# and each match is replaced by a placeholder naming its kind (e.g. '[EMAIL]'). The checks are done for all texts of a chunk
+# at once on their bytes, so the per-text cost is that of the patterns that can match.
+# Large frames are split into chunks that are redacted in parallel by a pool of processes.
+
+import re
+import numpy as np
+import pandas as pd
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from math import ceil
+
+
+# Kinds of PII, in the order they're redacted (i.e. a URL containing an IP address is redacted as a URL).
+# IPv6 addresses that are compressed ('::') need a group on either side or two on one side, so a bare '::' (or 'add::')
+# isn't taken for one. Phone numbers need a country code ('+...'), an area code and two more groups, or a separator
+# within a 7-digit local number ('555-0123'), so that pairs of years ('2019 2020', '2019-2020') aren't taken for one.
+piiPatterns = {
+        'URL': r'(?:https?://|www\.)[^\s<>"\'\x00]+',
+        'EMAIL': r'(?<![A-Za-z0-9._%+-])[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}',
+        'PROLIFIC_ID': r'(?<![0-9A-Za-z])[0-9a-f]{24}(?![0-9A-Za-z])',
+        'IPV6': r'(?<![\w:])(?:(?:[0-9A-Fa-f]{1,4}:){7}[0-9A-Fa-f]{1,4}'
+                r'|(?:[0-9A-Fa-f]{1,4}:){1,6}(?::[0-9A-Fa-f]{1,4}){1,6}'
+                r'|(?:[0-9A-Fa-f]{1,4}:){2,7}:|::(?:[0-9A-Fa-f]{1,4}:){1,6}[0-9A-Fa-f]{1,4})(?![\w:])',
+        'IPV4': r'(?<![\d.])(?:(?:25[0-5]|2[0-4]\d|1?\d?\d)\.){3}(?:25[0-5]|2[0-4]\d|1?\d?\d)(?!\.?\d)',
+        'PHONE': r'(?<![\w+])(?:\+\d{1,3}(?:[\s.-]?(?:\(\d{1,4}\)|\d{1,4})){3,6}'
+                 r'|(?:\(\d{2,4}\)[\s.-]?|\d{2,4}[\s.-])\d{3}[\s.-]\d{4}|\d{3}[.-]\d{4}|\d{10,11})(?!\w)'
+        }
+
+# Classes of bytes (of UTF-8 encoded text) the guards look for, as ranges of characters (see piiGuards).
+(digit, hexLower, hexDigit) = ((('0', '9'),), (('0', '9'), ('a', 'f')), (('0', '9'), ('a', 'f'), ('A', 'F')))
+(colon, slash, dot, at, plus, www) = (((c, c),) for c in ':/.@+w')
+
+# Cheap necessary conditions for a text to contain each kind of PII: a text can only contain it if it contains one of
+# the kind's sequences of bytes (classes). The sequences are looked for in all texts of a chunk at once (see guarded_texts()),
+# so most patterns never run on most texts. Patterns are matched with ASCII digits only, as the guards look for them.
+piiGuards = {
+        'URL': [[colon, slash, slash], [www, www, www, dot]],
+        'EMAIL': [[at]],
+        'PROLIFIC_ID': [[hexLower]*24],
+        'IPV6': [[colon, colon], [hexDigit, colon, hexDigit]],
+        'IPV4': [[digit, dot, digit]],
+        'PHONE': [[digit]*3, [plus, digit]]
+        }
+
+piiMatchers = [(kind, re.compile(pattern, re.ASCII)) for (kind, pattern) in piiPatterns.items()]
+
+# free-text columns of the surveys (see survey_instruments/) that aren't *_TEXT columns, i.e. the open questions
+# (see scrub_records.qualCols) and Q16 of the Reddit survey
+freeTextCols = ['Q2.2','Q3.3','Q4.6','Q6.2','Q6.4','Q9.2','Q10.3','Q11.3','Q11.5','Q16']
+
+# most rows per chunk handed to a worker process
+defaultChunkSize = 2**14
+# tasks per worker and column (see task_size())
+tasksPerWorker = 4
+
+
+
+# Which bytes of data are in byteClass, computed once per class (classFlags: byteClass -> flags).
+def class_flags(data, byteClass, classFlags):
+    if byteClass not in classFlags:
+        flags = np.zeros(len(data), dtype=bool)
+        for (first, last) in byteClass:
+            flags |= (data == ord(first)) if first == last else (data >= ord(first)) & (data <= ord(last))
+        classFlags[byteClass] = flags
+    return classFlags[byteClass]
+
+
+# Positions in data at which a sequence of bytes of the given classes starts.
+def sequence_starts(data, byteClasses, classFlags):
+    n = len(data)-len(byteClasses)+1
+    if n <= 0:
+        return np.empty(0, dtype=np.intp)
+    starts = np.ones(n, dtype=bool)
+    for (i, byteClass) in enumerate(byteClasses):
+        starts &= class_flags(data, byteClass, classFlags)[i:i+n]
+    return np.flatnonzero(starts)
+
+
+# Indices of the texts that pass the guard of each kind (kind -> indices).
+# The texts are joined by NUL, which none of the sequences contain, so a sequence never spans two texts.
+def guarded_texts(texts):
+    data = np.frombuffer('\x00'.join(texts).encode('utf8', 'surrogatepass'), dtype=np.uint8)
+    ends = np.flatnonzero(data == 0)
+    if len(ends) != len(texts)-1:
+        # some text contains NUL itself, so all of them are checked
+        return {kind: range(len(texts)) for kind in piiGuards}
+    classFlags = dict()
+    return {kind: np.unique(np.searchsorted(ends, np.concatenate([sequence_starts(data, sequence, classFlags)
+                                                                  for sequence in sequences])))
+            for (kind, sequences) in piiGuards.items()}
+
+
+# Redact a list of cells (non-str cells, i.e. missing answers, are left as they are).
+# Each distinct text is redacted once. Returns the redacted cells and the number of matches of each kind.
+# Placeholders contain no digits or any of '@:.', so they're never matched by a later pattern.
+def redact_values(values):
+    counts = Counter()
+    occurrences = Counter(value for value in values if isinstance(value, str))
+    texts = list(occurrences)
+    redacted = list(texts)
+    guarded = guarded_texts(texts)
+    for (kind, matcher) in piiMatchers:
+        for i in guarded[kind]:
+            (text, n) = matcher.subn(f'[{kind}]', redacted[i])
+            if n:
+                redacted[i] = text
+                counts[kind] += n*occurrences[texts[i]]
+    redacted = dict(zip(texts, redacted))
+    return ([redacted[value] if isinstance(value, str) else value for value in values], counts)
+
+
+# Redact a single text, counting the matches of each kind in counts.
+def redact_text(text, counts):
+    ([text], textCounts) = redact_values([text])
+    counts.update(textCounts)
+    return text
+
+
+# Free-text columns of dataFrame: the open questions and the 'Other (please specify)' text entries, along with
+# any other columns of kind 'text' if a schema (see qsf_schema.py) is given. For the surveys of the study the schema
+# adds none, so the same columns are redacted with or without it.
+def free_text_columns(dataFrame, schema=None):
+    textCols = {col['name'] for col in schema['columns'] if col['kind'] == 'text'} if schema else set()
+    return [col for col in dataFrame.keys() if col in freeTextCols or col.endswith('_TEXT') or col in textCols]
+
+
+# Number of values of a task of pool (see make_pool()) for columns of numValues values: each worker gets about
+# tasksPerWorker tasks per column, so even the short columns of a chunk of the export keep all workers busy.
+def task_size(numValues, pool):
+    if not pool:
+        return defaultChunkSize
+    return min(defaultChunkSize, max(1, ceil(numValues / (pool.workers * tasksPerWorker))))
+
+
+# Redact columns of dataFrame (in place), with the chunks of the columns processed by pool if given: the chunks of all
+# columns are submitted before the results are collected. chunkSize: values per chunk (default: see task_size()).
+# Returns the number of redactions per column and kind (col -> Counter).
+def redact_frame(dataFrame, columns, pool=None, chunkSize=None):
+    chunkSize = chunkSize or task_size(len(dataFrame), pool)
+    results = dict()
+    for col in columns:
+        values = dataFrame[col].tolist()
+        chunks = [values[i:i+chunkSize] for i in range(0, len(values), chunkSize)]
+        results[col] = [pool.submit(redact_values, chunk) for chunk in chunks] if pool else map(redact_values, chunks)
+    redactions = dict()
+    for (col, colResults) in results.items():
+        (redacted, counts) = (list(), Counter())
+        for result in colResults:
+            (chunkValues, chunkCounts) = result.result() if pool else result
+            redacted.extend(chunkValues)
+            counts.update(chunkCounts)
+        dataFrame[col] = pd.Series(redacted, index=dataFrame.index, dtype=dataFrame[col].dtype)
+        redactions[col] = counts
+    return (dataFrame, redactions)
+
+
+# Add the redaction counts of a chunk to those of the previous ones.
+def merge_redactions(redactions, chunkRedactions):
+    for (col, counts) in chunkRedactions.items():
+        redactions.setdefault(col, Counter()).update(counts)
+    return redactions
+
+
+def print_redactions(redactions):
+    for (col, counts) in redactions.items():
+        if counts:
+            print(f'{col!r}: redacted {", ".join(f"{n} {kind}" for (kind, n) in counts.most_common())}')
+
+
+# Process pool knowing its number of workers (see task_size()).
+class RedactionPool(ProcessPoolExecutor):
+    def __init__(self, workers):
+        super().__init__(max_workers=workers)
+        self.workers = workers
+
+
+# Pool for redact_frame(), to be used as a context manager (which shuts the pool down):
+# with make_pool(workers) as pool: ... The pool is None if workers is 1 (i.e. redact in this process).
+def make_pool(workers):
+    return RedactionPool(workers) if workers > 1 else nullcontext(None)
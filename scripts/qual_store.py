@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Storage for the free-text (qualitative) answers, keyed by ResponseId, so that the analysis scripts can work on the
+# (compact, typed) quantitative data and only fetch the text of the responses they need, e.g. for coding and review.
+# A store is a directory holding:
+#   text.bin       the UTF-8 text of all cells (ResponseIds included), back to back
+#   index.bin      per response (row) the (start, end) byte offsets into text.bin of its ResponseId and its answer
+#                  to each question (int64, -1 for missing answers)
+#   manifest.json  the questions (columns) of the store, the number of rows and text bytes written, and the coding tables
+#   codes_<name>.ids.npy, codes_<name>.codes.npy
+#                  a coding of the responses to one question (e.g. the Primary coding of Q3.3, see import_codes()):
+#                  the coded ResponseIds and the codes (Code 1..3), dictionary-encoded as int16 (-1: no code)
+#                  against the code dictionary kept in the manifest
+# Both text.bin and index.bin are memory-mapped when read, so opening a store doesn't load any text,
+# and rows are only ever appended (see QualStoreWriter), i.e. chunked and incremental runs extend a store in place.
+# The manifest is replaced after the rows are written, so a store that was interrupted while being written keeps
+# the rows of its last complete write.
+
+import json
+import mmap
+import os
+import numpy as np
+import pandas as pd
+
+from argparse import ArgumentParser
+from os import makedirs as os_makedirs, replace as os_replace
+from os.path import exists as os_exists, join as os_join
+
+
+manifestVersion = 1
+codeCols = ['Code 1','Code 2','Code 3']
+
+
+
+def manifest_path(path):
+    return os_join(path, 'manifest.json')
+
+
+def is_store(path):
+    return os_exists(manifest_path(path))
+
+
+def read_manifest(path):
+    with open(manifest_path(path)) as f:
+        return json.load(f)
+
+
+def write_manifest(path, manifest):
+    tmpPath = f'{manifest_path(path)}.{os.getpid()}.tmp'
+    with open(tmpPath, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os_replace(tmpPath, manifest_path(path))
+
+
+# Encode cells (a list) as UTF-8; returns the encoded cells (b'' for missing ones) and their lengths (-1 for missing ones).
+def encode_cells(values):
+    encoded = [value.encode('utf8') if isinstance(value, str) else b'' for value in values]
+    lengths = np.fromiter((len(e) if isinstance(v, str) else -1 for (e, v) in zip(encoded, values)), dtype=np.int64, count=len(values))
+    return (encoded, lengths)
+
+
+# Appends the ResponseIds and free-text answers of frames to the store at path (creating it, or starting it
+# from scratch if append is False). columns: the questions of the store; columns missing from a frame
+# are stored as missing answers (e.g. prescreen and main survey responses kept in one store).
+class QualStoreWriter:
+    def __init__(self, path, columns, append=False):
+        os_makedirs(path, exist_ok=True)
+        self.path = path
+        if append and is_store(path):
+            self.manifest = read_manifest(path)
+            if self.manifest['columns'] != list(columns):
+                raise ValueError(f'{path}: store has columns {self.manifest["columns"]}, not {list(columns)}')
+        else:
+            # codings are kept by ResponseId, so they stay valid when the text is rewritten
+            codes = read_manifest(path)['codes'] if is_store(path) else dict()
+            self.manifest = {'version': manifestVersion, 'columns': list(columns), 'rows': 0, 'textBytes': 0, 'codes': codes}
+        self.columns = self.manifest['columns']
+        # drop whatever was written past the manifest (i.e. by an interrupted write)
+        self.textFile = open(os_join(path, 'text.bin'), 'ab' if append else 'wb')
+        self.textFile.truncate(self.manifest['textBytes'])
+        self.indexFile = open(os_join(path, 'index.bin'), 'ab' if append else 'wb')
+        self.indexFile.truncate(self.manifest['rows']*self.row_width()*8)
+        if not append:
+            write_manifest(path, self.manifest)
+
+    def row_width(self):
+        return 2*(1+len(self.columns))
+
+    def write(self, dataFrame):
+        cells = [dataFrame['ResponseId'].tolist()]
+        cells += [dataFrame[col].tolist() if col in dataFrame else [None]*len(dataFrame) for col in self.columns]
+        encoded = [encode_cells(values) for values in cells]
+        # lengths of the cells in the order they're written, i.e. row by row
+        lengths = np.column_stack([cellLengths for (_, cellLengths) in encoded])
+        ends = self.manifest['textBytes']+np.cumsum(np.maximum(lengths, 0).ravel()).reshape(lengths.shape)
+        starts = ends-np.maximum(lengths, 0)
+        offsets = np.empty((len(dataFrame), self.row_width()), dtype=np.int64)
+        offsets[:, 0::2] = np.where(lengths >= 0, starts, -1)
+        offsets[:, 1::2] = np.where(lengths >= 0, ends, -1)
+        self.textFile.write(b''.join(cell for row in zip(*(cellBytes for (cellBytes, _) in encoded)) for cell in row))
+        self.indexFile.write(offsets.tobytes())
+        self.manifest['rows'] += len(dataFrame)
+        self.manifest['textBytes'] = int(ends[-1, -1]) if len(dataFrame) else self.manifest['textBytes']
+        return self
+
+    def close(self):
+        self.textFile.close()
+        self.indexFile.close()
+        write_manifest(self.path, self.manifest)
+
+
+# Write (append is False) or append the free-text answers in dataFrame to the store at path.
+def write_store(dataFrame, path, columns, append=False):
+    writer = QualStoreWriter(path, columns, append)
+    writer.write(dataFrame)
+    writer.close()
+
+
+# Read access to a store. Nothing is read up front: the text and offsets are memory-mapped,
+# and the ResponseId index is only built when a response is first looked up by its id.
+class QualStore:
+    def __init__(self, path):
+        self.path = path
+        self.manifest = read_manifest(path)
+        if self.manifest['version'] > manifestVersion:
+            raise ValueError(f'{path}: unsupported store version {self.manifest["version"]}')
+        self.columns = self.manifest['columns']
+        width = 2*(1+len(self.columns))
+        rows = self.manifest['rows']
+        self.offsets = np.memmap(os_join(path, 'index.bin'), dtype=np.int64, mode='r', shape=(rows, width)) if rows else np.empty((0, width), dtype=np.int64)
+        self.text = b''
+        if self.manifest['textBytes']:
+            with open(os_join(path, 'text.bin'), 'rb') as f:
+                self.text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._ids = None
+        self._lookup = None
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    # Cells of column colIndex (0: ResponseId, i: the i-th question) of rows (-1: missing row), None where missing.
+    def cells(self, rows, colIndex):
+        rows = np.asarray(rows)
+        valid = rows >= 0
+        starts = np.full(len(rows), -1, dtype=np.int64)
+        ends = np.full(len(rows), -1, dtype=np.int64)
+        starts[valid] = self.offsets[rows[valid], 2*colIndex]
+        ends[valid] = self.offsets[rows[valid], 2*colIndex+1]
+        text = self.text
+        return [text[start:end].decode('utf8') if start >= 0 else None for (start, end) in zip(starts.tolist(), ends.tolist())]
+
+    # ResponseIds of the rows of the store (pd.Index, in the order they were written)
+    @property
+    def ids(self):
+        if self._ids is None:
+            self._ids = pd.Index(self.cells(np.arange(len(self)), 0), name='ResponseId')
+        return self._ids
+
+    # Rows of responseIds (-1 for ids that aren't in the store); if a response was written more than once
+    # (e.g. re-ingested), its last row.
+    def rows(self, responseIds):
+        if self._lookup is None:
+            lastRows = np.flatnonzero(~self.ids.duplicated(keep='last'))
+            self._lookup = (self.ids[lastRows], lastRows)
+        (uniqueIds, lastRows) = self._lookup
+        found = uniqueIds.get_indexer(responseIds)
+        return np.where(found >= 0, lastRows[found], -1)
+
+    # Answer of responseId to question col (None if the answer or the response is missing)
+    def get(self, responseId, col):
+        return self.cells(self.rows([responseId]), 1+self.columns.index(col))[0]
+
+    # Answers of responseIds (default: all responses) to question col, as a Series indexed by ResponseId.
+    def texts(self, col, responseIds=None):
+        colIndex = 1+self.columns.index(col)
+        if responseIds is None:
+            (responseIds, rows) = (self.ids, np.arange(len(self)))
+        else:
+            (responseIds, rows) = (pd.Index(responseIds, name='ResponseId'), self.rows(responseIds))
+        return pd.Series(self.cells(rows, colIndex), index=responseIds, name=col, dtype=object)
+
+    # All answers of the store as a frame (ResponseId followed by the questions), e.g. to export it as a csv.
+    def to_frame(self, columns=None):
+        columns = columns if columns is not None else self.columns
+        frame = pd.DataFrame({col: self.texts(col) for col in columns})
+        return frame.reset_index()
+
+    # Coding name (see import_codes()) as a frame indexed by ResponseId, with the codes as categoricals
+    # (i.e. still dictionary-encoded).
+    def codes(self, name):
+        spec = self.manifest['codes'][name]
+        ids = np.load(os_join(self.path, f'codes_{name}.ids.npy'), mmap_mode='r')
+        codes = np.load(os_join(self.path, f'codes_{name}.codes.npy'), mmap_mode='r')
+        dictionary = pd.Index(spec['dictionary'])
+        return pd.DataFrame({col: pd.Categorical.from_codes(codes[:, i], categories=dictionary) for (i, col) in enumerate(spec['columns'])},
+                            index=pd.Index(ids.astype(str), name='ResponseId'))
+
+    # Names of the codings kept with the store
+    def codings(self):
+        return list(self.manifest['codes'])
+
+
+# Read a coding csv (e.g. 'Response_Coding-deidentified - Q3.3-Primary.csv': ResponseId, <question>, Code 1..3,
+# with a second header row describing the columns). Returns the ResponseIds and codes (as str, NaN for no code)
+# of the coded responses and the question they answer.
+def read_coding(codesFile):
+    header = pd.read_csv(codesFile, nrows=0).columns
+    columns = [col for col in codeCols if col in header]
+    question = next((col for col in header if col not in ['ResponseId']+codeCols), None)
+    codesFrame = pd.read_csv(codesFile, usecols=['ResponseId']+columns, dtype=str, skiprows=[1])
+    codesFrame = codesFrame[codesFrame['ResponseId'].notna()]
+    for col in columns:
+        codesFrame[col] = codesFrame[col].str.strip().replace('', np.nan)
+    return (codesFrame, question)
+
+
+# Keep the codes of a coding csv (see read_coding()) with the store at path as coding name.
+# The text of the coded responses isn't stored again, it's looked up in the store by ResponseId.
+def import_codes(path, codesFile, name):
+    (codesFrame, question) = read_coding(codesFile)
+    columns = [col for col in codeCols if col in codesFrame]
+    dictionary = pd.Index(pd.unique(codesFrame[columns].stack().dropna())).sort_values()
+    if len(dictionary) >= np.iinfo(np.int16).max:
+        raise ValueError(f'{codesFile}: too many distinct codes ({len(dictionary)})')
+    codes = np.column_stack([dictionary.get_indexer(codesFrame[col]) for col in columns]).astype(np.int16)
+    np.save(os_join(path, f'codes_{name}.ids.npy'), codesFrame['ResponseId'].to_numpy().astype(bytes))
+    np.save(os_join(path, f'codes_{name}.codes.npy'), codes)
+    manifest = read_manifest(path)
+    manifest['codes'][name] = {'question': question, 'columns': columns, 'dictionary': dictionary.tolist(), 'rows': len(codesFrame)}
+    write_manifest(path, manifest)
+    return manifest['codes'][name]
+
+
+
+
+def parse_inputs(args=None):
+    desc = 'qual_store.py: builds a memory-mapped store of free-text answers keyed by ResponseId from a qualitative csv (e.g. the *_qualitative.csv written by scrub_records.py), keeps coding csvs with it (dictionary-encoded) and looks up answers and codes by ResponseId.'
+    parser = ArgumentParser(description=desc)
+    parser.add_argument('-s',
+                        dest='store',
+                        type=str,
+                        required=True,
+                        help='(full or relative) path of the store (a directory)')
+    parser.add_argument('-i',
+                        dest='infile',
+                        type=str,
+                        default=None,
+                        help='csv of free-text answers (ResponseId and one column per question) to (re-)build the store from')
+    parser.add_argument('-a',
+                        dest='append',
+                        action='store_true',
+                        help='append the answers in the csv given by -i to the store rather than rebuilding it')
+    parser.add_argument('-c',
+                        dest='codesFile',
+                        type=str,
+                        default=None,
+                        help='coding csv to keep with the store, e.g. \'data/Response_Coding-deidentified - Q3.3-Primary.csv\' (requires -n)')
+    parser.add_argument('-n',
+                        dest='codingName',
+                        type=str,
+                        default=None,
+                        help='name of the coding given by -c, e.g. Q3.3-Primary')
+    parser.add_argument('-r',
+                        dest='responseIds',
+                        nargs='+',
+                        default=[],
+                        help='print the answers (and codes) of these responses')
+    parser.add_argument('-q',
+                        dest='questions',
+                        nargs='+',
+                        default=None,
+                        help='only print the answers to these questions (default: all questions of the store)')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    params = parse_inputs(args)
+    if params.infile:
+        dataFrame = pd.read_csv(params.infile, dtype=str)
+        columns = [col for col in dataFrame.keys() if col != 'ResponseId']
+        write_store(dataFrame, params.store, read_manifest(params.store)['columns'] if params.append and is_store(params.store) else columns, params.append)
+    if params.codesFile:
+        if not params.codingName:
+            raise SystemExit('-c requires the name of the coding (-n)')
+        spec = import_codes(params.store, params.codesFile, params.codingName)
+        print(f'{params.codingName}: {spec["rows"]} coded response(s) to {spec["question"]}, {len(spec["dictionary"])} distinct code(s)')
+    store = QualStore(params.store)
+    print(f'{params.store}: {len(store)} response(s), {store.manifest["textBytes"]} bytes of text, coding(s): {", ".join(store.codings()) or "-"}')
+    for responseId in params.responseIds:
+        print(responseId)
+        for col in (params.questions or store.columns):
+            print(f'  {col}: {store.get(responseId, col)}')
+        for name in store.codings():
+            codes = store.codes(name)
+            if responseId in codes.index:
+                print(f'  {name}: {", ".join(str(code) for code in codes.loc[responseId].dropna())}')
+
+
+
+if __name__=='__main__':
+    main()
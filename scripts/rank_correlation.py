@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Rank correlation for the ordinal survey items: resampling-based inference for Spearman's rank correlation
+# between two columns and (see correlation_matrix()) all-pairs Spearman/Kendall correlation matrices.
+#
+# Resampling-based inference for Spearman's rank correlation.
+# The asymptotic p-value given by stats.spearmanr is unreliable for the heavily tied ordinal
+# (Likert, knowledge level) data in this study, so we add bootstrap confidence intervals and a permutation p-value.
+# Both columns are coded on small ordinal scales, so a sample is fully described by its (k x l) contingency table,
+# and so is each resample: bootstrap resamples are multinomial draws of a table, and permutations of one column
+# against the other are draws of a table with the same margins. All resamples are evaluated together from their
+# tables (see spearman_from_tables()), so the cost is that of resamples x k x l cells, independent of n.
+
+import pandas as pd, numpy as np
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
+# scipy.stats takes longer to import than pandas; it is imported by the functions that compute p-values,
+# so a run whose statistics are all cached (see result_cache.py) never loads it.
+
+from likert_encoding import encode_codes
+
+
+SpearmanResult = namedtuple('SpearmanResult',
+        ['rho', 'pval', 'ciLow', 'ciHigh', 'permPval', 'n', 'resamples', 'confidence'])
+
+# upper bound on the number of cells (resamples x k x l) of the tables held in memory per chunk
+maxChunkCells = 2**22
+
+
+
+# Factorize x into codes 0..k-1 in sorted order of its distinct values (i.e. ranks w/o tie correction).
+def factorize(x):
+    (levels, codes) = np.unique(x, return_inverse=True)
+    return (codes.reshape(-1), len(levels))
+
+
+# Contingency table (k x l) of the level codes (0..k-1 and 0..l-1) of pairs of values.
+def code_table(xCodes, xLevels, yCodes, yLevels):
+    return np.bincount(xCodes*yLevels + yCodes, minlength=xLevels*yLevels).reshape(xLevels, yLevels)
+
+
+# Spearman's rho for numResamples bootstrap resamples (n pairs drawn with replacement) of the sample w/the given table,
+# i.e. for tables drawn from the multinomial distribution of n pairs over its cells.
+def bootstrap_chunk(table, numResamples, seed):
+    rng = np.random.default_rng(seed)
+    n = table.sum()
+    rhos = list()
+    chunkSize = max(1, maxChunkCells // table.size)
+    for start in range(0, numResamples, chunkSize):
+        tables = rng.multinomial(n, table.ravel()/n, size=min(chunkSize, numResamples-start)).reshape(-1, *table.shape)
+        rhos.append(spearman_from_tables(tables)[0])
+    return np.concatenate(rhos)
+
+
+# numResamples random tables w/the given row and column counts, as (numResamples x k x l) array. These have the
+# distribution of the tables of x against random permutations of y: each cell is drawn (hypergeometrically) from the
+# rows' and columns' counts not yet taken by the cells before it (see Patefield 1981), for all tables at once.
+def permutation_tables(rowCounts, colCounts, numResamples, rng):
+    (k, l) = (len(rowCounts), len(colCounts))
+    tables = np.zeros((numResamples, k, l), dtype=np.int64)
+    colsLeft = np.tile(np.asarray(colCounts, dtype=np.int64), (numResamples, 1))
+    for i in range(k-1):
+        drawsLeft = np.full(numResamples, rowCounts[i], dtype=np.int64)
+        othersLeft = colsLeft.sum(axis=1)
+        for j in range(l-1):
+            othersLeft -= colsLeft[:, j]
+            tables[:, i, j] = rng.hypergeometric(colsLeft[:, j], othersLeft, drawsLeft)
+            drawsLeft -= tables[:, i, j]
+            colsLeft[:, j] -= tables[:, i, j]
+        tables[:, i, l-1] = drawsLeft
+        colsLeft[:, l-1] -= drawsLeft
+    tables[:, k-1, :] = colsLeft
+    return tables
+
+
+# Spearman's rho for numResamples random permutations of y against x (i.e. tables w/the margins of table).
+def permutation_chunk(table, numResamples, seed):
+    rng = np.random.default_rng(seed)
+    rhos = list()
+    chunkSize = max(1, maxChunkCells // table.size)
+    for start in range(0, numResamples, chunkSize):
+        tables = permutation_tables(table.sum(axis=1), table.sum(axis=0), min(chunkSize, numResamples-start), rng)
+        rhos.append(spearman_from_tables(tables)[0])
+    return np.concatenate(rhos)
+
+
+# Split numResamples into (at most) workers chunks, each w/its own independent seed (spawned from seedSeq),
+# and evaluate them (in parallel if workers > 1) with chunkFunc(*args, numResamples, seed).
+def run_resamples(chunkFunc, args, numResamples, seedSeq, workers):
+    workers = max(1, min(workers, numResamples))
+    seeds = seedSeq.spawn(workers)
+    sizes = [len(part) for part in np.array_split(np.arange(numResamples), workers)]
+    if workers == 1:
+        return chunkFunc(*args, sizes[0], seeds[0])
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(chunkFunc, *args, size, chunkSeed) for (size, chunkSeed) in zip(sizes, seeds)]
+        return np.concatenate([future.result() for future in futures])
+
+
+# Spearman's rank correlation between x and y w/a percentile bootstrap confidence interval
+# and a (two-sided) permutation p-value, computed from `resamples` resamples each.
+# Pairs where either value is missing are dropped.
+def spearman_resampling(x, y, resamples=10000, confidence=0.95, seed=None, workers=1):
+    from scipy import stats
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = ~(np.isnan(x) | np.isnan(y))
+    (x, y) = (x[keep], y[keep])
+    n = len(x)
+    (rho, pval) = stats.spearmanr(x, y)
+    if n < 3 or resamples < 1:
+        return SpearmanResult(rho, pval, np.nan, np.nan, np.nan, n, 0, confidence)
+
+    # tabulate once
+    table = code_table(*factorize(x), *factorize(y))
+
+    (bootSeed, permSeed) = np.random.SeedSequence(seed).spawn(2)
+    bootRhos = run_resamples(bootstrap_chunk, (table,), resamples, bootSeed, workers)
+    tail = (1 - confidence)/2
+    (ciLow, ciHigh) = np.nanquantile(bootRhos, [tail, 1 - tail]) if not np.isnan(bootRhos).all() else (np.nan, np.nan)
+
+    if np.isnan(rho):
+        permPval = np.nan
+    else:
+        permRhos = run_resamples(permutation_chunk, (table,), resamples, permSeed, workers)
+        # small tolerance so that permutations reproducing rho (up to rounding) count as extreme
+        permPval = (np.sum(np.abs(permRhos) >= np.abs(rho) - 1e-12) + 1) / (resamples + 1)
+    return SpearmanResult(rho, pval, ciLow, ciHigh, permPval, n, resamples, confidence)
+
+
+
+CorrelationMatrix = namedtuple('CorrelationMatrix', ['coef', 'pval', 'adjPval', 'n', 'method', 'correction'])
+
+
+# Sparse (n x levels) indicator matrix of the level of each row in each column, where codes is an (n x p) matrix of
+# level codes (-1 for missing values) and numLevels the number of levels of each column.
+# Returns the matrix and the offset of each column's levels within its columns.
+def one_hot(codes, numLevels):
+    offsets = np.concatenate([[0], np.cumsum(numLevels)]).astype(int)
+    (rowIdx, colIdx) = np.nonzero(codes >= 0)
+    oneHot = sparse.csr_matrix((np.ones(len(rowIdx)), (rowIdx, offsets[colIdx] + codes[rowIdx, colIdx])),
+                               shape=(codes.shape[0], offsets[-1]))
+    return (oneHot, offsets)
+
+
+# Contingency tables between the levels of every pair of columns, from a single sparse matrix product.
+# codes and numLevels as for one_hot().
+# Returns the (levels x levels) co-occurrence matrix and the offset of each column's levels within it,
+# i.e. the table for columns i and j is table[offsets[i]:offsets[i+1], offsets[j]:offsets[j+1]]
+# and only counts rows where both i and j were answered (pairwise complete).
+def contingency_tables(codes, numLevels):
+    (oneHot, offsets) = one_hot(codes, numLevels)
+    return ((oneHot.T @ oneHot).toarray(), offsets)
+
+
+# Spearman's rho (w/ties) and its (t-distribution) p-value from the contingency table of two ordinal columns.
+# The midranks of each level follow from the table's margins, so ties and pairwise missing values are handled exactly.
+def spearman_from_table(table):
+    from scipy import stats
+    n = table.sum()
+    if n < 3:
+        return (np.nan, np.nan, n)
+    (rowCounts, colCounts) = (table.sum(axis=1), table.sum(axis=0))
+    rowRanks = np.cumsum(rowCounts) - (rowCounts - 1)/2 - (n + 1)/2
+    colRanks = np.cumsum(colCounts) - (colCounts - 1)/2 - (n + 1)/2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rho = (rowRanks @ table @ colRanks) / np.sqrt((rowCounts @ rowRanks**2) * (colCounts @ colRanks**2))
+        t = rho * np.sqrt((n - 2) / ((1 - rho)*(1 + rho)))
+    pval = 2*stats.t.sf(np.abs(t), n - 2) if not np.isnan(rho) else np.nan
+    return (rho, pval, n)
+
+
+# spearman_from_table() of a stack of tables (... x rows x columns), e.g. the tables of one pair of columns
+# within each of a number of groups, at once. Returns arrays of rho, its p-value and n.
+def spearman_from_tables(tables):
+    from scipy import stats
+    n = tables.sum(axis=(-2, -1))
+    (rowCounts, colCounts) = (tables.sum(axis=-1), tables.sum(axis=-2))
+    rowRanks = np.cumsum(rowCounts, axis=-1) - (rowCounts - 1)/2 - (n[..., None] + 1)/2
+    colRanks = np.cumsum(colCounts, axis=-1) - (colCounts - 1)/2 - (n[..., None] + 1)/2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rho = (np.einsum('...i,...ij,...j->...', rowRanks, tables, colRanks)
+               / np.sqrt((rowCounts*rowRanks**2).sum(axis=-1) * (colCounts*colRanks**2).sum(axis=-1)))
+        t = rho * np.sqrt((n - 2) / ((1 - rho)*(1 + rho)))
+        pval = 2*stats.t.sf(np.abs(t), n - 2)
+    rho = np.where(n < 3, np.nan, rho)
+    pval = np.where(np.isnan(rho), np.nan, pval)
+    return (rho, pval, n)
+
+
+# Kendall's tau-b and its (normal approximation, tie-corrected) p-value from the contingency table of two ordinal columns.
+def kendall_from_table(table):
+    from scipy import stats
+    n = table.sum()
+    if n < 3:
+        return (np.nan, np.nan, n)
+    # number of observations strictly above and to the right (left) of each cell
+    above = np.cumsum(np.cumsum(table[::-1, ::-1], axis=0), axis=1)[::-1, ::-1]
+    aboveRight = np.zeros_like(table)
+    aboveRight[:-1, :-1] = above[1:, 1:]
+    aboveLeftAll = np.cumsum(np.cumsum(table[::-1, :], axis=0), axis=1)[::-1, :]
+    aboveLeft = np.zeros_like(table)
+    aboveLeft[:-1, 1:] = aboveLeftAll[1:, :-1]
+    concordant = (table*aboveRight).sum()
+    discordant = (table*aboveLeft).sum()
+
+    (xTies, yTies) = (table.sum(axis=1), table.sum(axis=0))
+    totalPairs = n*(n - 1)/2
+    xTiedPairs = (xTies*(xTies - 1)/2).sum()
+    yTiedPairs = (yTies*(yTies - 1)/2).sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tau = (concordant - discordant) / np.sqrt((totalPairs - xTiedPairs)*(totalPairs - yTiedPairs))
+    # variance of concordant - discordant under independence (w/ties), as in stats.kendalltau
+    var = ((n*(n - 1)*(2*n + 5) - (xTies*(xTies - 1)*(2*xTies + 5)).sum() - (yTies*(yTies - 1)*(2*yTies + 5)).sum()) / 18
+           + (xTies*(xTies - 1)).sum() * (yTies*(yTies - 1)).sum() / (2*n*(n - 1))
+           + (xTies*(xTies - 1)*(xTies - 2)).sum() * (yTies*(yTies - 1)*(yTies - 2)).sum() / (9*n*(n - 1)*(n - 2)))
+    pval = 2*stats.norm.sf(np.abs(concordant - discordant) / np.sqrt(var)) if var > 0 else np.nan
+    return (tau, pval, n)
+
+
+# Adjust pvals for multiple comparisons ('holm', 'bonferroni', 'fdr_bh' (Benjamini-Hochberg) or 'none').
+# NaN values are ignored (and kept as NaN).
+def adjust_pvalues(pvals, method='holm'):
+    pvals = np.asarray(pvals, dtype=float)
+    adjusted = np.full_like(pvals, np.nan)
+    valid = ~np.isnan(pvals)
+    p = pvals[valid]
+    m = len(p)
+    order = np.argsort(p)
+    if method == 'none':
+        adj = p
+    elif method == 'bonferroni':
+        adj = p*m
+    elif method == 'holm':
+        adj = np.empty(m)
+        adj[order] = np.maximum.accumulate((m - np.arange(m))*p[order])
+    elif method == 'fdr_bh':
+        adj = np.empty(m)
+        adj[order] = np.minimum.accumulate((p[order]*m/np.arange(1, m + 1))[::-1])[::-1]
+    else:
+        raise ValueError(f'unknown correction method: {method!r}')
+    adjusted[valid] = np.minimum(adj, 1)
+    return adjusted
+
+
+# Rank correlation ('spearman' or 'kendall') between all pairs of columns in scales (col -> scale),
+# w/p-values adjusted for multiple comparisons across all pairs (see adjust_pvalues()).
+# Each pair uses all rows in which both of its columns were answered.
+# The data is only touched once (to build all pairwise contingency tables), so the cost of
+# each of the p*(p-1)/2 pairs is independent of the number of responses.
+def correlation_matrix(dataFrame, scales, method='spearman', correction='holm'):
+    fromTable = {'spearman': spearman_from_table, 'kendall': kendall_from_table}[method]
+    columns = list(scales.keys())
+    codes = np.column_stack([encode_codes(dataFrame[col], scale) for (col, scale) in scales.items()])
+    (table, offsets) = contingency_tables(codes, [len(scale.categories) for scale in scales.values()])
+
+    p = len(columns)
+    (coef, pval, counts) = (np.eye(p), np.zeros((p, p)), np.zeros((p, p)))
+    (upperI, upperJ) = np.triu_indices(p, k=1)
+    for i in range(p):
+        counts[i, i] = table[offsets[i]:offsets[i+1], offsets[i]:offsets[i+1]].sum()
+    for (i, j) in zip(upperI, upperJ):
+        pairTable = table[offsets[i]:offsets[i+1], offsets[j]:offsets[j+1]]
+        (coef[i, j], pval[i, j], counts[i, j]) = fromTable(pairTable)
+    adjPval = np.zeros((p, p))
+    adjPval[upperI, upperJ] = adjust_pvalues(pval[upperI, upperJ], correction)
+    for matrix in (coef, pval, adjPval, counts):
+        matrix[upperJ, upperI] = matrix[upperI, upperJ]
+
+    frames = [pd.DataFrame(matrix, index=columns, columns=columns) for matrix in (coef, pval, adjPval, counts.astype(int))]
+    return CorrelationMatrix(*frames, method, correction)
+
+
+# Long format version of a CorrelationMatrix: one row per pair of columns.
+def correlation_pairs(result):
+    columns = result.coef.index
+    (upperI, upperJ) = np.triu_indices(len(columns), k=1)
+    return pd.DataFrame({
+            'column1': columns[upperI], 'column2': columns[upperJ],
+            result.method: result.coef.to_numpy()[upperI, upperJ],
+            'pval': result.pval.to_numpy()[upperI, upperJ],
+            'adjPval': result.adjPval.to_numpy()[upperI, upperJ],
+            'n': result.n.to_numpy()[upperI, upperJ]
+            })
@@ -11,24 +11,72 @@
 
 import pandas as pd, numpy as np
 from os import getcwd as os_getcwd
+from os.path import exists as os_exists
 import argparse
 
+from frame_join import key_index, select_keys, select_matching
+from instrumentation import add_arguments as add_instrumentation_arguments, configure as configure_instrumentation, stage
+from qsf_schema import apply_schema, export_time_zones, load_schema, print_problems, read_export
+from qual_store import QualStoreWriter
+from sdns_dataset import append_dataset, is_dataset_file, read_dataset, write_dataset
+from wave_ingest import advance_mark, is_first_run, load_state, save_state, select_new, state_path
+
 # Removal of disqualified responses from Prolific participants.
+# Returns the qualifying prescreen responses, the main survey responses from the same participants,
+# and a report of the PROLIFIC_PIDs that could not be matched (see match_participants()).
 def remove_disqualified_responses(prolificPrescreen, proMainQuant):
+    return match_participants(select_qualifying(prolificPrescreen), proMainQuant)
+
+
+# The prescreen responses of participants that qualified for the main survey
+def select_qualifying(prolificPrescreen):
     toKeep = prolificPrescreen['Q2.6']!='I have never had nor used a SmartDNS account'
     # Q2.6: Which of the following types of Smart DNS accounts have you had or used \n\n(including any accounts you currently have/use)?\n\n(Select all that apply.)
     #       Note: 'I have never had nor used a SmartDNS account' was an exclusive option. 
 
-    qualifies = prolificPrescreen['Q2.3'].apply(lambda x: x=='Yes')
+    qualifies = prolificPrescreen['Q2.3']=='Yes'
     #Q2.3: Do you currently use Smart DNS, or have you done so in the past?
     
     #Remove qualitative question fields and responses from participants who didn't meet qualification requirements from prescreen
-    prolificPrescreen = prolificPrescreen[['PROLIFIC_PID','random_id','Q2.1','Q2.3','Q2.4','Q2.6','Q9','Q9_15_TEXT','Q3.1','Q3.2','Q13.1','Q13.2','Q13.3','Q13.4','Q13.5','Q13.5_4_TEXT','Q13.6']].where(qualifies & toKeep)
-    matchRestriction = prolificPrescreen['PROLIFIC_PID'].apply(lambda x: x in set(proMainQuant['PROLIFIC_PID']))
-    prolificPrescreen = prolificPrescreen.where(matchRestriction)
-    matchRestriction = proMainQuant['PROLIFIC_PID'].apply(lambda x: x in set(prolificPrescreen['PROLIFIC_PID']))
-    proMainQuant = proMainQuant.where(matchRestriction)
-    return (prolificPrescreen, proMainQuant)
+    # The ResponseId of the prescreen is kept: the Q3.3 codes of Prolific participants are keyed by it (Q3.3 is a prescreen question).
+    return prolificPrescreen.loc[qualifies & toKeep, ['PROLIFIC_PID','ResponseId','random_id','Q2.1','Q2.3','Q2.4','Q2.6','Q9','Q9_15_TEXT','Q3.1','Q3.2','Q13.1','Q13.2','Q13.3','Q13.4','Q13.5','Q13.5_4_TEXT','Q13.6']]
+
+
+# Restrict both frames to the participants (PROLIFIC_PID) that appear in both of them (see frame_join.select_matching()).
+# The returned report holds the PIDs only found in the prescreen ('prescreenOnly') or in the main survey ('mainOnly').
+def match_participants(prolificPrescreen, proMainQuant):
+    (selected, dropped) = select_matching({'prescreen': prolificPrescreen, 'main': proMainQuant}, 'PROLIFIC_PID')
+    unmatched = {'prescreenOnly': dropped['prescreen'], 'mainOnly': dropped['main']}
+    return (selected['prescreen'], selected['main'], unmatched)
+
+
+# Files holding the qualifying prescreen responses and the main survey responses that haven't been matched yet (in incremental mode)
+def pending_paths(outfile):
+    return (outfile+'.pending_prescreen.parquet', outfile+'.pending_main.parquet')
+
+
+# Incremental counterpart of match_participants(): new responses are matched against each other and
+# against the responses left unmatched by previous runs (e.g. participants that took the prescreen
+# in an earlier wave than the main survey). Responses that are still unmatched are kept for the next run,
+# along with their free-text answers (prescreenQual, mainQual: see write_qual_store()), so that those aren't lost
+# for participants matched in a later run. Returns the matched responses and report (see match_participants())
+# and the free-text answers of the new and the previously pending responses.
+def match_pending(prolificPrescreen, proMainQuant, outfile, prescreenQual, mainQual):
+    (pendingPrescreenFile, pendingMainFile) = pending_paths(outfile)
+    # the columns of the free-text answers not already in the frames (i.e. all but PROLIFIC_PID, and the prescreen's ResponseId)
+    prescreenCarried = [col for col in prescreenQual.keys() if col not in prolificPrescreen]
+    mainCarried = [col for col in mainQual.keys() if col not in proMainQuant]
+    prolificPrescreen = prolificPrescreen.join(prescreenQual[prescreenCarried])
+    proMainQuant = proMainQuant.join(mainQual[mainCarried])
+    if os_exists(pendingPrescreenFile):
+        prolificPrescreen = pd.concat([read_dataset(pendingPrescreenFile), prolificPrescreen], ignore_index=True)
+    if os_exists(pendingMainFile):
+        proMainQuant = pd.concat([read_dataset(pendingMainFile), proMainQuant], ignore_index=True)
+    (matchedPrescreen, matchedMain, unmatched) = match_participants(prolificPrescreen, proMainQuant)
+    write_dataset(select_keys(prolificPrescreen, 'PROLIFIC_PID', unmatched['prescreenOnly']), pendingPrescreenFile)
+    write_dataset(select_keys(proMainQuant, 'PROLIFIC_PID', unmatched['mainOnly']), pendingMainFile)
+    return (matchedPrescreen.drop(columns=prescreenCarried), matchedMain.drop(columns=mainCarried), unmatched,
+            prolificPrescreen[list(prescreenQual.keys())], proMainQuant[list(mainQual.keys())])
 
 
 #extract mapping of dataFrame keys (e/g 'Q2.1')
@@ -43,9 +91,9 @@ def get_key_mapping(dataFrame):
 
 
 
-def parse_inputs():
+def parse_inputs(args=None):
     desc = "remove_disqualified.py merges data collected in the Prolific prescreen survey with that of the main survey and removes entries for prolific participants that were previously included but ultimately determined not to qualify to participate in this study."
-    parser = ArgumentParser(description=desc)
+    parser = argparse.ArgumentParser(description=desc)
     parser.add_argument('-p',
         dest='prescreen_file',
         type=str,
@@ -56,23 +104,89 @@ def parse_inputs():
         type=str,
         default='data/SDNS-ProlificMain_12July21.csv',
         help='Input data file containing responses to the main survey from Prolific participants. Default: data/SDNS-ProlificMain_12July21.csv (assumed to be running from main project dir)')
+    parser.add_argument('-qp',
+        dest='prescreen_qsf',
+        type=str,
+        default=None,
+        help='If specified, the definition (QSF file) of the prescreen survey, e.g. survey_instruments/prolific/SmartDNS-Prescreen.qsf. The prescreen export is then read with the dtypes given by its schema (see qsf_schema.py) and validated against it.')
+    parser.add_argument('-qm',
+        dest='main_qsf',
+        type=str,
+        default=None,
+        help='If specified, the definition (QSF file) of the main survey, e.g. survey_instruments/prolific/SDNS_-Main_Survey.qsf (see -qp).')
     parser.add_argument('-o',
             dest='outfile',
             type=str,
-            default=os.getcwd()+'/prolific_datafile.csv') 
-    return parser.parse_args()
+            default=os_getcwd()+'/prolific_datafile.csv',
+            help='Output file for the merged Prolific data. If the filename ends in .parquet, the data is written as a typed columnar dataset (see sdns_dataset.py) along with the mapping of column keys to question text. Default: <current working dir>/prolific_datafile.csv')
+    parser.add_argument('-i',
+            dest='incremental',
+            action='store_true',
+            help='Incremental mode: only process the responses to either survey recorded since the last incremental run and append the newly matched participants to the output file. The high-water marks of both exports are kept in <outfile>.ingest.json and responses that could not be matched yet in <outfile>.pending_*.parquet. The first incremental run (re-)writes the output from scratch.')
+    parser.add_argument('-qs',
+            dest='qualStore',
+            type=str,
+            default=None,
+            help='If specified, a directory to which the free-text answers of the participants kept in the output (to Q2.2 and Q3.3 in the prescreen, Q4.6, Q6.2, Q6.4, Q9.2, Q10.3, Q11.3 and Q11.5 in the main survey) are written as a memory-mapped store keyed by the ResponseId of either survey (see qual_store.py). These answers are otherwise dropped. In incremental mode the answers of newly matched participants are appended to it.')
+    add_instrumentation_arguments(parser)
+    return parser.parse_args(args)
+
+
+# Free-text questions of either survey (see main())
+prescreenQualCols = ['Q2.2','Q3.3']
+mainQualCols = ['Q4.6','Q6.2','Q6.4','Q9.2','Q10.3','Q11.3','Q11.5']
+
 
+# Write the free-text answers (prescreenQual, mainQual: PROLIFIC_PID, ResponseId and the answers to either survey's
+# free-text questions) of the participants in keptPids to the store at path (see qual_store.py).
+def write_qual_store(path, prescreenQual, mainQual, keptPids, append=False):
+    writer = QualStoreWriter(path, prescreenQualCols+mainQualCols, append)
+    writer.write(select_keys(prescreenQual, 'PROLIFIC_PID', keptPids))
+    writer.write(select_keys(mainQual, 'PROLIFIC_PID', keptPids))
+    writer.close()
 
-def main():
-    params = parse_inputs()
-    prolificPrescreen = pd.read_csv(params.prescreen_file)
-    prolificMain = pd.read_csv(params.main_survey_file)
+
+# Read a qualtrics export (w/o its header rows) and its key mapping, optionally typed and validated by the survey's QSF file.
+def load_export(exportFile, qsfFile=None):
+    schema = load_schema(qsfFile) if qsfFile else None
+    (dataFrame, mapDict) = read_export(exportFile, schema)
+    if schema:
+        (dataFrame, problems) = apply_schema(dataFrame, schema)
+        print_problems(problems, f'{exportFile}: ')
+    return (dataFrame, mapDict)
+
+
+def main(args=None):
+    params = parse_inputs(args)
+    configure_instrumentation(params)
+    # the qualtrics header rows are split off while reading - use prescreenMap/mainMap instead
+    with stage('load_export (prescreen)') as s:
+        (prolificPrescreen, prescreenMap) = load_export(params.prescreen_file, params.prescreen_qsf)
+        s.record(prolificPrescreen)
+    with stage('load_export (main)') as s:
+        (prolificMain, mainMap) = load_export(params.main_survey_file, params.main_qsf)
+        s.record(prolificMain)
+    if params.incremental:
+        statePath = state_path(params.outfile)
+        state = load_state(statePath)
+        nextMarks = dict(state['marks'])
+        timeZones = {'prescreen': export_time_zones(params.prescreen_file).get('RecordedDate'),
+                     'main': export_time_zones(params.main_survey_file).get('RecordedDate')}
+        prolificPrescreen = select_new(prolificPrescreen, state['marks'], 'prescreen', timeZones['prescreen'])
+        prolificMain = select_new(prolificMain, state['marks'], 'main', timeZones['main'])
+        advance_mark(nextMarks, 'prescreen', prolificPrescreen, timeZones['prescreen'])
+        advance_mark(nextMarks, 'main', prolificMain, timeZones['main'])
+        print(f'{len(prolificPrescreen)} new prescreen response(s), {len(prolificMain)} new main survey response(s)')
     piiCols = ['IPAddress','RecipientLastName',
                 'RecipientFirstName', 'RecipientEmail',
                 'LocationLatitude', 'LocationLongitude',
                 'Status']
     prolificPrescreen.drop(columns=piiCols, inplace=True)
     prolificMain.drop(columns=piiCols, inplace=True)
+    # the free-text answers are stored by the ResponseId of their survey, which is dropped from the main survey below
+    if params.qualStore or params.incremental:
+        prescreenQual = prolificPrescreen[['PROLIFIC_PID','ResponseId']+prescreenQualCols]
+        mainQual = prolificMain[['PROLIFIC_PID','ResponseId']+mainQualCols]
 
     # Note: For data from Prolific participants the Prolific_PID field 
     # was used to map records collected in the prescreen survey to 
@@ -106,7 +220,10 @@ def main():
            'Q113','Q112',
            'Low_quality','RecordedDate',
            'ResponseId', 'ExternalReference',
-           'STUDY_ID', 'SESSION_ID']
+           'STUDY_ID', 'SESSION_ID', 'random_id']
+
+    # The responses of Prolific participants are identified by the ResponseId and random_id (the nonce of the hidden DNS test)
+    # of their prescreen response, like those of the Reddit survey by those of their only response.
 
     # Responses to the main survey determined to be of low quality (e.g. participant did not give descriptive answers)
     # were marked with the 'Low_quality' field, and only responses that were not marked with this field (i.e. where it was null) were exported. 
@@ -114,11 +231,9 @@ def main():
     prolificPrescreen.drop(columns=prescreenNoNeed, inplace=True)
     prolificMain.drop(columns=mainNoNeed, inplace=True)
     
-    #get mapping dicts
-    prescreenMap = get_key_mapping(prolificPrescreen)
-    mainMap = get_key_mapping(prolificMain)
-    prolificPrescreen.drop([0,1],inplace=True)#remove field-desc from dataFrame - use prescreenMap instead
-    prolificMain.drop([0,1],inplace=True)#remove field-desc from dataFrame - use mainMap instead
+    #restrict mapping dicts to the remaining fields
+    prescreenMap = {col: prescreenMap[col] for col in prolificPrescreen.keys()}
+    mainMap = {col: mainMap[col] for col in prolificMain.keys()}
 
 
     #split off qualitative question responses from quantitative ones. (This script only handles quantitative ones):
@@ -145,19 +260,48 @@ def main():
     
     # prescreenQual = prolificPrescreen[['Q2.2','Q3.3']]
     # mainQual = prolificMain[['Q4.6','Q6.2','Q6.4','Q9.2','Q10.3','Q11.3','Q11.5']]
-    prolificPrescreen.drop(columns=['Q2.2','Q3.3'],inplace=True)
-    prolificMain.drop(columns=['Q4.6','Q6.2','Q6.4','Q9.2','Q10.3','Q11.3','Q11.5'],inplace=True)
+    prolificPrescreen.drop(columns=prescreenQualCols,inplace=True)
+    prolificMain.drop(columns=mainQualCols,inplace=True)
 
     # Remove remaining disqualified responses:
-    (prolificPrescreen, prolificMain) = remove_disqualified_responses(prolificPrescreen, prolificMain)
+    with stage('remove_disqualified_responses') as s:
+        if params.incremental:
+            (prolificPrescreen, prolificMain, unmatched, prescreenQual, mainQual) = match_pending(
+                    select_qualifying(prolificPrescreen), prolificMain, params.outfile, prescreenQual, mainQual)
+        else:
+            (prolificPrescreen, prolificMain, unmatched) = remove_disqualified_responses(prolificPrescreen, prolificMain)
+        s.record(prolificMain)
+    print(f'{len(unmatched["prescreenOnly"])} qualifying prescreen participant(s) without a main survey response, {len(unmatched["mainOnly"])} main survey response(s) without a qualifying prescreen response')
 
     # Align responses in both dataFrames and merge 
-    prolificMerged = prolificPrescreen.dropna(how='all').merge(prolificMain.dropna(how='all'),how='inner', on='PROLIFIC_PID')    
+    with stage('merge') as s:
+        prolificMerged = prolificPrescreen.merge(prolificMain,how='inner', on='PROLIFIC_PID')    
     
-    #remove responses where participants used a provider that has never offered SDNS, and does not currently offer it.
-    prolificMerged = prolificMerged['Q9_15_TEXT'].apply(lambda x: x not in ['KutoVpn','OperaVPN','protonvpn','Mullvad'])
-    prolificMerged.drop(columns=['PROLIFIC_PID'],inplace=True)
-    prolificMerged.to_csv(path_or_buf=params.outfile)
+        #remove responses where participants used a provider that has never offered SDNS, and does not currently offer it.
+        prolificMerged = prolificMerged[~prolificMerged['Q9_15_TEXT'].isin(['KutoVpn','OperaVPN','protonvpn','Mullvad'])]
+        keptPids = key_index(prolificMerged, 'PROLIFIC_PID')
+        prolificMerged = s.record(prolificMerged.drop(columns=['PROLIFIC_PID']))
+    if params.incremental:
+        # continue the numbering of the rows written so far
+        prolificMerged.index = pd.RangeIndex(state['rows'], state['rows']+len(prolificMerged))
+    with stage('write_output') as s:
+        if params.incremental and not is_first_run(state):
+            if is_dataset_file(params.outfile):
+                append_dataset(prolificMerged, params.outfile, {**prescreenMap, **mainMap})
+            else:
+                prolificMerged.to_csv(path_or_buf=params.outfile, mode='a', header=False)
+        elif is_dataset_file(params.outfile):
+            write_dataset(prolificMerged, params.outfile, {**prescreenMap, **mainMap})
+        else:
+            prolificMerged.to_csv(path_or_buf=params.outfile)
+        s.record(rows=len(prolificMerged))
+    if params.qualStore:
+        with stage('write_qual_store'):
+            write_qual_store(params.qualStore, prescreenQual, mainQual, keptPids, params.incremental and not is_first_run(state))
+    if params.incremental:
+        state['rows'] += len(prolificMerged)
+        state['marks'] = nextMarks
+        save_state(statePath, state)
 
 
 
@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Analysis of the hidden DNS test (see the README): every survey session loaded <nonce>.smartdnsstudy.com,
+# where the nonce is the session's random_id, so the query logs of the authoritative name server of
+# smartdnsstudy.com tell which resolver(s) each participant's computer used.
+# The logs are streamed in large blocks of whole lines, and the (resolver IP, nonce) pair of each query
+# for the domain is extracted by a single regular expression per block and counted; only the distinct
+# pairs are kept. Log files (and large files in ranges of whole lines) are scanned in parallel (-w) and
+# their counts merged. The query records of dns_responder.py (when running the test locally) are read
+# the same way, a range of records at a time.
+# Resolvers are classified against a list of known SDNS, VPN and public resolver prefixes (a csv with the
+# columns prefix, category and provider), compiled into an index of disjoint address intervals, each labeled
+# with the longest prefix covering it, so an address is classified by a binary search of the interval it
+# falls into. IPv4 addresses are mapped into IPv6 (::ffff:0:0/96), so both share one index.
+# The resolvers of each nonce are then joined to the survey responses by their random_id.
+
+import gzip
+import ipaddress
+import re
+import socket
+import struct
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from argparse import ArgumentParser
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from os.path import getsize as os_getsize
+
+from dns_responder import check_header, headerSize, ipv4MappedPrefix, is_record_file, recordSize
+from frame_join import key_index
+from instrumentation import add_arguments as add_instrumentation_arguments, configure as configure_instrumentation, stage
+from result_cache import ResultCache, defaultCacheDir
+from sdns_dataset import load_full_dataset
+
+
+defaultDomain = 'smartdnsstudy.com'
+blockSize = 2**24
+rangeSize = 2**26
+
+ipv4Mapped = 0xffff << 32
+addressSpace = 2**128
+
+# starts: first addresses (as 16 byte big-endian strings, which sort like the addresses) of disjoint intervals
+# covering the whole address space; labels: the row of prefixes matching each interval (-1 if none does)
+PrefixIndex = namedtuple('PrefixIndex', ['starts', 'labels', 'prefixes'])
+
+# query records written by dns_responder.py (see recordFormat there)
+recordDtype = np.dtype([('time', '<f8'), ('resolver', 'V16'), ('ecs', 'V16'), ('qtype', '<u2'), ('ecsFamily', 'u1'),
+                        ('ecsPrefix', 'u1'), ('transport', 'u1'), ('nonce', 'S32')])
+
+# lines: number of lines scanned; queries: number of queries for the domain; seconds: time spent scanning (summed over workers)
+ScanResult = namedtuple('ScanResult', ['pairs', 'lines', 'queries', 'bytes', 'seconds'])
+
+
+
+# Queries for <nonce>.<domain> in the query log of BIND, e.g.
+#   18-Oct-2026 10:00:00.001 queries: info: client @0x7f3b2c000001 42.137.164.87#40001 (16058.smartdnsstudy.com): query: 16058.smartdnsstudy.com IN A -E(0)DC (198.51.100.1)
+# (the client object and the parenthesized name were added in BIND 9.10 and 9.11, older logs lack them:
+#   client 42.137.164.87#40001: query: 16058.smartdnsstudy.com IN A -E (198.51.100.1)).
+# Groups: the resolver IP and the nonce. The regex starts with a literal, which lets the regex engine skip
+# to candidate lines; the domain alone is matched case insensitively (resolvers randomize the case of names).
+# All repetitions are possessive, as none of the fields can end within the next one (e.g. the port is all digits
+# and followed by a space or colon), so the engine never keeps the positions to backtrack to.
+def query_pattern(domain=defaultDomain):
+    return (rb'client (?:@[^ ]++ )?+([0-9A-Fa-f.:]++)#[0-9]++(?: \([^)]*+\))?+:? query: ([A-Za-z0-9_-]++)\.(?i:'
+            + re.escape(domain.encode('ascii')) + rb') ')
+
+
+def open_log(path):
+    return gzip.open(path, 'rb') if str(path).endswith('.gz') else open(path, 'rb')
+
+
+# Blocks of whole lines of f: those starting within [start, end) (to the end of the file if end is None).
+# A line crossing start belongs to the preceding range, a line crossing end to this one, so consecutive
+# ranges of a file yield each line exactly once.
+def read_blocks(f, start=0, end=None, size=blockSize):
+    if start > 0:
+        f.seek(start-1)
+        if f.read(1) != b'\n':
+            f.readline()
+    position = f.tell()
+    tail = b''
+    while end is None or position < end:
+        block = f.read(size if end is None else min(size, end-position))
+        if not block:
+            break
+        position += len(block)
+        cut = block.rfind(b'\n')+1
+        if cut == 0:
+            tail += block
+            continue
+        yield tail+block[:cut]
+        tail = block[cut:]
+    if tail:
+        yield tail+f.readline()
+
+
+# Ranges (path, start, end) of whole lines the log files are scanned in (of records, for record files).
+# Compressed logs can't be read from an offset, so they are scanned whole.
+def log_ranges(paths, size=rangeSize):
+    ranges = list()
+    for path in paths:
+        fileSize = os_getsize(path)
+        if is_record_file(path):
+            numRecords = (fileSize-headerSize)//recordSize
+            step = max(size//recordSize, 1)
+            ranges.extend((path, start, min(start+step, numRecords)) for start in range(0, numRecords, step))
+            continue
+        if str(path).endswith('.gz') or fileSize <= size:
+            ranges.append((path, 0, None))
+            continue
+        ranges.extend((path, start, min(start+size, fileSize)) for start in range(0, fileSize, size))
+    return ranges
+
+
+# Counts of the (resolver IP, nonce) pairs (as bytes, as logged) of the lines of path within [start, end).
+def scan_range(path, start, end, pattern):
+    if is_record_file(path):
+        return scan_records(path, start, end)
+    regex = re.compile(pattern)
+    counts = Counter()
+    lines = 0
+    numBytes = 0
+    startTime = time.perf_counter()
+    with open_log(path) as f:
+        for block in read_blocks(f, start, end):
+            counts.update(regex.findall(block))
+            lines += block.count(b'\n')
+            numBytes += len(block)
+    return (counts, lines, numBytes, time.perf_counter()-startTime)
+
+
+# Query records (see dns_responder.recordFormat) of a record file, without reading it.
+def read_query_records(path):
+    check_header(path)
+    numRecords = (os_getsize(path)-headerSize)//recordSize
+    return np.memmap(path, dtype=recordDtype, mode='r', offset=headerSize, shape=(numRecords,))
+
+
+# Text of 16 byte addresses (IPv4 for those mapped to ::ffff:0:0/96).
+def address_text(key):
+    if key[:12] == ipv4MappedPrefix:
+        return socket.inet_ntop(socket.AF_INET, key[12:])
+    return socket.inet_ntop(socket.AF_INET6, key)
+
+
+# Counts of the (resolver IP, nonce) pairs of records [start, end) of a record file, like those of scan_range().
+# Records are grouped by their raw resolver and nonce fields (as 64 bit words), so only the distinct pairs are decoded.
+def scan_records(path, start, end):
+    startTime = time.perf_counter()
+    records = read_query_records(path)[start:end]
+    words = np.concatenate([np.ascontiguousarray(records['resolver']).view('<u8').reshape(-1, 2),
+                            np.ascontiguousarray(records['nonce']).view('<u8').reshape(-1, 4)], axis=1)
+    sizes = pd.DataFrame(words).groupby(list(range(words.shape[1])), sort=False).size()
+    (counts, addresses) = (Counter(), dict())
+    for (key, n) in sizes.items():
+        raw = struct.pack('<6Q', *key)
+        if raw[:16] not in addresses:
+            addresses[raw[:16]] = address_text(raw[:16]).encode('ascii')
+        counts[(addresses[raw[:16]], raw[16:].rstrip(b'\x00'))] += n
+    return (counts, len(records), len(records)*recordSize, time.perf_counter()-startTime)
+
+
+# Merged pair counts, with the nonces lower cased (resolvers may randomize the case of the name)
+# and the IPs normalized to their canonical text.
+def pair_frame(counts):
+    addresses = {ip: canonical_address(ip.decode('ascii')) for ip in {ip for (ip, _) in counts}}
+    merged = Counter()
+    for ((ip, nonce), n) in counts.items():
+        merged[(nonce.decode('ascii').lower(), addresses[ip])] += n
+    pairs = pd.DataFrame([(nonce, ip, n) for ((nonce, ip), n) in merged.items()], columns=['nonce', 'resolver', 'queries'])
+    return pairs.sort_values(['nonce', 'resolver'], ignore_index=True)
+
+
+# IPv6 addresses are logged in any case and (non-)compressed form.
+def canonical_address(text):
+    if ':' not in text:
+        return text
+    try:
+        return socket.inet_ntop(socket.AF_INET6, socket.inet_pton(socket.AF_INET6, text))
+    except OSError:
+        return text
+
+
+# Scan the given logs for queries of <nonce>.<domain> with workers processes.
+# pattern: regex (bytes) with two groups, the resolver IP and the nonce (default: query_pattern(domain)).
+def scan_logs(paths, domain=defaultDomain, pattern=None, workers=1):
+    pattern = pattern or query_pattern(domain)
+    ranges = log_ranges(paths)
+    if workers > 1 and len(ranges) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(scan_range, *zip(*ranges), [pattern]*len(ranges)))
+    else:
+        results = [scan_range(path, start, end, pattern) for (path, start, end) in ranges]
+    counts = Counter()
+    for (rangeCounts, _, _, _) in results:
+        counts.update(rangeCounts)
+    pairs = pair_frame(counts)
+    return ScanResult(pairs, sum(r[1] for r in results), int(pairs['queries'].sum()), sum(r[2] for r in results), sum(r[3] for r in results))
+
+
+
+# First and last address of a prefix (e.g. 8.8.8.0/24, 2001:4860::/32) in the IPv6 address space, and its length there.
+def prefix_range(text):
+    network = ipaddress.ip_network(text.strip(), strict=False)
+    (first, length) = (int(network.network_address), network.prefixlen)
+    if network.version == 4:
+        (first, length) = (first | ipv4Mapped, length+96)
+    return (first, first | ((1 << (128-length))-1), length)
+
+
+def to_keys(addresses):
+    return np.array([a.to_bytes(16, 'big') for a in addresses], dtype='S16')
+
+
+# Known resolver prefixes: csv with the columns prefix, category (e.g. sdns, vpn, public) and optionally provider.
+# Lines starting with # are comments.
+def read_prefixes(path):
+    prefixes = pd.read_csv(path, comment='#', dtype=str, skipinitialspace=True)
+    if 'provider' not in prefixes.columns:
+        prefixes['provider'] = pd.NA
+    return prefixes[['prefix', 'category', 'provider']].dropna(subset=['prefix']).reset_index(drop=True)
+
+
+# Compile prefixes (see read_prefixes()) into a PrefixIndex. Prefixes are painted onto the intervals from the
+# shortest to the longest, so each interval ends up labeled with the longest prefix covering it (the later
+# row, if a prefix is listed more than once).
+def build_prefix_index(prefixes):
+    (firsts, lasts, lengths) = zip(*map(prefix_range, prefixes['prefix'])) if len(prefixes) else ((), (), ())
+    bounds = sorted({0}.union(firsts, (last+1 for last in lasts if last+1 < addressSpace)))
+    starts = to_keys(bounds)
+    lows = np.searchsorted(starts, to_keys(firsts))
+    ends = [last+1 for last in lasts]
+    inside = np.array([end < addressSpace for end in ends], dtype=bool)
+    highs = np.full(len(ends), len(starts), dtype=np.int64)
+    highs[inside] = np.searchsorted(starts, to_keys([end for end in ends if end < addressSpace]))
+    labels = np.full(len(starts), -1, dtype=np.int32)
+    for row in np.argsort(np.array(lengths, dtype=np.int64), kind='stable'):
+        labels[lows[row]:highs[row]] = row
+    # merge adjacent intervals with the same label
+    keep = np.concatenate([[True], labels[1:] != labels[:-1]])
+    return PrefixIndex(starts[keep], labels[keep], prefixes)
+
+
+def read_prefix_index(path):
+    return build_prefix_index(read_prefixes(path))
+
+
+def load_prefix_index(path, cache=None):
+    cache = ResultCache(None) if cache is None else cache
+    return cache.cached('resolver_logs.prefix_index', [path], {}, read_prefix_index, path)
+
+
+# 16 byte (IPv6) form of an address, or None if it isn't one.
+def address_key(text):
+    try:
+        if ':' in text:
+            return socket.inet_pton(socket.AF_INET6, text.split('%')[0])
+        return ipv4MappedPrefix+socket.inet_pton(socket.AF_INET, text)
+    except OSError:
+        return None
+
+
+# Row of index.prefixes matching each of addresses (-1 if none does); each distinct address is looked up once.
+def classify_addresses(index, addresses):
+    (unique, inverse) = np.unique(np.asarray(addresses, dtype=object).astype(str), return_inverse=True)
+    keys = [address_key(a) for a in unique]
+    valid = np.array([k is not None for k in keys], dtype=bool)
+    labels = np.full(len(unique), -1, dtype=np.int32)
+    if valid.any():
+        found = np.searchsorted(index.starts, np.array([k for k in keys if k is not None], dtype='S16'), side='right')-1
+        labels[valid] = index.labels[found]
+    return labels[inverse.reshape(-1)]
+
+
+# The pairs of a scan with the prefix, category and provider of their resolver (empty if it isn't listed).
+def classify_pairs(pairs, index):
+    rows = classify_addresses(index, pairs['resolver']) if len(pairs) else np.zeros(0, dtype=np.int32)
+    listed = index.prefixes.reindex(rows).reset_index(drop=True)
+    return pd.concat([pairs.reset_index(drop=True), listed], axis=1)
+
+
+
+# The distinct values of col of each nonce, sorted and joined by ';'.
+def join_unique(resolvers, col):
+    values = resolvers[['nonce', col]].dropna().drop_duplicates().sort_values(['nonce', col])
+    return values.groupby('nonce', sort=True)[col].agg(';'.join)
+
+
+# One row per nonce: its number of resolvers and queries, the categories and providers of its listed resolvers
+# and whether any of them is listed.
+def summarize_nonces(resolvers):
+    grouped = resolvers.groupby('nonce', sort=True)
+    summary = pd.DataFrame({'resolvers': grouped['resolver'].nunique().astype('Int64'),
+                            'queries': grouped['queries'].sum().astype('Int64')})
+    if 'category' in resolvers.columns:
+        summary['categories'] = join_unique(resolvers, 'category').reindex(summary.index).fillna('')
+        summary['providers'] = join_unique(resolvers, 'provider').reindex(summary.index).fillna('')
+        summary['listed'] = grouped['category'].count().gt(0).astype('boolean')
+    return summary
+
+
+# Nonces of a response column, as they appear in the query names (e.g. ids read as numbers lose their '.0').
+def nonce_keys(values):
+    if pd.api.types.is_float_dtype(values):
+        values = values.astype('Int64')
+    return values.astype('string').str.strip().str.lower()
+
+
+# The DNS test results of each response: the summary (see summarize_nonces()) of the nonce in each of keys
+# (prefixed with the key if there are several). Responses whose nonce was never queried are kept (without results).
+# Returns the joined frame and the nonces of the summary without a response.
+def join_responses(responses, summary, keys, idColumn='ResponseId'):
+    joined = responses[[col for col in [idColumn]+keys if col in responses.columns]].copy()
+    matched = pd.Index([])
+    for key in keys:
+        nonces = nonce_keys(responses[key])
+        results = summary.reindex(nonces.to_numpy())
+        results.index = responses.index
+        if len(keys) > 1:
+            results.columns = [f'{key}_{col}' for col in results.columns]
+        joined = pd.concat([joined, results], axis=1)
+        matched = matched.union(key_index(nonces.to_frame(), key))
+    return (joined, summary.index.difference(matched))
+
+
+
+
+
+def parse_inputs(args=None):
+    desc = 'resolver_logs.py: extracts the resolvers of the hidden DNS test (the queries for <nonce>.smartdnsstudy.com) from the query logs of its authoritative name server, classifies them against a list of known SDNS, VPN and public resolver prefixes and joins them to the survey responses by nonce (random_id).'
+    parser = ArgumentParser(description=desc)
+    parser.add_argument('-l',
+                        dest='logFiles',
+                        nargs='+',
+                        required=True,
+                        help='query logs of the authoritative name server (BIND query log format; may be gzipped) and/or query record files written by dns_responder.py')
+    parser.add_argument('-p',
+                        dest='prefixFile',
+                        type=str,
+                        default=None,
+                        help='csv of known resolver prefixes with the columns prefix (e.g. 8.8.8.0/24), category (e.g. sdns, vpn, public) and provider; lines starting with # are ignored')
+    parser.add_argument('-f',
+                        dest='responsesFile',
+                        type=str,
+                        default=None,
+                        help='responses to join the resolvers to (a dataset written by sdns_dataset.py, or a csv), e.g. the quantitative output of scrub_records.py')
+    parser.add_argument('-k',
+                        dest='keys',
+                        nargs='+',
+                        default=['random_id'],
+                        help='column(s) of the responses holding the nonce of a session (default: random_id)')
+    parser.add_argument('-i',
+                        dest='idColumn',
+                        type=str,
+                        default='ResponseId',
+                        help='column identifying a response (default: ResponseId)')
+    parser.add_argument('-d',
+                        dest='domain',
+                        type=str,
+                        default=defaultDomain,
+                        help=f'domain under which the nonces were queried (default: {defaultDomain})')
+    parser.add_argument('-x',
+                        dest='regex',
+                        type=str,
+                        default=None,
+                        help='regex matching a query in the logs (for other log formats), with two groups: the resolver IP and the nonce (default: BIND query log lines for <nonce>.<domain>)')
+    parser.add_argument('-w',
+                        dest='workers',
+                        type=int,
+                        default=1,
+                        help='number of processes the logs are scanned with (default: 1)')
+    parser.add_argument('-o',
+                        dest='outfile',
+                        type=str,
+                        default=None,
+                        help='write the resolvers of each nonce (with their number of queries and classification) to this csv')
+    parser.add_argument('-j',
+                        dest='joinedFile',
+                        type=str,
+                        default=None,
+                        help='write the responses joined to the resolvers of their nonce to this csv')
+    parser.add_argument('-C',
+                        dest='cacheDir',
+                        type=str,
+                        default=defaultCacheDir,
+                        help=f'Directory in which the compiled prefix index is cached, keyed by the content of the prefix file (default: {defaultCacheDir})')
+    parser.add_argument('-n',
+                        dest='noCache',
+                        action='store_true',
+                        help='Compile the prefix index without reading or writing the cache.')
+    add_instrumentation_arguments(parser)
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    params = parse_inputs(args)
+    configure_instrumentation(params)
+    cache = ResultCache(None if params.noCache else params.cacheDir)
+    with stage('scan_logs') as s:
+        pattern = params.regex.encode() if params.regex else None
+        scan = scan_logs(params.logFiles, params.domain, pattern, params.workers)
+        s.record(scan.pairs, rows=scan.lines)
+    rate = scan.lines/scan.seconds if scan.seconds else 0
+    print(f'{scan.lines} lines ({scan.bytes/2**20:.0f} MiB, {rate/1e6:.2f}M lines/s per worker): {scan.queries} queries for {params.domain} '
+          f'from {scan.pairs["resolver"].nunique()} resolvers for {scan.pairs["nonce"].nunique()} nonces')
+    resolvers = scan.pairs
+    if params.prefixFile:
+        with stage('build_prefix_index'):
+            index = load_prefix_index(params.prefixFile, cache)
+        with stage('classify_resolvers') as s:
+            resolvers = s.record(classify_pairs(scan.pairs, index))
+        print(resolvers.groupby(resolvers['category'].fillna('(unlisted)'))['nonce'].nunique().rename('nonces').to_string())
+    if params.outfile:
+        resolvers.to_csv(params.outfile, index=False)
+    if params.responsesFile:
+        with stage('join_responses') as s:
+            responses = load_full_dataset(params.responsesFile, [params.idColumn]+params.keys)
+            (joined, unmatched) = join_responses(responses, summarize_nonces(resolvers), params.keys, params.idColumn)
+            s.record(joined)
+        print(f'{len(unmatched)} nonce(s) in the logs without a matching response')
+        if params.joinedFile:
+            joined.to_csv(params.joinedFile, index=False)
+        elif not params.outfile:
+            joined.to_csv(sys.stdout, index=False)
+
+
+
+if __name__=='__main__':
+    main()
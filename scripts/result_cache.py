@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# On-disk cache for the intermediate frames and statistics of the analysis scripts.
+# Results are keyed by the content hash (sha256) of the files they were computed from, the parameters
+# they were computed with (e.g. the scales and the grouping of codes, see likert_encoding.py) and the source of
+# the scripts in this directory (see code_digest()), so they are reused until the data, the parameters or the code
+# of the analysis change. Entries that can no longer be loaded (e.g. pickles of classes since renamed) are recomputed.
+# Results are stored as pickles (i.e. frames and arrays are written as raw buffers rather than re-encoded).
+# The cache is bounded in size; the least recently used results are evicted first.
+# By default it is kept in the user's cache directory ($XDG_CACHE_HOME or ~/.cache), outside of the repository.
+
+import json
+import hashlib
+import pickle
+import os
+
+from os import makedirs as os_makedirs, replace as os_replace, scandir as os_scandir, stat as os_stat, utime as os_utime
+from os.path import abspath as os_abspath, dirname as os_dirname, expanduser as os_expanduser, isdir as os_isdir, join as os_join
+
+
+defaultCacheDir = os_join(os.environ.get('XDG_CACHE_HOME') or os_expanduser('~/.cache'), 'sdns')
+defaultMaxBytes = 2**29
+
+scriptDir = os_dirname(os_abspath(__file__))
+
+# path -> (stamp, sha256), so each input is only hashed once per process
+fileDigests = dict()
+
+
+
+# Files of a directory (e.g. the part files of a dataset, see sdns_dataset.append_dataset()) sorted by name,
+# leaving out files that are still being written (see ResultCache.put()).
+def directory_files(path):
+    return sorted((entry.name, entry.path) for entry in os_scandir(path) if entry.is_file() and not entry.name.endswith('.tmp'))
+
+
+# Content hash of a file, or of a directory by the names and contents of its files.
+def hash_file(path, blockSize=2**20):
+    files = directory_files(path) if os_isdir(path) else [(None, path)]
+    stamp = [(name, os_stat(filePath).st_size, os_stat(filePath).st_mtime_ns) for (name, filePath) in files]
+    if path in fileDigests and fileDigests[path][0] == stamp:
+        return fileDigests[path][1]
+    digest = hashlib.sha256()
+    for (name, filePath) in files:
+        if name is not None:
+            digest.update(f'{name}\0{os_stat(filePath).st_size}\0'.encode())
+        with open(filePath, 'rb') as f:
+            for block in iter(lambda: f.read(blockSize), b''):
+                digest.update(block)
+    fileDigests[path] = (stamp, digest.hexdigest())
+    return digest.hexdigest()
+
+
+# Hash of the source of all scripts in this directory. Cached results may be computed by code from any of them
+# (e.g. simplify_coding(), likertScales or correlation_matrix()), so changing any script invalidates all results.
+def code_digest():
+    digest = hashlib.sha256()
+    for (name, path) in directory_files(scriptDir):
+        if name.endswith('.py'):
+            digest.update(f'{name}\0{hash_file(path)}\0'.encode())
+    return digest.hexdigest()
+
+
+# Parameters describing a set of scales (col -> pd.CategoricalDtype), for use in cache keys.
+def scale_params(scales):
+    return {col: list(scale.categories) for (col, scale) in scales.items()}
+
+
+# A cacheDir of None disables caching, i.e. every result is computed.
+class ResultCache:
+    def __init__(self, cacheDir=defaultCacheDir, maxBytes=defaultMaxBytes):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        if cacheDir:
+            os_makedirs(cacheDir, exist_ok=True)
+
+    # name identifies the computation (e.g. '<script>.<function>'); params must be json serializable.
+    def key(self, name, inputFiles, params):
+        description = {
+                'name': name,
+                'inputs': [hash_file(path) for path in inputFiles],
+                'code': code_digest(),
+                'params': params
+                }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def path(self, key):
+        return os_join(self.cacheDir, key+'.pkl')
+
+    # Returns (hit, value); a hit marks the entry as recently used.
+    # Entries that can't be loaded (truncated, or referring to classes or modules that no longer exist) are removed.
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return (False, None)
+        except (EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+            return (False, None)
+        os_utime(self.path(key))
+        return (True, value)
+
+    # Entries are written to a temporary file first, so concurrent runs never read a partial entry.
+    def put(self, key, value):
+        tmpPath = f'{self.path(key)}.{os.getpid()}.tmp'
+        with open(tmpPath, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os_replace(tmpPath, self.path(key))
+        self.evict()
+
+    # Remove the least recently used entries until the cache fits into maxBytes.
+    def evict(self):
+        entries = list()
+        for entry in os_scandir(self.cacheDir):
+            if not entry.name.endswith('.pkl'):
+                continue
+            try:
+                info = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((info.st_mtime_ns, info.st_size, entry.path))
+        totalBytes = sum(size for (_, size, _) in entries)
+        for (_, size, path) in sorted(entries):
+            if totalBytes <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            totalBytes -= size
+
+    # Return func(*args) as computed from inputFiles with params, computing (and caching) it if needed.
+    def cached(self, name, inputFiles, params, func, *args, **kwargs):
+        if not self.cacheDir:
+            return func(*args, **kwargs)
+        key = self.key(name, inputFiles, params)
+        (hit, value) = self.get(key)
+        if not hit:
+            value = func(*args, **kwargs)
+            self.put(key, value)
+        return value
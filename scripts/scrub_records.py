@@ -15,8 +15,42 @@ import numpy as np
 import pandas as pd
 
 from argparse import ArgumentParser
+from contextlib import nullcontext
 from datetime import datetime
 from os import mkdir as os_mkdir,scandir as os_scandir
+from os import getcwd as os_getcwd
+from os.path import basename as os_basename, join as os_join, splitext as os_splitext
+
+from aggregates import MultiSelectCounts, ValueCounts
+from instrumentation import add_arguments as add_instrumentation_arguments, configure as configure_instrumentation, stage
+from pii_redaction import free_text_columns, make_pool, merge_redactions, print_redactions, redact_frame
+from qsf_schema import apply_schema, export_time_zones, load_schema, multi_select_options, print_problems, read_export
+from qual_store import QualStoreWriter
+from sdns_dataset import DatasetWriter, append_dataset, write_dataset
+from wave_ingest import advance_mark, is_first_run, load_state, save_state, select_new, state_path, update_counts
+
+
+piiCols = ['IPAddress','RecipientLastName',
+            'RecipientFirstName', 'RecipientEmail',
+            'LocationLatitude', 'LocationLongitude',
+            'Status']
+
+noneedCols = ['Progress','UserLanguage',
+              'DistributionChannel','urlPart',
+              'idURL','Q1.3',
+              'Q1.4','Q1.5']#'EndDate','StartDate']#specifically removed from Reddit data
+
+# Free-text (qualitative) questions. These are split off into their own output file, keyed by ResponseId.
+# Q2.2: What are Smart DNS services primarily used for?
+# Q3.3: To the best of your knowledge, explain how DNS works by describing the steps taken by your computer
+#       when you navigate to a website like http://www.example.com
+# Q4.6: Please explain why you think Smart DNS can affect your security and privacy in the way(s) you indicated.
+# Q6.2: What was your main goal in using a Smart DNS service?
+# Q6.4: What motivated you to specifically use Smart DNS (rather than e.g. a VPN)?
+# Q9.2: Please describe your view on the overall trustworthiness of Smart DNS.
+# Q10.3: If previously blocked by a content provider when using Smart DNS: How do you think they determined you were using Smart DNS?
+# Q11.3/Q11.5: Please explain your prior response (ethics/legality of using Smart DNS to access geoblocked content)
+qualCols = ['Q2.2','Q3.3','Q4.6','Q6.2','Q6.4','Q9.2','Q10.3','Q11.3','Q11.5']
 
 
 
@@ -40,53 +74,63 @@ def filter_by_sdns_use(useCol, services):
      considers = services[useFilter.apply(lambda x: not(x))]
      return (serviceUse,considers)
 
+# Count states (see aggregates.py) of the services (Q9) of participants that use/used SDNS ('use')
+# and of those that are considering it ('consider'); options are the answer options of Q9, if known.
+def service_use_counts(useCol,services,options=None):
+    (serviceUse, considers) = filter_by_sdns_use(useCol,services)
+    return {'use': MultiSelectCounts.from_column(serviceUse, options), 'consider': MultiSelectCounts.from_column(considers, options)}
+
+
 # How many participants use/used SDNS and how many are considering?
 # Usage breakdown by service (useByService), number of services used
 # breakdown by services considered (with double-counting), number of services considered
-def get_service_use(useCol,services):
-    (serviceUse, considers) = filter_by_sdns_use(useCol,services)
-    useByService = serviceUse.str.split(pat=',').explode().value_counts()
-    useByServNorm = serviceUse.str.split(pat=',').explode().value_counts(normalize=True)
-    numServicesUsed = serviceUse.str.split(pat=',').map(lambda x: len(x)).value_counts()
-    numServUsedNorm = serviceUse.str.split(pat=',').map(lambda x: len(x)).value_counts(normalize=True)
-    
-    consByService = considers.str.split(pat=',').explode().value_counts()
-    consByServNorm = considers.str.split(pat=',').explode().value_counts(normalize=True)
-    numServConsidered = considers.str.split(pat=',').map(lambda x: len(x)).value_counts()
-    numServConsNorm = considers.str.split(pat=',').map(lambda x: len(x)).value_counts(normalize=True)
-    
+def get_service_use(useCol,services,options=None):
+    return service_use_from_counts(service_use_counts(useCol,services,options))
+
+
+# get_service_use() from (e.g. merged or incrementally updated) count states
+def service_use_from_counts(counts):
+    (use, cons) = (counts['use'], counts['consider'])
     ret = {
-            'useByService':useByService, 'useByServNorm':useByServNorm,
-            'numServicesUsed':numServicesUsed, 'numServUsedNorm':numServUsedNorm,
-            'consByService':consByService, 'consByServNorm': consByServNorm,
-            'numServConsidered':numServConsidered, 'numServConsNorm':numServConsNorm
+            'useByService':use.option_counts(), 'useByServNorm':use.option_counts(normalize=True),
+            'numServicesUsed':use.size_counts(), 'numServUsedNorm':use.size_counts(normalize=True),
+            'consByService':cons.option_counts(), 'consByServNorm': cons.option_counts(normalize=True),
+            'numServConsidered':cons.size_counts(), 'numServConsNorm':cons.size_counts(normalize=True)
             }
     return ret
 
 
 # Using Smart DNS when I browse the Internet provides additional security(' ')/privacy(' .1') 
+# Each distribution is counted once; the normalized ones are derived from the counts.
 def get_sec_priv_impressions(nPrivSecLikert):
+    (sec, priv) = (ValueCounts.from_column(nPrivSecLikert[' ']), ValueCounts.from_column(nPrivSecLikert[' .1']))
     ret = {
-            'moreBrowsingSec': nPrivSecLikert[' '].value_counts(),
-            'browseSecNorm': nPrivSecLikert[' '].value_counts(normalize=True),
-            'moreBrowsingPriv': nPrivSecLikert[' .1'].value_counts(),
-            'browsePrivNorm': nPrivSecLikert[' .1'].value_counts(normalize=True)
+            'moreBrowsingSec': sec.distribution(),
+            'browseSecNorm': sec.distribution(normalize=True),
+            'moreBrowsingPriv': priv.distribution(),
+            'browsePrivNorm': priv.distribution(normalize=True)
             }
     return ret
 
 
+# Count states (see aggregates.py) of the answers to each col of subframe (col -> ValueCounts)
+def likert_counts(subframe):
+    return {col: ValueCounts.from_column(subframe[col]) for col in subframe.keys() if col != 'random_id'}
+
+
 #Handle subframes with likert value responses.
 def process_likert(subframe,mapDict):
+    return likert_from_counts(likert_counts(subframe.iloc[1:]), mapDict)
+
+
+# process_likert() from (e.g. merged or incrementally updated) count states (col -> ValueCounts)
+def likert_from_counts(countsByCol,mapDict):
     retDict = dict()
-    for col in subframe.keys():
-        if col == 'random_id':
-              continue
+    for (col, counts) in countsByCol.items():
         colVal = mapDict[col]
-        valDist = subframe[col][1:].value_counts()
-        normValDist = subframe[col][1:].value_counts(normalize=True)
         retDict[col] = {
                            'description': colVal,
-                           'distribution':valDist, 'normalized_dist':normValDist
+                           'distribution':counts.distribution(), 'normalized_dist':counts.distribution(normalize=True)
                        }
     return retDict
 
@@ -94,16 +138,16 @@ def process_likert(subframe,mapDict):
 
 # Get the relative distributions of options selected
 # for each entry in a select many column
-def select_many_dist(col,titleSuffix):
-    colLists = col.str.split(',')
-    lengths = colLists.apply(lambda x: len(x) if isinstance(x,list) else np.nan)
-    lengthDist = lengths.value_counts(dropna=True)
+# options: answer options of the question (e.g. from its QSF schema), so that options containing commas are counted correctly.
+def select_many_dist(col,titleSuffix,options=None):
+    return select_many_from_counts(MultiSelectCounts.from_column(col, options), titleSuffix)
+
+
+# select_many_dist() from a (e.g. merged or incrementally updated) aggregates.MultiSelectCounts
+def select_many_from_counts(counts,titleSuffix):
+    lengthDist = counts.size_counts()
     distributionDict = dict()
-    subsetSizes = dict()
-    maxVal = lengths.dropna().max()
-    for i in range(1,int(maxVal)+1):
-        subsetI = colLists.apply(lambda x: x if isinstance(x,list) and len(x)==i else np.nan).dropna()
-        prevalenceDist = subsetI.explode().value_counts()
+    for (i, prevalenceDist) in counts.option_counts_by_size().items():
         distributionDict[str(i)+titleSuffix] = prevalenceDist
     return (lengthDist, distributionDict)
 
@@ -111,17 +155,174 @@ def select_many_dist(col,titleSuffix):
 # Q7.1: Which other services do SDNS providers offer (if any)? 
 # Q7.2: Were participants mainly looking to use SDNS when they signed up w/their (respective) service provider(s)?
 # Q7.4: Which (if any) of the additional services (other than SDNS) did participants use?
-def analyze_other_offerings(otherServices,mapDict):
+# optionsByCol: answer options of Q7.3/Q7.4 (col -> list of options), if known.
+def analyze_other_offerings(otherServices,mapDict,optionsByCol=None):
+    optionsByCol = dict() if optionsByCol is None else optionsByCol
     offersAndMotives = process_likert(otherServices[['Q7.1','Q7.2']],mapDict)
-    (countsByNumOffered,offerPrevalence) = select_many_dist(otherServices['Q7.3'][1:],' service(s)') 
-    (countsByNumUsed,usePrevalence) = select_many_dist(otherServices['Q7.4'][1:],'service(s)')
+    (countsByNumOffered,offerPrevalence) = select_many_dist(otherServices['Q7.3'][1:],' service(s)',optionsByCol.get('Q7.3')) 
+    (countsByNumUsed,usePrevalence) = select_many_dist(otherServices['Q7.4'][1:],'service(s)',optionsByCol.get('Q7.4'))
     ret =  (countsByNumOffered ,offerPrevalence ,
             countsByNumUsed, usePrevalence
             )
     return ret
 
 
-def parse_inputs():
+# Create outDir if it doesn't already exist.
+def make_output_dir(outDir):
+    try:
+        os_mkdir(outDir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+# Resolve the quantitative and qualitative output files for infile.
+# Both files are named after the input file and written to the current working directory unless -qn/-ql are given.
+def get_output_paths(params):
+    quantDir = params.quantDir if params.quantDir else os_getcwd()
+    qualDir = params.qualDataDir if params.qualDataDir else os_getcwd()
+    if params.newDirs:
+        make_output_dir(quantDir)
+        make_output_dir(qualDir)
+    stem = os_splitext(os_basename(params.infile))[0]
+    return (os_join(quantDir, stem+'_quantitative.csv'), os_join(qualDir, stem+'_qualitative.csv'))
+
+
+# The (optional) typed columnar copy of the quantitative output sits next to the quantitative csv.
+def get_dataset_path(quantFile):
+    return os_splitext(quantFile)[0]+'.parquet'
+
+
+# The (optional) store of the qualitative output (see qual_store.py) sits next to the qualitative csv.
+def get_store_path(qualFile):
+    return os_splitext(qualFile)[0]+'.qstore'
+
+
+# Split a scrubbed frame into its quantitative and qualitative parts and write (or append) them to disk.
+# isFirst controls whether files are truncated and the header line is written, so the same
+# function serves both the in-memory path (called once) and the streaming path (called per chunk).
+# If storeWriter (a qual_store.QualStoreWriter) is given, the qualitative part is also added to its store.
+def write_scrubbed_frames(dataFrame, quantFile, qualFile, isFirst=True, storeWriter=None):
+    mode = 'w' if isFirst else 'a'
+    dataFrame.drop(columns=qualCols).to_csv(path_or_buf=quantFile, mode=mode, header=isFirst, index=False)
+    dataFrame[['ResponseId']+qualCols].to_csv(path_or_buf=qualFile, mode=mode, header=isFirst, index=False)
+    if storeWriter:
+        storeWriter.write(dataFrame[['ResponseId']+qualCols])
+
+
+# Redact PII pasted into the free-text answers of dataFrame (see pii_redaction.py), unless pool is False,
+# i.e. text is to be kept as it is. The number of redactions is added to redactions (col -> Counter).
+def redact_free_text(dataFrame, schema, pool, redactions):
+    if pool is False:
+        return dataFrame
+    (dataFrame, frameRedactions) = redact_frame(dataFrame, free_text_columns(dataFrame, schema), pool)
+    merge_redactions(redactions, frameRedactions)
+    return dataFrame
+
+
+# Merge the problems reported by qsf_schema.apply_schema() for one chunk into those of the previous ones.
+def merge_problems(problems, chunkProblems):
+    if problems is None:
+        return chunkProblems
+    for (col, values) in chunkProblems['invalidValues'].items():
+        problems['invalidValues'][col] = sorted(set(problems['invalidValues'].get(col, [])) | set(values))
+    return problems
+
+
+# Streaming counterpart of the scrubbing steps in main(): reads infile chunkSize rows at a time so that
+# peak memory is bounded by the chunk size rather than the size of the export.
+# The two qualtrics header rows (question text, ImportId JSON) are handled once up front by read_export(),
+# which also returns the key mapping. Without a schema everything is read as str, so that
+# the values written out match those of the in-memory path exactly.
+# If datasetFile is given, the quantitative part is also written to it as a typed columnar dataset (see sdns_dataset.py),
+# and if storeFile is given, the qualitative part to a store of free-text answers (see qual_store.py).
+# pool: as for redact_free_text()
+def scrub_in_chunks(infile, chunkSize, quantFile, qualFile, datasetFile=None, schema=None, pool=None, storeFile=None):
+    (chunks, mapDict) = read_export(infile, schema, chunksize=chunkSize)
+    mapDict = {col: text for (col, text) in mapDict.items() if col not in piiCols+noneedCols}
+    datasetWriter = DatasetWriter(datasetFile, mapDict) if datasetFile else None
+    storeWriter = QualStoreWriter(storeFile, qualCols) if storeFile else None
+    problems = None
+    redactions = dict()
+    isFirst = True
+    for chunk in chunks:
+        if schema:
+            (chunk, chunkProblems) = apply_schema(chunk, schema)
+            problems = merge_problems(problems, chunkProblems)
+        chunk.drop(columns=piiCols+noneedCols, inplace=True)
+        chunk = redact_free_text(chunk, schema, pool, redactions)
+        write_scrubbed_frames(chunk, quantFile, qualFile, isFirst, storeWriter)
+        if datasetWriter:
+            datasetWriter.write(chunk.drop(columns=qualCols))
+        isFirst = False
+    if datasetWriter:
+        datasetWriter.close()
+    if storeWriter:
+        storeWriter.close()
+    if problems:
+        print_problems(problems)
+    print_redactions(redactions)
+    return mapDict
+
+
+# Columns whose answer counts are kept up to date by incremental runs (see scrub_incremental() and wave_ingest.update_counts()):
+# the demographics and Q7.1/Q7.2 (process_likert()), Q7.3/Q7.4 (select_many_dist()) and Q2.3/Q9 (get_service_use()).
+countedLikertCols = ['Q13.1','Q13.2','Q13.3','Q13.4','Q13.5','Q13.5_4_TEXT','Q13.6','Q7.1','Q7.2']
+countedMultiCols = ['Q7.3','Q7.4']
+
+
+# Incremental counterpart of scrub_in_chunks(): only responses recorded after those of the previous incremental run
+# (see wave_ingest.py) are scrubbed and appended to the outputs, and the answer counts kept in the
+# run's state file are updated with theirs. The first run starts the outputs from scratch.
+# chunkSize: read the export chunkSize rows at a time (default: all at once). pool, storeFile: as for scrub_in_chunks()
+def scrub_incremental(infile, quantFile, qualFile, datasetFile=None, schema=None, chunkSize=None, pool=None, storeFile=None):
+    statePath = state_path(quantFile)
+    state = load_state(statePath)
+    isFirst = is_first_run(state)
+    storeWriter = QualStoreWriter(storeFile, qualCols, append=not isFirst) if storeFile else None
+    (chunks, mapDict) = read_export(infile, schema, chunksize=chunkSize)
+    mapDict = {col: text for (col, text) in mapDict.items() if col not in piiCols+noneedCols}
+    optionsByCol = multi_select_options(schema)
+    timeZone = export_time_zones(infile).get('RecordedDate')
+    nextMarks = dict(state['marks'])
+    newFrames = list()
+    problems = None
+    redactions = dict()
+    numNew = 0
+    for chunk in ([chunks] if chunkSize is None else chunks):
+        chunk = select_new(chunk, state['marks'], 'export', timeZone)
+        if chunk.empty:
+            continue
+        if schema:
+            (chunk, chunkProblems) = apply_schema(chunk, schema)
+            problems = merge_problems(problems, chunkProblems)
+        advance_mark(nextMarks, 'export', chunk, timeZone)
+        chunk = chunk.drop(columns=piiCols+noneedCols)
+        chunk = redact_free_text(chunk, schema, pool, redactions)
+        write_scrubbed_frames(chunk, quantFile, qualFile, isFirst, storeWriter)
+        update_counts(state['counts'], chunk, countedLikertCols, countedMultiCols, optionsByCol, 'Q2.3', 'Q9')
+        if datasetFile:
+            newFrames.append(chunk.drop(columns=qualCols))
+        numNew += len(chunk)
+        isFirst = False
+    if datasetFile and newFrames:
+        if is_first_run(state):
+            write_dataset(pd.concat(newFrames), datasetFile, mapDict)
+        else:
+            append_dataset(pd.concat(newFrames), datasetFile, mapDict)
+    if storeWriter:
+        storeWriter.close()
+    if problems:
+        print_problems(problems)
+    print_redactions(redactions)
+    state['rows'] += numNew
+    state['marks'] = nextMarks
+    save_state(statePath, state)
+    print(f'{numNew} new response(s), {state["rows"]} in total')
+    return mapDict
+
+
+def parse_inputs(args=None):
     desc = "scrub_records.py removes PII fields from qualtrics data (based on field names) and splits quantitative and qualitative results into two separate data files."
     parser = ArgumentParser(description=desc)
     parser.add_argument('-f',
@@ -142,41 +343,103 @@ def parse_inputs():
                         dest='qualDataDir',
                         nargs='?',
                         help='Path to directory for qualitative output files. Flag is required if -d is specified. Path value defaults to the current_working_dir/qual_data_metrics')
-    return parser.parse_args()
-
-
-
-def main():
-    params = parse_inputs()
-    dataFrame = pd.read_csv(params.infile)
-    piiCols = ['IPAddress','RecipientLastName',
-                'RecipientFirstName', 'RecipientEmail',
-                'LocationLatitude', 'LocationLongitude',
-                'Status']
+    parser.add_argument('-c',
+                        dest='chunkSize',
+                        type=int,
+                        default=None,
+                        help='If specified, scrub the input in a streaming fashion, reading this many rows at a time (peak memory is then bounded by the chunk size). Only the scrubbed output files are written in this mode; the in-memory analyses are skipped. Default: read the whole file at once.')
+    parser.add_argument('-pq',
+                        dest='writeDataset',
+                        action='store_true',
+                        help='If specified, also write the quantitative data as a typed columnar dataset (<quantitative file>.parquet) that the analysis scripts can read directly.')
+    parser.add_argument('-s',
+                        dest='qsfFile',
+                        type=str,
+                        default=None,
+                        help='If specified, the survey definition (QSF file, e.g. survey_instruments/reddit/Smart_DNS.qsf) the export was collected with. Columns are then read with the dtypes given by the survey\'s schema (see qsf_schema.py) and answers are validated against it. Default: read all columns as text.')
+    parser.add_argument('-i',
+                        dest='incremental',
+                        action='store_true',
+                        help='Incremental mode: only scrub the responses recorded since the last incremental run and append them to the output files. The high-water mark of the export and the running answer counts are kept in <quantitative output>.ingest.json. The first incremental run (re-)writes the outputs from scratch.')
+    parser.add_argument('-k',
+                        dest='keepText',
+                        action='store_true',
+                        help='If specified, write the free-text answers as they are. Default: email addresses, URLs, IP addresses, phone numbers and Prolific IDs in the free-text answers are replaced by placeholders (e.g. [EMAIL], see pii_redaction.py).')
+    parser.add_argument('-w',
+                        dest='workers',
+                        type=int,
+                        default=1,
+                        help='Number of processes redacting the free-text answers. Default: 1 (redact in this process)')
+    parser.add_argument('-qs',
+                        dest='writeStore',
+                        action='store_true',
+                        help='If specified, also write the qualitative data to a memory-mapped store of free-text answers keyed by ResponseId (<qualitative file>.qstore, see qual_store.py), from which they can be looked up without loading the qualitative csv.')
+    add_instrumentation_arguments(parser)
+    return parser.parse_args(args)
+
+
+
+def main(args=None):
+    params = parse_inputs(args)
+    configure_instrumentation(params)
+    (quantFile, qualFile) = get_output_paths(params)
+    datasetFile = get_dataset_path(quantFile) if params.writeDataset else None
+    storeFile = get_store_path(qualFile) if params.writeStore else None
+    with stage('load_schema'):
+        schema = load_schema(params.qsfFile) if params.qsfFile else None
+    # pool redacting the free-text answers (False: they're kept as they are, see redact_free_text())
+    redactionPool = nullcontext(False) if params.keepText else make_pool(params.workers)
+    if params.incremental:
+        with stage('scrub_incremental'), redactionPool as pool:
+            mapDict = scrub_incremental(params.infile, quantFile, qualFile, datasetFile, schema, params.chunkSize, pool, storeFile)
+        return
+    if params.chunkSize:
+        with stage('scrub_in_chunks'), redactionPool as pool:
+            mapDict = scrub_in_chunks(params.infile, params.chunkSize, quantFile, qualFile, datasetFile, schema, pool, storeFile)
+        # sanity check: Review the names of the fields to ensure initial PII has been scrubbed.
+        print(list(mapDict.keys()))
+        return
+
+    # the qualtrics header rows are split off while reading - use mapDict instead
+    with stage('read_export') as s:
+        (dataFrame, mapDict) = read_export(params.infile, schema)
+        s.record(dataFrame)
+    if schema:
+        with stage('apply_schema') as s:
+            (dataFrame, problems) = apply_schema(dataFrame, schema)
+            s.record(dataFrame)
+        print_problems(problems)
     dataFrame.drop(columns=piiCols, inplace=True)
     # Note: For data from Prolific participants the Prolific_PID field 
     # was used to map records collected in the prescreen survey to 
     # reponses from the same participants given in the main survey.
     # Once all Prolific data had been assembled, the Prolific_PID field was deleted. 
 
-    dataFrame.drop(1,inplace=True)#drop qualtrics column IDs
+    dataFrame.drop(columns=noneedCols, inplace=True)
+    mapDict = {col: mapDict[col] for col in dataFrame.keys()}
+    redactions = dict()
+    with stage('redact_free_text') as s, redactionPool as pool:
+        dataFrame = s.record(redact_free_text(dataFrame, schema, pool, redactions))
+    print_redactions(redactions)
 
-    noneedCols = ['Progress','UserLanguage',
-                  'DistributionChannel','urlPart',
-                  'idURL','Q1.3',
-                  'Q1.4','Q1.5']#'EndDate','StartDate']#specifically removed from Reddit data
-    
     # utm fields were mainly used to determine the most effective means of participant recruitment through Reddit
     # and were not needed for additional analysis. These fields were not present in data collected via Prolific. 
     # dataFrame.drop(columns=[ 'Source', 'utm_source', 'utm_medium', 'utm_campaign'], inplace=True)
 
-    mapDict = get_key_mapping(dataFrame)
-    dataFrame.drop(0,inplace=True)#remove field-desc from dataFrame - use mapDict instead
     
     # sanity check: Review the names of the fields to ensure initial PII has been scrubbed. 
     print(dataFrame.keys()[:20])
     print(dataFrame.keys()[60:])
-   
+
+    with stage('write_scrubbed_frames') as s:
+        storeWriter = QualStoreWriter(storeFile, qualCols) if storeFile else None
+        write_scrubbed_frames(dataFrame, quantFile, qualFile, storeWriter=storeWriter)
+        if storeWriter:
+            storeWriter.close()
+        s.record(rows=len(dataFrame))
+    if datasetFile:
+        with stage('write_dataset'):
+            write_dataset(dataFrame.drop(columns=qualCols), datasetFile, mapDict)
 
 
     # Split off smaller dataFrame (copies) to perform analysis.
@@ -190,7 +453,8 @@ def main():
     # Q13.5: What is the gender to which you most closely identify?
     # Q13.6: What is your annual income in US Dollars?
 
-    demogStats = process_likert(demographics,mapDict) 
+    with stage('process_likert (demographics)'):
+        demogStats = process_likert(demographics,mapDict) 
 
     otherServices = dataFrame[['Q7.1','Q7.2','Q7.3','Q7.4']]
     # Q7.1: Which other services do SDNS providers offer (if any)? 
@@ -200,7 +464,9 @@ def main():
 
 
     # perform analysis
-    (countsByNumOffered,offerPrevalence, countsByNumUsed, usePrevalence) = analyze_other_offerings(otherServices,mapDict) 
+    optionsByCol = multi_select_options(schema)
+    with stage('analyze_other_offerings'):
+        (countsByNumOffered,offerPrevalence, countsByNumUsed, usePrevalence) = analyze_other_offerings(otherServices,mapDict,optionsByCol) 
 
     #Quantitative analysis fields
 
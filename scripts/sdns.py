@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Single entry point for the scripts in this directory: sdns.py <command> [arguments], e.g.
+#
+#   sdns.py spearman -f data/fullDataset_post_drops.parquet -s 0
+#
+# runs dns_knowledgeSpearman.py with the given arguments (sdns.py <command> -h lists them).
+# The script of a command is only imported when the command is run, so neither sdns.py -h nor a command
+# pays for the libraries of the others (e.g. a Spearman run never loads plotly).
+# Several commands can be run one after the other in the same process, separated by a lone +, e.g.
+#
+#   sdns.py spearman -f data/fullDataset_post_drops.parquet + spearman -f data/fullDataset_post_drops.parquet -m + alluvium -f data/fullDataset_post_drops.parquet -b
+#
+# which loads pandas etc. and each dataset (see sdns_dataset.share_datasets()) once rather than once per command.
+# A command that fails stops the run (and the commands after it).
+
+import sys
+
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from collections import namedtuple
+from importlib import import_module
+from os.path import basename as os_basename
+
+
+# module: the script (in this directory) whose main() runs the command
+Command = namedtuple('Command', ['module', 'help'])
+
+commands = {
+        'scrub': Command('scrub_records', 'scrub a raw Qualtrics export of the Reddit survey (scrub_records.py)'),
+        'disqualify': Command('remove_disqualified', 'merge the Prolific surveys and drop disqualified participants (remove_disqualified.py)'),
+        'spearman': Command('dns_knowledgeSpearman', 'Spearman correlation of DNS knowledge and the Q3.3 codes, or the correlation matrix (dns_knowledgeSpearman.py)'),
+        'alluvium': Command('dns_understanding_alluvium', 'alluvium figures of DNS understanding v. beliefs about Smart DNS (dns_understanding_alluvium.py)'),
+        'subgroups': Command('subgroups', 'breakdowns of the results by demographics (subgroups.py)'),
+        'irr': Command('irr', 'inter-rater reliability of the qualitative codings (irr.py)'),
+        'qual': Command('qual_store', 'build or query the store of free-text answers and codings (qual_store.py)'),
+        'schema': Command('qsf_schema', 'derive the column schema of a survey from its QSF (qsf_schema.py)'),
+        'dataset': Command('sdns_dataset', 'convert a preprocessed csv into a typed dataset (sdns_dataset.py)'),
+        'resolvers': Command('resolver_logs', 'classify the resolvers of the hidden DNS test (resolver_logs.py)'),
+        'responder': Command('dns_responder', 'wildcard authoritative name server for the DNS test (dns_responder.py)'),
+        'storm': Command('dns_query_storm', 'replay a storm of DNS test queries against a name server (dns_query_storm.py)'),
+        'pipeline': Command('sdns_pipeline', 'run the whole preprocessing and analysis pipeline (sdns_pipeline.py)'),
+        'synthetic': Command('synthetic_exports', 'generate synthetic survey exports (synthetic_exports.py)'),
+        'benchmark': Command('sdns_benchmark', 'benchmark the pipeline on synthetic exports (sdns_benchmark.py)')
+        }
+
+separator = '+'
+
+
+
+# Split the command line into its commands: [(name, arguments), ...]
+def split_commands(args):
+    runs = [[]]
+    for arg in args:
+        if arg == separator:
+            runs.append([])
+        else:
+            runs[-1].append(arg)
+    return [(run[0], run[1:]) for run in runs if run]
+
+
+# Run command name with the given arguments. The script's parser takes its program name from sys.argv[0],
+# so its usage and error messages name the command (e.g. 'sdns.py spearman').
+def run_command(name, args, prog):
+    from instrumentation import stage
+    sys.argv[0] = f'{prog} {name}'
+    with stage(name):
+        module = import_module(commands[name].module)
+        module.main(args)
+
+
+def parse_inputs(args=None):
+    desc = 'sdns.py: runs the scripts of this directory as commands, loading only the libraries the command at hand needs; several commands separated by a lone + run one after the other in the same process, sharing the datasets they load.'
+    epilog = 'commands:\n'+'\n'.join(f'  {name:<12}{command.help}' for (name, command) in commands.items())
+    parser = ArgumentParser(description=desc, epilog=epilog, formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument('command',
+                        choices=commands,
+                        metavar='command',
+                        help='command to run (see below), followed by its arguments (see sdns.py <command> -h)')
+    parser.add_argument('args',
+                        nargs='...',
+                        help='arguments of the command, optionally followed by + and further commands')
+    params = parser.parse_args(args)
+    runs = split_commands([params.command]+params.args)
+    for (name, _) in runs:
+        if name not in commands:
+            parser.error(f'unknown command {name!r} (choose from {", ".join(commands)})')
+    return runs
+
+
+def main(args=None):
+    prog = os_basename(sys.argv[0])
+    runs = parse_inputs(args)
+    if len(runs) > 1:
+        from sdns_dataset import share_datasets
+        share_datasets()
+    for (name, commandArgs) in runs:
+        run_command(name, commandArgs, prog)
+
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Benchmarks of the preprocessing and analysis steps on synthetic exports (see synthetic_exports.py) of
+# increasing size. Each case runs in a process of its own, so its peak memory (peak RSS) isn't inflated by
+# the cases run before it:
+#  - scripts (scrub_records.py, remove_disqualified.py) are run as they would be run from the command line,
+#  - functions (assemble_dataframe(), select_many_dist(), the alluvium builders, compute_spearman()) are called
+#    on inputs loaded beforehand, so only the call itself is timed.
+# Results are written as json along with the commit and versions they were measured with, and can be compared
+# against those of an earlier run (-b) to spot regressions.
+
+import json
+import multiprocessing
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from argparse import ArgumentParser
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from os import cpu_count as os_cpu_count, makedirs as os_makedirs, waitpid as os_waitpid, waitstatus_to_exitcode, WNOHANG
+from os.path import abspath as os_abspath, dirname as os_dirname, exists as os_exists, join as os_join
+
+from instrumentation import current_rss, peak_rss
+from synthetic_exports import generate_surveys, mainQsf, prescreenQsf, redditQsf
+
+
+scriptDir = os_dirname(os_abspath(__file__))
+
+defaultSizes = [1000, 10000, 100000]
+
+# kind: 'script' (target: script name, args: function of the case's paths giving its command line arguments)
+#       or 'function' (target: function of (paths, params) returning the function to time and its arguments)
+Case = namedtuple('Case', ['name', 'kind', 'target', 'args'])
+
+
+
+# Run script with args in a process of its own; returns its wall time and peak RSS.
+# The peak is polled every pollInterval seconds while the script runs (it only ever increases).
+def measure_script(script, args, pollInterval=0.01):
+    with tempfile.TemporaryFile() as errors:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, os_join(scriptDir, script)]+list(args), stdout=subprocess.DEVNULL, stderr=errors)
+        peak = 0
+        while True:
+            (pid, status) = os_waitpid(proc.pid, WNOHANG)
+            if pid:
+                break
+            peak = max(peak, peak_rss(proc.pid) or 0)
+            time.sleep(pollInterval)
+        seconds = time.perf_counter()-start
+        proc.returncode = waitstatus_to_exitcode(status)
+        if proc.returncode != 0:
+            errors.seek(0)
+            raise RuntimeError(f'{script} failed: {errors.read().decode(errors="replace")[-2000:]}')
+    return {'seconds': seconds, 'peakRssBytes': peak}
+
+
+# Runs in a fresh worker process: loads the inputs of the case (prepare) and times the call.
+# rssIncreaseBytes: peak RSS above the RSS right before the call, i.e. roughly what the call itself allocated.
+def measure_function(prepare, paths, params):
+    (func, args) = prepare(paths, params)
+    rssBefore = current_rss() or 0
+    start = time.perf_counter()
+    func(*args)
+    seconds = time.perf_counter()-start
+    peak = peak_rss() or 0
+    return {'seconds': seconds, 'peakRssBytes': peak, 'rssIncreaseBytes': max(peak-rssBefore, 0)}
+
+
+def run_case(case, paths, params):
+    if case.kind == 'script':
+        return measure_script(case.target, case.args(paths))
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(measure_function, case.target, paths, params).result()
+
+
+# Function cases: each returns the function to time and its arguments.
+
+def prepare_assemble_spearman(paths, params):
+    from dns_knowledgeSpearman import assemble_dataframe
+    return (assemble_dataframe, [paths['fullDataset'], paths['codesPrimary']])
+
+
+def prepare_assemble_alluvium(paths, params):
+    from dns_understanding_alluvium import assemble_dataframe
+    return (assemble_dataframe, [paths['fullDataset'], paths['codesPrimary']])
+
+
+def prepare_select_many_dist(paths, params):
+    from scrub_records import select_many_dist
+    from sdns_dataset import read_dataset
+    col = read_dataset(paths['fullDataset'], columns=['Q7.3'])['Q7.3']
+    return (select_many_dist, [col, ' service(s)'])
+
+
+# The figures of dns_understanding_alluvium.py (w/o rendering them)
+def build_alluvia(mergedFrame):
+    from dns_understanding_alluvium import build_alluvium, sdnsPlots
+    return {name: build_alluvium(mergedFrame, **plotSpec) for (name, plotSpec) in sdnsPlots.items()}
+
+
+def prepare_alluvia(paths, params):
+    from dns_understanding_alluvium import assemble_simplified
+    return (build_alluvia, [assemble_simplified(paths['fullDataset'], paths['codesPrimary'])])
+
+
+def prepare_compute_spearman(paths, params):
+    from dns_knowledgeSpearman import assemble_simplified, compute_spearman
+    from likert_encoding import dnsKnowledgeScale, encode_ranks, knowledgeLevelScale
+    mergedFrame = assemble_simplified(paths['fullDataset'], paths['codesPrimary'])
+    numericMframe = encode_ranks(mergedFrame, {'Q3.2':dnsKnowledgeScale, 'simplified_code1':knowledgeLevelScale})
+    return (compute_spearman, [numericMframe, params.resamples, 0.95, params.seed])
+
+
+cases = [
+        Case('scrub_records', 'script', 'scrub_records.py',
+             lambda paths: ['-f', paths['reddit'], '-qn', paths['outDir'], '-ql', paths['outDir'], '-pq', '-s', redditQsf]),
+        Case('scrub_records (chunked)', 'script', 'scrub_records.py',
+             lambda paths: ['-f', paths['reddit'], '-qn', paths['outDir'], '-ql', paths['outDir'], '-s', redditQsf, '-c', '50000']),
+        Case('remove_disqualified', 'script', 'remove_disqualified.py',
+             lambda paths: ['-p', paths['prescreen'], '-m', paths['main'], '-o', paths['prolificDataset'], '-qp', prescreenQsf, '-qm', mainQsf]),
+        Case('assemble_dataframe (dns_knowledgeSpearman)', 'function', prepare_assemble_spearman, None),
+        Case('assemble_dataframe (dns_understanding_alluvium)', 'function', prepare_assemble_alluvium, None),
+        Case('select_many_dist', 'function', prepare_select_many_dist, None),
+        Case('build_alluvium (all figures)', 'function', prepare_alluvia, None),
+        Case('compute_spearman', 'function', prepare_compute_spearman, None)
+        ]
+
+
+# Synthetic exports with numRows responses (generated unless they exist from an earlier run) and
+# the full dataset combined from them, as the pipeline would (see sdns_pipeline.py).
+def prepare_data(dataDir, numRows, seed):
+    from sdns_pipeline import combine_datasets
+    sizeDir = os_join(dataDir, f'{numRows}_{seed}')
+    outDir = os_join(sizeDir, 'out')
+    doneFile = os_join(sizeDir, '.generated')
+    if os_exists(doneFile):
+        with open(doneFile) as f:
+            paths = json.load(f)
+    else:
+        paths = generate_surveys(sizeDir, numRows, seed)
+        paths['outDir'] = outDir
+        paths['redditDataset'] = os_join(outDir, 'SDNS_RedditData_raw_quantitative.parquet')
+        paths['prolificDataset'] = os_join(outDir, 'prolific_datafile.parquet')
+        paths['fullDataset'] = os_join(outDir, 'fullDataset_post_drops.parquet')
+        os_makedirs(outDir, exist_ok=True)
+        measure_script('scrub_records.py', cases[0].args(paths))
+        measure_script('remove_disqualified.py', cases[2].args(paths))
+        combine_datasets([paths['redditDataset'], paths['prolificDataset']], paths['fullDataset'])
+        with open(doneFile, 'w') as f:
+            json.dump(paths, f, indent=1)
+    return paths
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=scriptDir, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain'], cwd=scriptDir, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return (None, None)
+    return (commit, dirty)
+
+
+def environment():
+    (commit, dirty) = git_commit()
+    return {
+            'commit': commit, 'dirty': dirty,
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpus': os_cpu_count()
+            }
+
+
+# Run the selected cases on data of each size repeats times each.
+# Returns one result per case and size: its wall times, their median and the highest peak RSS measured.
+def run_benchmarks(sizes, selected, params):
+    results = list()
+    for numRows in sizes:
+        paths = prepare_data(params.dataDir, numRows, params.seed)
+        for case in selected:
+            runs = [run_case(case, paths, params) for _ in range(params.repeats)]
+            result = {
+                    'case': case.name, 'rows': numRows,
+                    'seconds': [run['seconds'] for run in runs],
+                    'medianSeconds': float(np.median([run['seconds'] for run in runs])),
+                    'peakRssBytes': max(run['peakRssBytes'] for run in runs)
+                    }
+            if case.kind == 'function':
+                result['rssIncreaseBytes'] = max(run['rssIncreaseBytes'] for run in runs)
+            results.append(result)
+            print(f'{case.name} ({numRows} rows): {result["medianSeconds"]:.3f}s, peak RSS {result["peakRssBytes"]/2**20:.0f} MiB')
+    return results
+
+
+# Cases (and sizes) that got slower than in baseline by more than a factor of tolerance.
+def compare_results(results, baseline, tolerance):
+    baseTimes = {(r['case'], r['rows']): r['medianSeconds'] for r in baseline['results']}
+    regressions = list()
+    for result in results:
+        key = (result['case'], result['rows'])
+        if key not in baseTimes:
+            continue
+        ratio = result['medianSeconds']/baseTimes[key] if baseTimes[key] > 0 else float('inf')
+        flag = ' <- slower' if ratio > tolerance else ''
+        print(f'{key[0]} ({key[1]} rows): {baseTimes[key]:.3f}s -> {result["medianSeconds"]:.3f}s (x{ratio:.2f}){flag}')
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+
+
+def parse_inputs(args=None):
+    desc = 'sdns_benchmark.py: times and measures the peak memory of the preprocessing and analysis steps on synthetic exports of increasing size, and stores the results as json.'
+    parser = ArgumentParser(description=desc)
+    parser.add_argument('-n',
+                        dest='sizes',
+                        type=int,
+                        nargs='+',
+                        default=defaultSizes,
+                        help=f'numbers of (Reddit and Prolific prescreen) responses to benchmark with, e.g. -n 1000 1000000 10000000 (default: {" ".join(map(str, defaultSizes))})')
+    parser.add_argument('-k',
+                        dest='cases',
+                        nargs='+',
+                        default=None,
+                        help='only run the cases whose name contains any of these strings (default: all cases)')
+    parser.add_argument('-r',
+                        dest='repeats',
+                        type=int,
+                        default=3,
+                        help='number of runs of each case (default: 3)')
+    parser.add_argument('-R',
+                        dest='resamples',
+                        type=int,
+                        default=1000,
+                        help='number of bootstrap/permutation resamples of compute_spearman (default: 1000)')
+    parser.add_argument('-s',
+                        dest='seed',
+                        type=int,
+                        default=0,
+                        help='seed of the synthetic data and of compute_spearman (default: 0)')
+    parser.add_argument('-D',
+                        dest='dataDir',
+                        type=str,
+                        default='data/benchmarks/synthetic',
+                        help='directory for the synthetic exports, which are reused by later runs (default: data/benchmarks/synthetic)')
+    parser.add_argument('-o',
+                        dest='outfile',
+                        type=str,
+                        default=None,
+                        help='json file to write the results to (default: data/benchmarks/<date>_<commit>.json)')
+    parser.add_argument('-b',
+                        dest='baseline',
+                        type=str,
+                        default=None,
+                        help='json results of an earlier run to compare with; exits with status 1 if any case got slower (see -t)')
+    parser.add_argument('-t',
+                        dest='tolerance',
+                        type=float,
+                        default=1.25,
+                        help='factor by which a case may be slower than in the baseline before it counts as a regression (default: 1.25)')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    params = parse_inputs(args)
+    selected = [case for case in cases if params.cases is None or any(key in case.name for key in params.cases)]
+    env = environment()
+    results = run_benchmarks(params.sizes, selected, params)
+    outfile = params.outfile or os_join('data/benchmarks', f'{env["date"][:10]}_{(env["commit"] or "unknown")[:10]}.json')
+    if os_dirname(outfile):
+        os_makedirs(os_dirname(outfile), exist_ok=True)
+    with open(outfile, 'w') as f:
+        json.dump({'environment': env, 'repeats': params.repeats, 'resamples': params.resamples, 'seed': params.seed,
+                   'results': results}, f, indent=1)
+    print(outfile)
+    if params.baseline:
+        with open(params.baseline) as f:
+            baseline = json.load(f)
+        if compare_results(results, baseline, params.tolerance):
+            sys.exit(1)
+
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Typed, columnar (Parquet) storage for the preprocessed survey data.
+# Preprocessing scripts (scrub_records.py, remove_disqualified.py) can emit their output in this format,
+# and the analysis scripts read it back with column projection (i.e. only the columns they need)
+# rather than re-parsing the full csv each time.
+# Likert columns are stored as ordered categoricals and the mapping of column keys to question text
+# (see get_key_mapping()) is stored in the file's metadata.
+# Datasets that grow by waves (see append_dataset()) are directories holding one part file per wave.
+
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from argparse import ArgumentParser
+from os import makedirs as os_makedirs, remove as os_remove, replace as os_replace, rmdir as os_rmdir, scandir as os_scandir, stat as os_stat
+from os.path import abspath as os_abspath, isdir as os_isdir, isfile as os_isfile, join as os_join
+
+from likert_encoding import likertScales, encode_column
+
+
+# key under which the column -> question text mapping is stored in the parquet metadata
+keyMappingField = b'sdns.key_mapping'
+
+# name of the i-th part file of a dataset directory (see append_dataset())
+partName = 'part-{:05d}.parquet'
+
+# path -> (size, mtime, frame) of the full datasets read so far, if they are kept (see share_datasets())
+sharedDatasets = None
+
+
+# Convert the Likert columns of dataFrame to ordered categoricals (see likert_encoding.likertScales).
+# Raises a ValueError if a column contains answers that are not part of its scale
+# (these would otherwise silently become NaN).
+def encode_likert_columns(dataFrame):
+    dataFrame = dataFrame.copy()
+    for col in dataFrame.keys():
+        if col not in likertScales:
+            continue
+        encoded = encode_column(dataFrame[col], likertScales[col])
+        unknown = dataFrame[col].notna() & encoded.isna()
+        if unknown.any():
+            raise ValueError(f'column {col!r} contains values outside of its scale: {sorted(set(dataFrame[col][unknown]))}')
+        dataFrame[col] = encoded
+    return dataFrame
+
+
+# Arrow schema for an (encoded) dataFrame. String columns are always typed as strings
+# (rather than inferred), so that all-empty columns and chunks written separately share one schema.
+def build_schema(dataFrame, mapDict=None):
+    fields = list()
+    for field in pa.Schema.from_pandas(dataFrame, preserve_index=False):
+        col = dataFrame[field.name]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string(), ordered=True))
+        elif not pd.api.types.is_numeric_dtype(col.dtype) and not pd.api.types.is_bool_dtype(col.dtype):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    schema = pa.schema(fields)
+    if mapDict is not None:
+        schema = schema.with_metadata({keyMappingField: json.dumps(mapDict)})
+    return schema
+
+
+def to_table(dataFrame, schema):
+    table = pa.Table.from_pandas(dataFrame, schema=schema, preserve_index=False)
+    # from_pandas() only keeps the pandas metadata, so re-attach the key mapping
+    return table.replace_schema_metadata({**table.schema.metadata, **(schema.metadata or {})})
+
+
+# Write dataFrame (Likert columns encoded) and its key mapping to path as a parquet file,
+# replacing the dataset at path (a file or a directory of parts) if there is one.
+def write_dataset(dataFrame, path, mapDict=None):
+    dataFrame = encode_likert_columns(dataFrame)
+    table = to_table(dataFrame, build_schema(dataFrame, mapDict))
+    if os_isdir(path):
+        remove_parts(path)
+    pq.write_table(table, path)
+
+
+# Part files of a dataset directory, in the order they were appended.
+def dataset_parts(path):
+    return sorted(entry.path for entry in os_scandir(path) if entry.name.startswith('part-') and entry.name.endswith('.parquet'))
+
+
+def remove_parts(path):
+    for part in dataset_parts(path):
+        os_remove(part)
+    os_rmdir(path)
+
+
+# Append the rows of dataFrame to the dataset at path (or create it) as a part file of their own, so that appending
+# a wave only costs as much as the wave itself (parquet files can't be extended in place).
+# A dataset written by write_dataset() becomes the first part of the directory.
+# The parts share the schema of the first one, and the key mapping is kept unless mapDict is given.
+def append_dataset(dataFrame, path, mapDict=None):
+    if os_isfile(path):
+        tmpPath = f'{path}.{os.getpid()}.tmp'
+        os_replace(path, tmpPath)
+        os_makedirs(path)
+        os_replace(tmpPath, os_join(path, partName.format(0)))
+    os_makedirs(path, exist_ok=True)
+    parts = dataset_parts(path)
+    dataFrame = encode_likert_columns(dataFrame)
+    if parts:
+        mapDict = mapDict if mapDict is not None else read_key_mapping(path)
+        schema = pq.read_schema(parts[0]).remove_metadata()
+        schema = schema.with_metadata({keyMappingField: json.dumps(mapDict)}) if mapDict is not None else schema
+    else:
+        schema = build_schema(dataFrame, mapDict)
+    partPath = os_join(path, partName.format(len(parts)))
+    # written under a temporary name first, so readers never see a partial part
+    tmpPath = f'{partPath}.{os.getpid()}.tmp'
+    pq.write_table(to_table(dataFrame, schema), tmpPath)
+    os_replace(tmpPath, partPath)
+
+
+# Incremental counterpart to write_dataset(): the schema is fixed by the first chunk,
+# which is why all columns are typed explicitly in build_schema().
+class DatasetWriter:
+    def __init__(self, path, mapDict=None):
+        self.path = path
+        self.mapDict = mapDict
+        self.schema = None
+        self.writer = None
+
+    def write(self, chunk):
+        chunk = encode_likert_columns(chunk)
+        if self.writer is None:
+            self.schema = build_schema(chunk, self.mapDict)
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        self.writer.write_table(to_table(chunk, self.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+# Read (a subset of the columns of) a dataset written by write_dataset() or append_dataset().
+def read_dataset(path, columns=None):
+    if os_isdir(path):
+        return pq.read_table(dataset_parts(path), columns=columns).to_pandas()
+    return pd.read_parquet(path, columns=columns)
+
+
+# Read the column key -> question text mapping stored with a dataset (that of its last part, for a directory).
+def read_key_mapping(path):
+    metadata = pq.read_schema(dataset_parts(path)[-1] if os_isdir(path) else path).metadata or {}
+    if keyMappingField not in metadata:
+        return dict()
+    return json.loads(metadata[keyMappingField])
+
+
+def is_dataset_file(path):
+    return str(path).endswith('.parquet')
+
+
+# Load only the given columns (all of them if None) of the full dataset, either from a parquet dataset
+# or (for backwards compatibility) from the csv export, e.g. data/fullDataset_post_drops.csv
+# If datasets are shared (see share_datasets()), the whole dataset is read once and the columns are copied out of it.
+def load_full_dataset(path, columns):
+    if sharedDatasets is not None:
+        dataFrame = shared_dataset(path)
+        return (dataFrame if columns is None else dataFrame[columns]).copy()
+    if is_dataset_file(path):
+        return read_dataset(path, columns=columns)
+    if columns is None:
+        return pd.read_csv(path)
+    return pd.read_csv(path, usecols=columns)[columns]
+
+
+# Keep the datasets read by load_full_dataset() in memory, so that several analyses run in the same process
+# (see sdns.py) read each dataset only once.
+def share_datasets():
+    global sharedDatasets
+    if sharedDatasets is None:
+        sharedDatasets = dict()
+
+
+def shared_dataset(path):
+    info = os_stat(path)
+    stamp = (info.st_size, info.st_mtime_ns)
+    key = os_abspath(path)
+    if key not in sharedDatasets or sharedDatasets[key][:2] != stamp:
+        sharedDatasets[key] = stamp+(read_dataset(path) if is_dataset_file(path) else pd.read_csv(path),)
+    return sharedDatasets[key][2]
+
+
+
+
+def parse_inputs(args=None):
+    desc = 'sdns_dataset.py: converts a preprocessed dataset exported as a csv (e.g. data/fullDataset_post_drops.csv) into the typed, columnar format read by the analysis scripts.'
+    parser = ArgumentParser(description=desc)
+    parser.add_argument('-i',
+                        dest='infile',
+                        type=str,
+                        default='data/fullDataset_post_drops.csv',
+                        help='(full or relative) filepath of the csv to convert (default: \'data/fullDataset_post_drops.csv\')')
+    parser.add_argument('-o',
+                        dest='outfile',
+                        type=str,
+                        default='data/fullDataset_post_drops.parquet',
+                        help='(full or relative) filepath of the resulting dataset (default: \'data/fullDataset_post_drops.parquet\')')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    params = parse_inputs(args)
+    dataFrame = pd.read_csv(params.infile, index_col=0)
+    write_dataset(dataFrame, params.outfile)
+
+
+
+if __name__=='__main__':
+    main()
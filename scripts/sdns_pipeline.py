@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Runs the whole preprocessing and analysis pipeline for a (new) wave of responses:
+#
+#   scrub (Reddit export) ------------\
+#                                      >-- combine --+-- spearman
+#   disqualify/merge (Prolific) ------/              +-- correlation matrix
+#                                                    +-- alluvium figures
+#
+# Each stage runs the existing script (or function) in a process of its own, and stages whose dependencies
+# have finished run concurrently (i.e. both survey sources, then all analyses and figures).
+# A stage is skipped if its outputs exist and neither its input files (by content hash), its parameters
+# nor the scripts changed since it last ran; the state of each stage is kept in <outDir>/.pipeline/<stage>.json.
+# The Q3.3 codes are joined to the responses (by ResponseId, that of the prescreen for Prolific participants, see
+# remove_disqualified.py) by the analysis scripts themselves, so the coding csv is an input of each analysis stage
+# rather than a stage of its own. The combine stage checks that the rows of all sources can be joined that way.
+
+import json
+import os
+import subprocess
+import sys
+import time
+import pandas as pd
+
+from argparse import ArgumentParser
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait as futures_wait, FIRST_COMPLETED
+from os import makedirs as os_makedirs
+from os.path import abspath as os_abspath, basename as os_basename, dirname as os_dirname, exists as os_exists, join as os_join, splitext as os_splitext
+
+from instrumentation import add_arguments as add_instrumentation_arguments, configure as configure_instrumentation, record_stage
+from result_cache import code_digest, hash_file
+from sdns_dataset import read_dataset, read_key_mapping, write_dataset
+
+
+scriptDir = os_dirname(os_abspath(__file__))
+
+# action: module level function run (in a worker process) as action(*args)
+Stage = namedtuple('Stage', ['name', 'deps', 'inputs', 'outputs', 'action', 'args'])
+
+
+
+# Run one of the scripts in this directory with the given command line arguments.
+# Its output is written to logFile (its output is the result of some of the analyses).
+def run_script(script, args, logFile):
+    with open(logFile, 'w') as log:
+        subprocess.run([sys.executable, os_join(scriptDir, script)]+list(args), stdout=log, stderr=subprocess.STDOUT, check=True)
+
+
+# columns every survey source must have: the key of the Q3.3 codes and the nonce of the hidden DNS test (see resolver_logs.py)
+keyCols = ['ResponseId', 'random_id']
+
+# suffixes pandas gives the columns of both sides of a merge that aren't merged on
+mergeSuffixes = ('_x', '_y')
+
+
+# Strip the whitespace around the labels of categorical columns (in place), where the surveys' definitions differ only in it
+# (e.g. the Reddit survey's 'High school graduate (...) ' for Q13.2), so the columns of different sources share a scale.
+def strip_labels(frames):
+    for frame in frames:
+        for col in frame.keys():
+            if isinstance(frame[col].dtype, pd.CategoricalDtype):
+                categories = frame[col].cat.categories
+                if categories.dtype != object and not pd.api.types.is_string_dtype(categories.dtype):
+                    continue
+                stripped = [label.strip() for label in categories]
+                if stripped != list(categories) and len(set(stripped)) == len(stripped):
+                    frame[col] = frame[col].cat.rename_categories(stripped)
+    return frames
+
+
+# Raise a ValueError if the datasets (datasetFile -> frame) can't be combined: if one lacks any of keyCols,
+# a ResponseId appears more than once, a column has different types (e.g. Likert scales) in different datasets,
+# or has been duplicated by a merge (e.g. random_id_x). Columns only some of the datasets have are fine (e.g. Q16).
+def check_combinable(frames):
+    problems = list()
+    dtypes = dict()
+    for (datasetFile, frame) in frames.items():
+        missing = [col for col in keyCols if col not in frame]
+        if missing:
+            problems.append(f'{datasetFile}: no column(s) {missing}')
+        merged = [col for col in frame.keys() if col.endswith(mergeSuffixes) and (col[:-2] in frame or col[:-2] in keyCols
+                  or any(col[:-2]+suffix in frame for suffix in mergeSuffixes if not col.endswith(suffix)))]
+        if merged:
+            problems.append(f'{datasetFile}: column(s) duplicated by a merge {merged}')
+        for col in frame.keys():
+            dtypes.setdefault(col, dict())[datasetFile] = frame[col].dtype
+    for (col, colTypes) in dtypes.items():
+        if len(colTypes) > 1 and any(dtype != next(iter(colTypes.values())) for dtype in colTypes.values()):
+            problems.append(f'column {col!r} has different types: ' + ', '.join(f'{dtype} ({datasetFile})' for (datasetFile, dtype) in colTypes.items()))
+    if all('ResponseId' in frame for frame in frames.values()):
+        responseIds = pd.concat([frame['ResponseId'] for frame in frames.values()], ignore_index=True)
+        duplicated = responseIds[responseIds.duplicated()].unique().tolist()
+        if duplicated:
+            problems.append(f'{len(duplicated)} ResponseId(s) appear more than once, e.g. {duplicated[:5]}')
+    if problems:
+        raise ValueError('datasets can\'t be combined:\n  ' + '\n  '.join(problems))
+
+
+# Combine the datasets of all survey sources into the full dataset (and their key mappings into its mapping).
+def combine_datasets(datasetFiles, outfile):
+    frames = strip_labels([read_dataset(datasetFile) for datasetFile in datasetFiles])
+    check_combinable(dict(zip(datasetFiles, frames)))
+    mapDict = dict()
+    for datasetFile in datasetFiles:
+        mapDict.update(read_key_mapping(datasetFile))
+    write_dataset(pd.concat(frames, ignore_index=True), outfile, mapDict)
+
+
+# What a stage's result depends on: the content of its inputs, what it is run with and the code of the scripts.
+def stage_stamp(stage):
+    return {
+            'action': stage.action.__name__,
+            'args': json.loads(json.dumps(stage.args)),
+            'inputs': {path: hash_file(path) for path in stage.inputs},
+            'code': code_digest()
+            }
+
+
+def state_file(stateDir, stage):
+    return os_join(stateDir, stage.name+'.json')
+
+
+def is_up_to_date(stage, stamp, stateDir):
+    if not all(os_exists(path) for path in stage.outputs) or not os_exists(state_file(stateDir, stage)):
+        return False
+    with open(state_file(stateDir, stage)) as f:
+        return json.load(f) == stamp
+
+
+def save_state(stage, stamp, stateDir):
+    with open(state_file(stateDir, stage), 'w') as f:
+        json.dump(stamp, f, indent=1)
+
+
+# Runs in a worker process; returns (name, start (seconds since the epoch), seconds taken, pid of the worker).
+def run_stage(stage):
+    (start, startCounter) = (time.time(), time.perf_counter())
+    stage.action(*stage.args)
+    return (stage.name, start, time.perf_counter()-startCounter, os.getpid())
+
+
+# The pipeline's stages (in an order that respects their dependencies) for the given input files.
+def build_stages(params):
+    (outDir, analysisDir) = (params.outDir, os_join(params.outDir, 'analysis'))
+    redditStem = os_splitext(os_basename(params.redditFile))[0]
+    (quantDir, qualDir) = (os_join(outDir, 'quantitative'), os_join(outDir, 'qualitative'))
+    redditDataset = os_join(quantDir, redditStem+'_quantitative.parquet')
+    prolificDataset = os_join(outDir, 'prolific_datafile.parquet')
+    fullDataset = os_join(outDir, 'fullDataset_post_drops.parquet')
+    spearmanLog = os_join(analysisDir, 'dns_knowledge_spearman.txt')
+    matrixFile = os_join(analysisDir, 'correlation_matrix.csv')
+
+    stages = [
+            Stage('scrub', [], [params.redditFile, params.redditQsf],
+                  [redditDataset, os_join(qualDir, redditStem+'_qualitative.csv')],
+                  run_script, ['scrub_records.py', ['-f', params.redditFile, '-qn', quantDir, '-ql', qualDir, '-pq', '-s', params.redditQsf],
+                               os_join(analysisDir, 'scrub_records.txt')]),
+            Stage('disqualify', [], [params.prescreenFile, params.mainFile, params.prescreenQsf, params.mainQsf],
+                  [prolificDataset],
+                  run_script, ['remove_disqualified.py', ['-p', params.prescreenFile, '-m', params.mainFile, '-o', prolificDataset,
+                                                          '-qp', params.prescreenQsf, '-qm', params.mainQsf],
+                               os_join(analysisDir, 'remove_disqualified.txt')]),
+            Stage('combine', ['scrub', 'disqualify'], [redditDataset, prolificDataset], [fullDataset],
+                  combine_datasets, [[redditDataset, prolificDataset], fullDataset]),
+            Stage('spearman', ['combine'], [fullDataset, params.codesFile], [spearmanLog],
+                  run_script, ['dns_knowledgeSpearman.py', ['-f', fullDataset, '-d', params.codesFile, '-s', str(params.seed)], spearmanLog]),
+            Stage('correlation_matrix', ['combine'], [fullDataset, params.codesFile], [matrixFile],
+                  run_script, ['dns_knowledgeSpearman.py', ['-f', fullDataset, '-d', params.codesFile, '-m', '-o', matrixFile],
+                               os_join(analysisDir, 'correlation_matrix.txt')]),
+            Stage('alluvium', ['combine'], [fullDataset, params.codesFile], [params.figDir],
+                  run_script, ['dns_understanding_alluvium.py', ['-f', fullDataset, '-d', params.codesFile, '-b', '-o', params.figDir],
+                               os_join(analysisDir, 'dns_understanding_alluvium.txt')])
+            ]
+    for directory in (quantDir, qualDir, analysisDir, os_join(outDir, '.pipeline')):
+        os_makedirs(directory, exist_ok=True)
+    return stages
+
+
+# Run stages with up to workers of them at a time. A stage is started as soon as all of its dependencies
+# have finished (or were up to date); if a stage fails, the stages depending on it are not run.
+# Returns the status of each stage ('ran', 'skipped', 'failed' or 'not run').
+def run_pipeline(stages, stateDir, workers=None, force=False):
+    status = dict()
+    pending = list(stages)
+    running = dict()
+    stamps = dict()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for stage in list(pending):
+                depStatus = [status.get(dep) for dep in stage.deps]
+                if any(s in ('failed', 'not run') for s in depStatus):
+                    status[stage.name] = 'not run'
+                elif all(s in ('ran', 'skipped') for s in depStatus):
+                    stamps[stage.name] = stage_stamp(stage)
+                    if not force and is_up_to_date(stage, stamps[stage.name], stateDir):
+                        status[stage.name] = 'skipped'
+                        print(f'{stage.name}: up to date')
+                    else:
+                        running[pool.submit(run_stage, stage)] = stage
+                        print(f'{stage.name}: started')
+                else:
+                    continue
+                pending.remove(stage)
+            if not running:
+                # stages waiting for dependencies that aren't part of the pipeline
+                for stage in pending:
+                    status[stage.name] = 'not run'
+                break
+            (done, _) = futures_wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    (name, start, seconds, pid) = future.result()
+                except Exception as e:
+                    status[stage.name] = 'failed'
+                    print(f'{stage.name}: failed ({e})')
+                    continue
+                save_state(stage, stamps[stage.name], stateDir)
+                record_stage(name, start, seconds, pid=pid)
+                status[stage.name] = 'ran'
+                print(f'{stage.name}: done in {seconds:.1f}s')
+    return status
+
+
+
+
+def parse_inputs(args=None):
+    desc = 'sdns_pipeline.py: runs scrub_records.py, remove_disqualified.py, the combination of their outputs into the full dataset, and the analysis and plotting scripts on it, in parallel where possible and skipping steps whose inputs have not changed.'
+    parser = ArgumentParser(description=desc)
+    parser.add_argument('-r',
+                        dest='redditFile',
+                        type=str,
+                        default='data/SDNS_RedditData_raw.csv',
+                        help='raw export of the Reddit survey (default: data/SDNS_RedditData_raw.csv)')
+    parser.add_argument('-p',
+                        dest='prescreenFile',
+                        type=str,
+                        default='data/SDNS-ProlificPrescreen_12July21.csv',
+                        help='raw export of the Prolific prescreen survey (default: data/SDNS-ProlificPrescreen_12July21.csv)')
+    parser.add_argument('-m',
+                        dest='mainFile',
+                        type=str,
+                        default='data/SDNS-ProlificMain_12July21.csv',
+                        help='raw export of the Prolific main survey (default: data/SDNS-ProlificMain_12July21.csv)')
+    parser.add_argument('-sr',
+                        dest='redditQsf',
+                        type=str,
+                        default='survey_instruments/reddit/Smart_DNS.qsf',
+                        help='QSF file of the Reddit survey (default: survey_instruments/reddit/Smart_DNS.qsf)')
+    parser.add_argument('-sp',
+                        dest='prescreenQsf',
+                        type=str,
+                        default='survey_instruments/prolific/SmartDNS-Prescreen.qsf',
+                        help='QSF file of the Prolific prescreen survey (default: survey_instruments/prolific/SmartDNS-Prescreen.qsf)')
+    parser.add_argument('-sm',
+                        dest='mainQsf',
+                        type=str,
+                        default='survey_instruments/prolific/SDNS_-Main_Survey.qsf',
+                        help='QSF file of the Prolific main survey (default: survey_instruments/prolific/SDNS_-Main_Survey.qsf)')
+    parser.add_argument('-d',
+                        dest='codesFile',
+                        type=str,
+                        default='data/Response_Coding-deidentified - Q3.3-Primary.csv',
+                        help='coding of the responses to Q3.3 (default: \'data/Response_Coding-deidentified - Q3.3-Primary.csv\')')
+    parser.add_argument('-o',
+                        dest='outDir',
+                        type=str,
+                        default='data',
+                        help='directory for the intermediate datasets and analysis results (default: data)')
+    parser.add_argument('-g',
+                        dest='figDir',
+                        type=str,
+                        default='figures/sdnsAlluvians',
+                        help='directory for the figures (default: figures/sdnsAlluvians)')
+    parser.add_argument('-s',
+                        dest='seed',
+                        type=int,
+                        default=0,
+                        help='seed for the resampling in the Spearman analysis, so its results only change with its inputs (default: 0)')
+    parser.add_argument('-w',
+                        dest='workers',
+                        type=int,
+                        default=None,
+                        help='maximum number of stages to run at the same time (default: number of CPUs)')
+    parser.add_argument('-F',
+                        dest='force',
+                        action='store_true',
+                        help='re-run all stages, even if their inputs have not changed.')
+    add_instrumentation_arguments(parser)
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    params = parse_inputs(args)
+    configure_instrumentation(params)
+    stages = build_stages(params)
+    status = run_pipeline(stages, os_join(params.outDir, '.pipeline'), params.workers, params.force)
+    if any(s in ('failed', 'not run') for s in status.values()):
+        sys.exit(1)
+
+
+
+if __name__=='__main__':
+    main()
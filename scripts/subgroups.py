@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Subgroup breakdowns of the survey results: the answer distributions of the Likert (and other single choice) items,
+# the prevalence of the options of the multi-select items, cross-tabs of pairs of items and the rank correlations
+# between the ordinal items, for every level of one or more demographic columns (groupings), e.g. per age
+# group (Q13.1), level of education (Q13.2), country (Q13.3), income (Q13.6) or age x income (Q13.1+Q13.6).
+# Every column is encoded into category codes once, and all groups of a grouping are counted together:
+# - distributions and multi-select counts are the product of a (group x respondent) indicator matrix with the
+#   one-hot matrix of the items (see rank_correlation.one_hot()) and the option indicator matrices (see multi_select.py)
+# - the contingency tables of all pairs of the paired (ordinal and cross-tabulated) items of every group are the product
+#   of their one-hot matrix, with the columns of each respondent shifted to the block of their group, with the plain
+#   one-hot matrix; the rank correlations of each group follow from its tables (see rank_correlation.spearman_from_tables()).
+# So the cost is linear in the number of responses and next to independent of the number of groups, whereas
+# rerunning the analysis on a filtered copy of the data per group grows with the number of groups.
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from argparse import ArgumentParser
+from collections import namedtuple
+from os import makedirs as os_makedirs
+from os.path import join as os_join
+
+from instrumentation import add_arguments as add_instrumentation_arguments, configure as configure_instrumentation, stage
+from likert_encoding import ascending_scale, encode_codes, likertScales
+from multi_select import indicator_matrix
+from qsf_schema import load_schema, multi_select_options, schema_scales
+from rank_correlation import adjust_pvalues, kendall_from_table, one_hot, spearman_from_tables
+from sdns_dataset import load_full_dataset
+
+
+# Q13.1: What is your age?
+# Q13.2: What is the highest level of school you have completed or the highest degree you have received?
+# Q13.3: In which country do you live?
+# Q13.4: What is your nationality?
+# Q13.5: What is the gender to which you most closely identify?
+# Q13.6: What is your annual income in US Dollars?
+demographicCols = ['Q13.1','Q13.2','Q13.3','Q13.4','Q13.5','Q13.5_4_TEXT','Q13.6']
+defaultGroupings = ['Q13.1', 'Q13.2', 'Q13.3', 'Q13.6']
+allGroup = '(all)'
+
+# codes: category code of each row (-1 if missing); levels: the label of each code
+EncodedColumn = namedtuple('EncodedColumn', ['name', 'codes', 'levels'])
+
+# Frames in long format, each with a grouping (e.g. 'Q13.1', 'Q13.1+Q13.6' or '(all)') and group column:
+# groups: respondents per group (and whether the group was reported, see minSize)
+# distributions: item, level, count, proportion (of the group's answers to the item)
+# multiSelect: item, option, count, respondents (of the group that answered the item), prevalence
+# crosstabs: row, column, rowLevel, columnLevel, count
+# correlations: column1, column2, <method>, pval, adjPval (within the group), n
+SubgroupResult = namedtuple('SubgroupResult', ['groups', 'distributions', 'multiSelect', 'crosstabs', 'correlations'])
+
+
+
+# Category codes of col: its positions in scale if given, the categories of a categorical column,
+# its distinct values in sorted order otherwise.
+def encode_item(col, scale=None):
+    if scale is not None:
+        return EncodedColumn(col.name, encode_codes(col, scale).astype(np.int64), list(scale.categories))
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        return EncodedColumn(col.name, col.cat.codes.to_numpy().astype(np.int64), list(col.cat.categories))
+    (codes, levels) = pd.factorize(col, sort=True)
+    return EncodedColumn(col.name, codes.astype(np.int64), list(levels))
+
+
+# Groups of the respondents by their combination of answers to columns. Only combinations that occur are groups,
+# in the order of the levels; respondents missing any of the columns are in no group (-1).
+def encode_groups(dataFrame, columns, scales=None):
+    scales = dict() if scales is None else scales
+    encoded = [encode_item(dataFrame[col], scales.get(col)) for col in columns]
+    codes = np.column_stack([e.codes for e in encoded])
+    valid = (codes >= 0).all(axis=1)
+    shape = [max(len(e.levels), 1) for e in encoded]
+    (groupIds, groups) = np.unique(np.ravel_multi_index(codes[valid].T, shape), return_inverse=True)
+    groupCodes = np.full(len(codes), -1, dtype=np.int64)
+    groupCodes[valid] = groups.reshape(-1)
+    labels = [' | '.join(str(e.levels[i]) for (e, i) in zip(encoded, levelCodes))
+              for levelCodes in zip(*np.unravel_index(groupIds, shape))]
+    return EncodedColumn('+'.join(columns), groupCodes, labels)
+
+
+# Sparse (groups x respondents) indicator matrix of the group of each respondent.
+def group_matrix(groups):
+    rows = np.flatnonzero(groups.codes >= 0)
+    return sp.csr_matrix((np.ones(len(rows)), (groups.codes[rows], rows)), shape=(len(groups.levels), len(groups.codes)))
+
+
+# Contingency tables of all pairs of the columns of oneHot (see rank_correlation.one_hot()) within each group:
+# a (groups x levels x levels) array, where tables[g] is what rank_correlation.contingency_tables() gives for
+# the respondents of group g alone.
+def grouped_tables(oneHot, groups):
+    (numGroups, numLevels) = (len(groups.levels), oneHot.shape[1])
+    rows = np.flatnonzero(groups.codes >= 0)
+    matrix = oneHot[rows]
+    shift = np.repeat(groups.codes[rows]*numLevels, np.diff(matrix.indptr))
+    shifted = sp.csr_matrix((matrix.data, matrix.indices+shift, matrix.indptr), shape=(len(rows), numGroups*numLevels))
+    return (shifted.T @ matrix).toarray().reshape(numGroups, numLevels, numLevels)
+
+
+# Long frame of the nonzero cells of counts (groups x levels), with the group and level labels of each cell.
+def long_counts(counts, groups, levels, countName='count'):
+    (g, k) = np.nonzero(counts)
+    return pd.DataFrame({'group': np.asarray(groups.levels, dtype=object)[g], 'level': np.asarray(levels, dtype=object)[k],
+                         countName: counts[g, k].astype(np.int64)})
+
+
+def distributions_frame(counts, groups, items, offsets):
+    (g, k) = np.nonzero(counts)
+    itemIdx = np.searchsorted(offsets, k, side='right')-1
+    totals = np.add.reduceat(counts, offsets[:-1], axis=1) if len(items) else np.zeros((len(groups.levels), 0))
+    return pd.DataFrame({'group': np.asarray(groups.levels, dtype=object)[g],
+                         'level': np.asarray([level for item in items for level in item.levels], dtype=object)[k],
+                         'count': counts[g, k].astype(np.int64), 'proportion': counts[g, k]/totals[g, itemIdx],
+                         'item': np.asarray([item.name for item in items], dtype=object)[itemIdx]})
+
+
+def multi_select_frame(matrix, multiSelects, groups):
+    frames = list()
+    for (col, multiSelect) in multiSelects.items():
+        counts = np.asarray((matrix @ multiSelect.matrix).todense())
+        respondents = matrix @ multiSelect.answered.astype(float)
+        frame = long_counts(counts, groups, multiSelect.options).rename(columns={'level': 'option'})
+        frame['respondents'] = respondents[groups_of(frame, groups)].astype(np.int64)
+        frame['prevalence'] = frame['count']/frame['respondents']
+        frames.append(frame.assign(item=col))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['group', 'option', 'count', 'respondents', 'prevalence', 'item'])
+
+
+def groups_of(frame, groups):
+    return pd.Index(groups.levels).get_indexer(frame['group'])
+
+
+def crosstabs_frame(tables, groups, paired, pairOffsets, crosstabs):
+    frames = list()
+    names = [item.name for item in paired]
+    for (rowCol, colCol) in crosstabs:
+        (i, j) = (names.index(rowCol), names.index(colCol))
+        block = tables[:, pairOffsets[i]:pairOffsets[i+1], pairOffsets[j]:pairOffsets[j+1]]
+        (g, a, b) = np.nonzero(block)
+        frames.append(pd.DataFrame({'group': np.asarray(groups.levels, dtype=object)[g], 'row': rowCol, 'column': colCol,
+                                    'rowLevel': np.asarray(paired[i].levels, dtype=object)[a],
+                                    'columnLevel': np.asarray(paired[j].levels, dtype=object)[b],
+                                    'count': block[g, a, b].astype(np.int64)}))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['group', 'row', 'column', 'rowLevel', 'columnLevel', 'count'])
+
+
+# The rank correlations of every pair of ranked within each group: spearman's rho of all groups at once
+# (see rank_correlation.spearman_from_tables()), kendall's tau-b per group; p-values are adjusted within each group.
+def correlations_frame(tables, groups, ranked, pairOffsets, method, correction):
+    (upperI, upperJ) = np.triu_indices(len(ranked), k=1)
+    numGroups = len(groups.levels)
+    (coef, pval, counts) = (np.zeros((numGroups, len(upperI))), np.zeros((numGroups, len(upperI))), np.zeros((numGroups, len(upperI))))
+    for (k, (i, j)) in enumerate(zip(upperI, upperJ)):
+        block = tables[:, pairOffsets[i]:pairOffsets[i+1], pairOffsets[j]:pairOffsets[j+1]]
+        if method == 'spearman':
+            (coef[:, k], pval[:, k], counts[:, k]) = spearman_from_tables(block)
+        else:
+            for g in range(numGroups):
+                (coef[g, k], pval[g, k], counts[g, k]) = kendall_from_table(block[g])
+    adjPval = np.array([adjust_pvalues(groupPval, correction) for groupPval in pval]).reshape(pval.shape)
+    columns = np.asarray([item.name for item in ranked], dtype=object)
+    return pd.DataFrame({'group': np.repeat(np.asarray(groups.levels, dtype=object), len(upperI)),
+                         'column1': np.tile(columns[upperI], numGroups), 'column2': np.tile(columns[upperJ], numGroups),
+                         method: coef.ravel(), 'pval': pval.ravel(), 'adjPval': adjPval.ravel(), 'n': counts.ravel().astype(np.int64)})
+
+
+# All breakdowns of one grouping (see SubgroupResult). items: encoded single choice items (see encode_item());
+# oneHot/offsets: their one-hot matrix; paired: the ranked items followed by the other cross-tabulated items, and
+# pairHot/pairOffsets their one-hot matrix; multiSelects: col -> indicator matrix (see multi_select.indicator_matrix()).
+def grouping_breakdown(groups, items, oneHot, offsets, paired, pairHot, pairOffsets, numRanked, multiSelects,
+                       crosstabs, method, correction, minSize):
+    matrix = group_matrix(groups)
+    sizes = np.asarray(matrix.sum(axis=1)).ravel().astype(np.int64)
+    groupFrame = pd.DataFrame({'group': groups.levels, 'respondents': sizes, 'reported': sizes >= minSize})
+    # small groups are left out of the breakdowns
+    kept = np.flatnonzero(sizes >= minSize)
+    keptCodes = np.full(len(groups.levels)+1, -1, dtype=np.int64)
+    keptCodes[kept] = np.arange(len(kept))
+    groups = EncodedColumn(groups.name, keptCodes[groups.codes], [groups.levels[g] for g in kept])
+    matrix = matrix[kept]
+    distributions = distributions_frame(np.asarray((matrix @ oneHot).todense()), groups, items, offsets)
+    multiSelect = multi_select_frame(matrix, multiSelects, groups)
+    tables = grouped_tables(pairHot, groups)
+    crosstabFrame = crosstabs_frame(tables, groups, paired, pairOffsets, crosstabs)
+    correlations = correlations_frame(tables, groups, paired[:numRanked], pairOffsets, method, correction)
+    return SubgroupResult(groupFrame, distributions, multiSelect, crosstabFrame, correlations)
+
+
+# Breakdowns of dataFrame by each of groupings (lists of columns, each grouping respondents by their combination of
+# answers to its columns), and of all respondents as a whole (grouping and group allGroup).
+# scales: col -> pd.CategoricalDtype to encode single choice items and grouping columns onto (otherwise categorical
+# columns keep their categories and others are factorized); multiCols: multi-select columns, optionsByCol: their
+# options (col -> list, e.g. from the QSF); ranked: ordinal items correlated with each other (method/correction as for
+# rank_correlation.correlation_matrix()); crosstabs: pairs of items (row, column) to cross-tabulate.
+# Groups with fewer than minSize respondents are counted but not broken down.
+def subgroup_breakdowns(dataFrame, groupings, items, scales=None, multiCols=None, optionsByCol=None, ranked=None, crosstabs=None,
+                        method='spearman', correction='holm', minSize=1):
+    (scales, optionsByCol) = (dict() if scales is None else scales, dict() if optionsByCol is None else optionsByCol)
+    (multiCols, crosstabs) = (list() if multiCols is None else multiCols, list() if crosstabs is None else crosstabs)
+    ranked = list(dict.fromkeys(ranked or []))
+    encoded = {col: encode_item(dataFrame[col], scales.get(col)) for col in dict.fromkeys(list(items)+[c for pair in crosstabs for c in pair])}
+    # ranked items run from their least to their most positive answer, so every correlation's sign means the same
+    pairEncoded = {**encoded, **{col: encode_item(dataFrame[col], ascending_scale(scales[col]) if col in scales else None) for col in ranked}}
+    itemList = [encoded[col] for col in items]
+    (oneHot, offsets) = one_hot(np.column_stack([e.codes for e in itemList]) if itemList else np.zeros((len(dataFrame), 0), dtype=np.int64),
+                                [len(e.levels) for e in itemList])
+    paired = [pairEncoded[col] for col in dict.fromkeys(list(ranked)+[c for pair in crosstabs for c in pair])]
+    (pairHot, pairOffsets) = one_hot(np.column_stack([e.codes for e in paired]) if paired else np.zeros((len(dataFrame), 0), dtype=np.int64),
+                                     [len(e.levels) for e in paired])
+    multiSelects = {col: indicator_matrix(dataFrame[col], optionsByCol.get(col)) for col in multiCols}
+    allRespondents = EncodedColumn(allGroup, np.zeros(len(dataFrame), dtype=np.int64), [allGroup])
+    results = list()
+    for groups in [allRespondents]+[encode_groups(dataFrame, grouping, scales) for grouping in groupings]:
+        with stage(f'grouping_breakdown ({groups.name})') as s:
+            result = grouping_breakdown(groups, itemList, oneHot, offsets, paired, pairHot, pairOffsets, len(ranked), multiSelects,
+                                        crosstabs, method, correction, minSize)
+            results.append(SubgroupResult(*[frame.assign(grouping=groups.name) for frame in result]))
+            s.record(rows=len(result.groups))
+    columnOrder = {
+            'groups': ['grouping', 'group', 'respondents', 'reported'],
+            'distributions': ['grouping', 'group', 'item', 'level', 'count', 'proportion'],
+            'multiSelect': ['grouping', 'group', 'item', 'option', 'count', 'respondents', 'prevalence'],
+            'crosstabs': ['grouping', 'group', 'row', 'column', 'rowLevel', 'columnLevel', 'count'],
+            'correlations': ['grouping', 'group', 'column1', 'column2', method, 'pval', 'adjPval', 'n']
+            }
+    return SubgroupResult(*[pd.concat([getattr(r, field) for r in results], ignore_index=True)[columnOrder[field]]
+                            for field in SubgroupResult._fields])
+
+
+# Single choice items of dataFrame: columns with a scale (see likert_encoding.likertScales and, if given, the QSF)
+# or with categorical answers (e.g. of a dataset written by sdns_dataset.py), other than the demographics.
+def default_items(dataFrame, scales):
+    return [col for col in dataFrame.columns
+            if col not in demographicCols and (col in scales or isinstance(dataFrame[col].dtype, pd.CategoricalDtype))]
+
+
+def write_result(result, outDir):
+    os_makedirs(outDir, exist_ok=True)
+    for (field, frame) in zip(SubgroupResult._fields, result):
+        frame.to_csv(os_join(outDir, f'{field}.csv'), index=False)
+
+
+def parse_inputs(args=None):
+    desc = 'subgroups.py: breaks the answer distributions, multi-select prevalences, cross-tabs and rank correlations of the survey down by every level of one or more demographic columns (e.g. Q13.1 age, Q13.2 education, Q13.3 country, Q13.6 income) in a single grouped pass over the data.'
+    parser = ArgumentParser(description=desc)
+    parser.add_argument('-f',
+                        dest='fullDfFile',
+                        type=str,
+                        required=True,
+                        help='dataset to break down: a dataset written by sdns_dataset.py (e.g. data/fullDataset_post_drops.parquet) or a csv without the Qualtrics header rows')
+    parser.add_argument('-g',
+                        dest='groupings',
+                        nargs='+',
+                        default=defaultGroupings,
+                        help=f'demographic column(s) to break the results down by; columns joined by + are combined into one grouping, e.g. Q13.1+Q13.6 (default: {" ".join(defaultGroupings)})')
+    parser.add_argument('-i',
+                        dest='items',
+                        nargs='+',
+                        default=None,
+                        help='single choice items whose answer distributions are broken down (default: all Likert items and categorical columns other than the demographics)')
+    parser.add_argument('-m',
+                        dest='multiCols',
+                        nargs='+',
+                        default=None,
+                        help='multi-select items whose options\' prevalence is broken down (default: the multi-select questions of the QSF, if given)')
+    parser.add_argument('-r',
+                        dest='ranked',
+                        nargs='+',
+                        default=None,
+                        help='ordinal items whose pairwise rank correlations are broken down (default: the Likert items of likert_encoding.py)')
+    parser.add_argument('-x',
+                        dest='crosstabs',
+                        nargs='+',
+                        default=[],
+                        help='pairs of items to cross-tabulate per group, as <row>:<column>, e.g. Q3.2:Q4.5')
+    parser.add_argument('-q',
+                        dest='qsfFile',
+                        type=str,
+                        default=None,
+                        help='QSF of the survey, for the answer scales of the single choice items and the options of the multi-select items')
+    parser.add_argument('-M',
+                        dest='method',
+                        choices=['spearman', 'kendall'],
+                        default='spearman',
+                        help='rank correlation coefficient (default: spearman)')
+    parser.add_argument('-c',
+                        dest='correction',
+                        choices=['holm', 'bonferroni', 'fdr_bh', 'none'],
+                        default='holm',
+                        help='correction of the p-values of each group for multiple comparisons (default: holm)')
+    parser.add_argument('-s',
+                        dest='minSize',
+                        type=int,
+                        default=1,
+                        help='groups with fewer respondents are left out of the breakdowns (default: 1)')
+    parser.add_argument('-o',
+                        dest='outDir',
+                        type=str,
+                        default=None,
+                        help='directory to write the breakdowns to (groups.csv, distributions.csv, multiSelect.csv, crosstabs.csv, correlations.csv)')
+    add_instrumentation_arguments(parser)
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    params = parse_inputs(args)
+    configure_instrumentation(params)
+    schema = load_schema(params.qsfFile) if params.qsfFile else None
+    scales = {**(schema_scales(schema) if schema else dict()), **likertScales}
+    multiOptions = multi_select_options(schema)
+    groupings = [grouping.split('+') for grouping in params.groupings]
+    crosstabs = [tuple(pair.split(':', 1)) for pair in params.crosstabs]
+    with stage('load_dataset') as s:
+        if params.items is None or params.multiCols is None or params.ranked is None:
+            dataFrame = s.record(load_full_dataset(params.fullDfFile, None))
+        else:
+            columns = list(dict.fromkeys([c for g in groupings for c in g]+params.items+params.multiCols+params.ranked+[c for p in crosstabs for c in p]))
+            dataFrame = s.record(load_full_dataset(params.fullDfFile, columns))
+    items = params.items if params.items is not None else default_items(dataFrame, scales)
+    multiCols = params.multiCols if params.multiCols is not None else [col for col in multiOptions if col in dataFrame]
+    ranked = params.ranked if params.ranked is not None else [col for col in likertScales if col in dataFrame]
+    with stage('subgroup_breakdowns'):
+        result = subgroup_breakdowns(dataFrame, groupings, items, scales, multiCols, multiOptions, ranked, crosstabs,
+                                     params.method, params.correction, params.minSize)
+    reported = result.groups[result.groups['reported']]
+    print(reported.groupby('grouping', sort=False)['group'].count().rename('groups').to_string())
+    if params.outDir:
+        write_result(result, params.outDir)
+    else:
+        print(result.correlations.to_string())
+
+
+
+if __name__=='__main__':
+    main()
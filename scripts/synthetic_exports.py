@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Synthetic Qualtrics exports of the Reddit and Prolific surveys, generated from their QSF files (see qsf_schema.py),
+# for benchmarking the scripts at sizes well beyond the collected data (which isn't part of this repository).
+# Exports have the layout of the real ones: the column keys, the two header rows (question text, ImportId json),
+# the survey metadata, answers drawn from the questions' choices in display order, multi-select answers as
+# comma separated choice labels, ranks and free text (some of it with PII in it, see pii_redaction.py).
+# The same responses can also be written as Qualtrics ndjson response exports, with the codes of the choices as values.
+# Prolific main survey responses are from participants (PROLIFIC_PID) that qualified in the prescreen, plus a few
+# that can't be matched, and the Q3.3 answers of all responses ending up in the full dataset are coded by
+# a primary and a secondary coder (Response_Coding-deidentified - Q3.3-Primary/Secondary.csv).
+# Exports are written chunk by chunk, so their size is only bounded by disk space.
+
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from argparse import ArgumentParser
+from os import makedirs as os_makedirs
+from os.path import join as os_join, splitext as os_splitext
+
+from likert_encoding import codeKnowledgeLevels, dnsKnowledgeScale, knowledgeLevelScale
+from multi_select import option_pattern, split_selections
+from qsf_schema import extraFields, load_schema, metadataColumns, numericMetadata
+
+
+redditQsf = 'survey_instruments/reddit/Smart_DNS.qsf'
+prescreenQsf = 'survey_instruments/prolific/SmartDNS-Prescreen.qsf'
+mainQsf = 'survey_instruments/prolific/SDNS_-Main_Survey.qsf'
+
+# output files, named like the exports the scripts read by default
+redditFile = 'SDNS_RedditData_raw.csv'
+prescreenFile = 'SDNS-ProlificPrescreen_12July21.csv'
+mainFile = 'SDNS-ProlificMain_12July21.csv'
+codesFiles = {
+        'Primary': 'Response_Coding-deidentified - Q3.3-Primary.csv',
+        'Secondary': 'Response_Coding-deidentified - Q3.3-Secondary.csv'
+        }
+
+# Participants could only proceed if they were 18 or older, and had read and agreed to the consent form.
+consentCols = ['Q1.3', 'Q1.4', 'Q1.5', 'Q114', 'Q113', 'Q112']
+
+# Answer weights (in display order) of questions whose answers matter for which responses are kept,
+# everything else is answered uniformly at random.
+# Q2.3: Do you currently use Smart DNS, or have you done so in the past?
+answerWeights = {'Q2.3': [0.7, 0.2, 0.1]}
+
+# Choices of select-all-that-apply questions that can't be combined with any other choice
+exclusiveChoices = ['I have never had nor used a SmartDNS account']
+
+# share of unanswered questions, by kind of column
+missingRates = {'single': 0.03, 'matrix': 0.03, 'multi': 0.08, 'text': 0.3}
+
+# share of free-text answers with some PII pasted into them
+piiRate = 0.01
+
+textAnswers = [
+        'I use it to watch shows that are not available in my country.',
+        'Mostly streaming, sometimes to get around blocks at work.',
+        'It is cheaper than a VPN and does not slow down my connection.',
+        'I trust them about as much as my ISP, which is to say not very much.',
+        'They probably saw that the DNS resolver did not match my IP address location.',
+        'It is legal where I live as far as I know, the content is paid for anyway.',
+        'Not sure, I never really thought about it.',
+        'The provider could see every site I visit, so there is some risk.',
+        'Netflix showed a proxy error, so they must keep a list of the servers.',
+        'I think it is fine ethically, but it probably breaks the terms of service.'
+        ]
+
+piiSnippets = [
+        ' Feel free to email me at jane.doe{i}@example.com.',
+        ' My resolver is 203.0.113.{j}.',
+        ' Call me at 555-01{j:02d}-{i:04d} if you have questions.',
+        ' See https://www.example.org/review/{i} for the service I use.'
+        ]
+
+# Q3.3 answers typical of each primary code
+dnsExplanations = {
+        'sdns': 'Smart DNS reroutes part of my traffic through a server in another country.',
+        'protocol_unclear': 'The computer sends a request and gets the website back.',
+        'don\'t_know': 'I honestly do not know how it works.',
+        'identifies_pc_by_ip': 'The website sees the IP address of my computer and sends the page to it.',
+        'missing_details': 'The browser asks a server where the site is and then connects.',
+        'navigation_to_website': 'It helps the browser navigate to the website you typed in.',
+        'maps_website_to_Internet_name': 'It turns the website name into the name the Internet uses.',
+        'maps_ip_to_domain': 'DNS looks up which domain name belongs to an IP address.',
+        'translates_domains_for_browsers': 'It translates domain names so the browser can understand them.',
+        'maps_website_to_ip': 'It converts www.example.com into the IP address of the website.',
+        'maps_domain_to_ip': 'The resolver translates the domain name example.com into an IP address.',
+        'query_dns_server': 'The computer asks the configured DNS server for the IP address of the domain and caches the answer.',
+        'query_recursive_dns': 'The recursive resolver asks a root server, then the .com TLD server, then the authoritative server for the IP address.'
+        }
+
+# probability that the secondary coder assigns the same code as the primary one
+coderAgreement = 0.85
+
+defaultChunkSize = 100000
+
+
+
+# Column keys and the two header rows of an export of the survey with the given schema.
+def header_rows(schema):
+    columns = [name for (name, _, _) in metadataColumns]
+    textRow = [text for (_, text, _) in metadataColumns]
+    importRow = [json.dumps({'ImportId': importId}) for (_, _, importId) in metadataColumns]
+    for col in schema['columns']:
+        columns.append(col['name'])
+        textRow.append(col['text'])
+        importRow.append(json.dumps({'ImportId': col['key']}))
+    for field in extraFields.get(schema['survey'], []):
+        columns.append(field)
+        textRow.append(field)
+        importRow.append(json.dumps({'ImportId': field}))
+    return (columns, textRow, importRow)
+
+
+def with_missing(rng, values, missingRate):
+    values[rng.random(len(values)) < missingRate] = None
+    return values
+
+
+def choice_column(rng, choices, n, missingRate, weights=None):
+    values = np.array(choices, dtype=object)[rng.choice(len(choices), size=n, p=weights)]
+    return with_missing(rng, values, missingRate)
+
+
+# Answers of a select-all-that-apply question. Respondents mostly select few options, and the same
+# combinations come up again and again, so answers are drawn from a pool of numPatterns combinations
+# (of 1-4 options, listed in display order) with a long-tailed distribution.
+def multi_column(rng, choices, n, missingRate, numPatterns=256):
+    patterns = list()
+    for _ in range(numPatterns):
+        size = min(len(choices), 4, rng.geometric(0.5))
+        picked = sorted(rng.choice(len(choices), size=size, replace=False))
+        exclusive = [choices[i] for i in picked if choices[i] in exclusiveChoices]
+        patterns.append(exclusive[0] if exclusive else ','.join(choices[i] for i in picked))
+    weights = 1/np.arange(1, numPatterns+1)
+    values = np.array(patterns, dtype=object)[rng.choice(numPatterns, size=n, p=weights/weights.sum())]
+    return with_missing(rng, values, missingRate)
+
+
+# Ranks (1..len(names)) of the options of a rank order question, one column per option.
+def rank_columns(rng, names, n):
+    ranks = rng.random((n, len(names))).argsort(axis=1).argsort(axis=1)+1
+    return {name: ranks[:, i].astype(str).astype(object) for (i, name) in enumerate(names)}
+
+
+def text_column(rng, answers, n, missingRate):
+    values = np.array(answers, dtype=object)[rng.integers(0, len(answers), n)]
+    for i in np.flatnonzero(rng.random(n) < piiRate):
+        values[i] = values[i]+piiSnippets[i % len(piiSnippets)].format(i=i, j=i % 100)
+    return with_missing(rng, values, missingRate)
+
+
+# Prolific IDs of participants first..first+n-1 (24 hex digits). The index is scrambled by a bijection
+# (multiplication by an odd number modulo 2**96), so IDs look random but never collide.
+def prolific_ids(first, n, salt):
+    return [f'{((i+salt)*0x9E3779B97F4A7C15F39CC061) % 2**96:024x}' for i in range(first, first+n)]
+
+
+def response_ids(prefix, first, n):
+    return [f'R_{prefix}{i:013X}' for i in range(first, first+n)]
+
+
+# times (datetime64[s]) as 'YYYY-MM-DD hh:mm:ss', as in the exports
+def date_strings(times):
+    strings = times.astype(str)
+    return np.char.replace(strings, 'T', ' ') if len(strings) else strings
+
+
+# Survey metadata of responses first..first+n-1 out of numRows, recorded evenly over days days from startDate.
+def metadata_frame(rng, prefix, first, n, numRows, startDate='2021-06-01', days=42):
+    recorded = np.datetime64(startDate+'T00:00:00')+(np.arange(first, first+n)*(days*86400/max(numRows, 1))).astype('timedelta64[s]')
+    duration = rng.gamma(4, 150, n).astype(int)+60
+    started = recorded-duration.astype('timedelta64[s]')
+    octets = rng.integers(1, 255, (n, 4))
+    return pd.DataFrame({
+            'StartDate': date_strings(started),
+            'EndDate': date_strings(recorded),
+            'Status': 'IP Address',
+            'IPAddress': [f'{a}.{b}.{c}.{d}' for (a, b, c, d) in octets.tolist()],
+            'Progress': '100',
+            'Duration (in seconds)': duration.astype(str),
+            'Finished': 'True',
+            'RecordedDate': date_strings(recorded),
+            'ResponseId': response_ids(prefix, first, n),
+            'RecipientLastName': None, 'RecipientFirstName': None, 'RecipientEmail': None, 'ExternalReference': None,
+            'LocationLatitude': np.round(rng.uniform(-60, 70, n), 4).astype(str),
+            'LocationLongitude': np.round(rng.uniform(-180, 180, n), 4).astype(str),
+            'DistributionChannel': 'anonymous',
+            'UserLanguage': 'EN'
+            })
+
+
+# Values of the embedded data fields (participant/session IDs, the nonce of the DNS test, recruitment source).
+def embedded_column(rng, field, first, n, salt):
+    if field == 'PROLIFIC_PID':
+        return prolific_ids(first, n, salt)
+    if field in ('STUDY_ID', 'SESSION_ID'):
+        return [f'{x:024x}' for x in rng.integers(0, 2**62, n).tolist()]
+    if field in ('random_id', 'idURL', 'urlPart'):
+        return [f'{x:010d}' for x in rng.integers(0, 10**10, n).tolist()]
+    if field in ('Source', 'utm_source'):
+        return 'reddit'
+    return None
+
+
+# Responses first..first+n-1 (out of numRows) to the survey with the given schema, as a frame of str (None where unanswered).
+# salt: makes the PROLIFIC_PIDs of different samples of participants distinct.
+def generate_responses(schema, rng, prefix, first, n, numRows, salt=0):
+    frame = metadata_frame(rng, prefix, first, n, numRows)
+    columns = dict()
+    rankGroups = dict()
+    for col in schema['columns']:
+        (name, kind) = (col['name'], col['kind'])
+        if name in consentCols:
+            columns[name] = col['choices'][0]
+        elif kind in ('single', 'matrix'):
+            columns[name] = choice_column(rng, col['choices'], n, missingRates[kind], answerWeights.get(name))
+        elif kind == 'multi':
+            columns[name] = multi_column(rng, col['choices'], n, missingRates[kind])
+        elif kind == 'rank':
+            rankGroups.setdefault(col['tag'], list()).append(name)
+        elif kind == 'text':
+            columns[name] = text_column(rng, textAnswers, n, missingRates[kind])
+        else:
+            columns[name] = embedded_column(rng, name, first, n, salt)
+    for names in rankGroups.values():
+        columns.update(rank_columns(rng, names, n))
+    for field in extraFields.get(schema['survey'], []):
+        columns[field] = None
+    frame = pd.concat([frame, pd.DataFrame(columns, index=frame.index)], axis=1)
+    return frame[header_rows(schema)[0]]
+
+
+# Prescreen responses that qualify for the main survey (see remove_disqualified.select_qualifying())
+def qualifying_rows(prescreen):
+    return (prescreen['Q2.3'] == 'Yes') & (prescreen['Q2.6'] != 'I have never had nor used a SmartDNS account')
+
+
+# Main survey responses of (a matchRate share of) the qualifying participants of a prescreen chunk,
+# followed by unmatchedRate as many responses of participants that can't be matched.
+# Returns the responses and which prescreen responses they were matched with.
+def main_responses(schema, rng, prescreen, first, numRows, matchRate=0.9, unmatchedRate=0.02):
+    matched = qualifying_rows(prescreen).to_numpy() & (rng.random(len(prescreen)) < matchRate)
+    pids = prescreen.loc[matched, 'PROLIFIC_PID'].tolist()
+    numUnmatched = rng.binomial(len(prescreen), unmatchedRate)
+    n = len(pids)+numUnmatched
+    main = generate_responses(schema, rng, 'M', first, n, numRows, salt=2**40)
+    main['PROLIFIC_PID'] = pids+prolific_ids(first, numUnmatched, salt=2**41)
+    main['RecordedDate'] = (pd.to_datetime(main['RecordedDate'])+pd.Timedelta(days=2)).dt.strftime('%Y-%m-%d %H:%M:%S')
+    return (main, matched)
+
+
+# Primary and secondary coding of the Q3.3 answers of responses (a frame with ResponseId and Q3.2).
+# The answers themselves are replaced by an explanation typical of their primary code.
+# How much respondents actually know (i.e. the level of the primary code) roughly follows their own assessment (Q3.2).
+def code_responses(rng, responses):
+    n = len(responses)
+    estimate = pd.Categorical(responses['Q3.2'], categories=dnsKnowledgeScale.categories).codes
+    levels = np.clip(np.where(estimate >= 0, estimate, rng.integers(0, 4, n))+rng.integers(-1, 2, n), 0, 3)
+    primary = np.empty(n, dtype=object)
+    for (i, level) in enumerate(knowledgeLevelScale.categories):
+        codes = np.array([code for (code, codeLevel) in codeKnowledgeLevels.items() if codeLevel == level], dtype=object)
+        atLevel = levels == i
+        primary[atLevel] = codes[rng.integers(0, len(codes), int(atLevel.sum()))]
+    secondary = primary.copy()
+    disagree = rng.random(n) > coderAgreement
+    secondary[disagree] = rng.choice(list(codeKnowledgeLevels), size=int(disagree.sum()))
+    extra = np.where(rng.random(n) < 0.15, rng.choice(list(codeKnowledgeLevels), size=n), None)
+    answers = pd.Series(primary).map(dnsExplanations).to_numpy()
+    coding = dict()
+    for (coder, codes) in (('Primary', primary), ('Secondary', secondary)):
+        coding[coder] = pd.DataFrame({'ResponseId': responses['ResponseId'].to_numpy(), 'Q3.3': answers,
+                                      'Code 1': codes, 'Code 2': extra, 'Code 3': None})
+    return coding
+
+
+# Exports are written through arrow's csv writer, which (like Qualtrics) quotes every value and is
+# many times faster than DataFrame.to_csv() on columns of text.
+def append_rows(frame, path, header=False):
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    with open(path, 'ab') as f:
+        pa_csv.write_csv(table, f, pa_csv.WriteOptions(include_header=header, quoting_style='needed'))
+
+
+# Values of frame[name] as objects, None where missing.
+def cell_values(frame, name):
+    col = frame[name]
+    return np.where(col.notna().to_numpy(), col.to_numpy(dtype=object), None)
+
+
+# Values of the responses in frame (see generate_responses()) as json exports hold them: (key, values (None where
+# unanswered), labels (None if the values are their own labels)) of each column, with the codes of the choices as values.
+def json_values(frame, schema):
+    columns = list()
+    for (name, _, key) in metadataColumns:
+        values = cell_values(frame, name)
+        labels = None
+        if key in numericMetadata:
+            codes = {label: code for (code, label) in (numericMetadata[key] or dict()).items()}
+            (labels, values) = (values if codes else None, [codes[v] if codes else int(v) for v in values])
+        elif key in ('startDate', 'endDate', 'recordedDate'):
+            values = [v.replace(' ', 'T')+'Z' for v in values]
+        columns.append((key, values, labels))
+    for col in schema['columns']+[{'name': field, 'key': field, 'kind': 'embedded'} for field in extraFields.get(schema['survey'], [])]:
+        values = cell_values(frame, col['name'])
+        if col['kind'] in ('single', 'matrix'):
+            codes = dict(zip(col['choices'], col['codes']))
+            columns.append((col['key'], [codes[v] if v is not None else None for v in values], values))
+        elif col['kind'] == 'multi':
+            (codes, pattern) = (dict(zip(col['choices'], col['codes'])), option_pattern(col['choices']))
+            selections = [split_selections(v, pattern) if v is not None else None for v in values]
+            columns.append((col['key'], [[codes[c] for c in v] if v is not None else None for v in selections], selections))
+        elif col['kind'] == 'rank':
+            columns.append((col['key'], [int(v) if v is not None else None for v in values], None))
+        else:
+            columns.append((col['key'], values, None))
+    return columns
+
+
+# Append the responses in frame to an ndjson export: one {"responseId": ..., "values": {...}, "labels": {...}} per line.
+def append_json_rows(frame, path, schema):
+    columns = json_values(frame, schema)
+    with open(path, 'a', encoding='utf8') as f:
+        for (i, responseId) in enumerate(frame['ResponseId']):
+            values = {key: values[i] for (key, values, _) in columns if values[i] is not None}
+            labels = {key: labels[i] for (key, values, labels) in columns if labels is not None and values[i] is not None}
+            f.write(json.dumps({'responseId': responseId, 'values': values, 'labels': labels})+'\n')
+
+
+def write_header(path, schema):
+    (columns, textRow, importRow) = header_rows(schema)
+    open(path, 'wb').close()
+    append_rows(pd.DataFrame([textRow, importRow], columns=columns), path, header=True)
+
+
+def codes_header(path):
+    # the coding sheets have a second header row (dropped by the analysis scripts)
+    open(path, 'wb').close()
+    append_rows(pd.DataFrame([['', 'Response', 'Primary code', 'Secondary code(s)', '']],
+                             columns=['ResponseId', 'Q3.3', 'Code 1', 'Code 2', 'Code 3']), path, header=True)
+
+
+# Write numRows synthetic Reddit responses and as many Prolific prescreen responses (along with the main survey
+# responses of the qualifying participants) to outDir, chunkSize rows at a time, and code the Q3.3 answers of
+# all responses that end up in the full dataset. With jsonExports, the surveys are also written as ndjson exports.
+# Returns the paths of the files written.
+def generate_surveys(outDir, numRows, seed=0, chunkSize=defaultChunkSize, jsonExports=False):
+    os_makedirs(outDir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    schemas = {'reddit': load_schema(redditQsf), 'prescreen': load_schema(prescreenQsf), 'main': load_schema(mainQsf)}
+    paths = {'reddit': os_join(outDir, redditFile), 'prescreen': os_join(outDir, prescreenFile), 'main': os_join(outDir, mainFile)}
+    jsonPaths = {survey+'Json': os_splitext(path)[0]+'.ndjson' for (survey, path) in paths.items()} if jsonExports else dict()
+    for survey in schemas:
+        write_header(paths[survey], schemas[survey])
+    for path in jsonPaths.values():
+        open(path, 'wb').close()
+    codesPaths = {coder: os_join(outDir, fileName) for (coder, fileName) in codesFiles.items()}
+    for path in codesPaths.values():
+        codes_header(path)
+    numMain = 0
+    for first in range(0, numRows, chunkSize):
+        n = min(chunkSize, numRows-first)
+        reddit = generate_responses(schemas['reddit'], rng, 'D', first, n, numRows)
+        prescreen = generate_responses(schemas['prescreen'], rng, 'P', first, n, numRows)
+        (main, matched) = main_responses(schemas['main'], rng, prescreen, numMain, numRows)
+        numMain += len(main)
+        isCoded = {'reddit': reddit['Q3.3'].notna().to_numpy(), 'prescreen': matched & prescreen['Q3.3'].notna().to_numpy()}
+        coding = code_responses(rng, pd.concat([reddit[isCoded['reddit']], prescreen[isCoded['prescreen']]]))
+        answers = coding['Primary']['Q3.3'].to_numpy()
+        numReddit = int(isCoded['reddit'].sum())
+        reddit.loc[isCoded['reddit'], 'Q3.3'] = answers[:numReddit]
+        prescreen.loc[isCoded['prescreen'], 'Q3.3'] = answers[numReddit:]
+        for (survey, frame) in (('reddit', reddit), ('prescreen', prescreen), ('main', main)):
+            append_rows(frame, paths[survey])
+            if jsonExports:
+                append_json_rows(frame, jsonPaths[survey+'Json'], schemas[survey])
+        for (coder, frame) in coding.items():
+            append_rows(frame, codesPaths[coder])
+    paths.update({'codes'+coder: path for (coder, path) in codesPaths.items()}, **jsonPaths)
+    return paths
+
+
+
+
+def parse_inputs(args=None):
+    desc = 'synthetic_exports.py: generates synthetic exports of the Reddit and Prolific surveys (from their QSF files) and codings of their Q3.3 answers, e.g. for benchmarking the scripts.'
+    parser = ArgumentParser(description=desc)
+    parser.add_argument('-n',
+                        dest='numRows',
+                        type=int,
+                        default=1000,
+                        help='number of Reddit and of Prolific prescreen responses (default: 1000)')
+    parser.add_argument('-o',
+                        dest='outDir',
+                        type=str,
+                        default='data/synthetic',
+                        help='directory to write the exports and codings to (default: data/synthetic)')
+    parser.add_argument('-s',
+                        dest='seed',
+                        type=int,
+                        default=0,
+                        help='random seed, i.e. the same seed and number of rows always give the same files (default: 0)')
+    parser.add_argument('-c',
+                        dest='chunkSize',
+                        type=int,
+                        default=defaultChunkSize,
+                        help=f'number of responses generated (and held in memory) at a time (default: {defaultChunkSize})')
+    parser.add_argument('-j',
+                        dest='jsonExports',
+                        action='store_true',
+                        help='also write each survey as a Qualtrics ndjson response export (<export>.ndjson, with the codes of the choices)')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    params = parse_inputs(args)
+    paths = generate_surveys(params.outDir, params.numRows, params.seed, params.chunkSize, params.jsonExports)
+    for path in paths.values():
+        print(path)
+
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# coding=utf8
+# -*- coding: utf8 -*-
+
+# vim: set fileencoding=utf8 :
+
+
+# Incremental ingestion of (continuously collected) survey waves.
+# Each incremental run of scrub_records.py/remove_disqualified.py keeps a state file next to its output,
+# holding a high-water mark per export: the latest RecordedDate processed so far and the ResponseIds recorded at
+# exactly that time (exports have second resolution, so responses recorded in the same second as the mark
+# may still be missing from it). Only responses past the mark are processed and appended to the output,
+# and the count states of the dataset (see aggregates.py) are merged with those of the new responses only.
+# Marks are kept in UTC, so that waves exported in different time zones or formats (csv exports are in the survey's
+# time zone, json exports in UTC) line up. Responses without a (valid) RecordedDate can't be placed relative to
+# the mark; they are skipped and reported.
+
+import json
+import os
+import pandas as pd
+
+from os import replace as os_replace
+from os.path import exists as os_exists
+
+from aggregates import MultiSelectCounts, ValueCounts
+
+
+# State file of the incremental runs writing outFile
+def state_path(outFile):
+    return outFile+'.ingest.json'
+
+
+# marks: export -> {'recordedDate', 'responseIds'}, rows: number of responses in the output so far.
+def load_state(path):
+    if not os_exists(path):
+        return {'marks': dict(), 'rows': 0, 'counts': dict()}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(path, state):
+    tmpPath = f'{path}.{os.getpid()}.tmp'
+    with open(tmpPath, 'w') as f:
+        json.dump(state, f, indent=1)
+    os_replace(tmpPath, path)
+
+
+def is_first_run(state):
+    return not state['marks']
+
+
+# RecordedDate of the responses in dataFrame ('YYYY-MM-DD hh:mm:ss' in timeZone, see qsf_schema.export_time_zones();
+# UTC if the export doesn't give its time zone) as UTC timestamps, NaT where it is missing or malformed.
+# Times repeated when daylight saving time ends are taken as standard time.
+def recorded_times(dataFrame, timeZone=None):
+    recorded = pd.to_datetime(dataFrame['RecordedDate'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    recorded = recorded.dt.tz_localize(timeZone or 'UTC', ambiguous=False, nonexistent='shift_forward')
+    return recorded.dt.tz_convert('UTC')
+
+
+# Time of a mark (marks of earlier versions were stored in the time zone of their export)
+def mark_time(mark, timeZone=None):
+    markTime = pd.Timestamp(mark['recordedDate'])
+    return markTime.tz_convert('UTC') if markTime.tzinfo else markTime.tz_localize(timeZone or 'UTC').tz_convert('UTC')
+
+
+# Responses of dataFrame that were recorded after the mark of export (in marks), i.e. those not processed yet.
+# timeZone: that of the export's RecordedDate (see recorded_times()).
+def select_new(dataFrame, marks, export, timeZone=None):
+    recorded = recorded_times(dataFrame, timeZone)
+    undated = recorded.isna()
+    if undated.any():
+        responseIds = dataFrame.loc[undated, 'ResponseId'].astype(str).tolist()
+        print(f'{export}: skipped {len(responseIds)} response(s) without a valid RecordedDate: '
+              + ', '.join(responseIds[:10])+(', ...' if len(responseIds) > 10 else ''))
+    if export not in marks:
+        return dataFrame[~undated]
+    mark = marks[export]
+    markTime = mark_time(mark, timeZone)
+    isNew = (recorded > markTime) | ((recorded == markTime) & ~dataFrame['ResponseId'].isin(mark['responseIds']))
+    return dataFrame[isNew]
+
+
+# Move the mark of export (in marks) past the responses in dataFrame (as selected by select_new()).
+def advance_mark(marks, export, dataFrame, timeZone=None):
+    recorded = recorded_times(dataFrame, timeZone)
+    if recorded.isna().all():
+        return marks
+    latest = recorded.max()
+    mark = marks.get(export)
+    markTime = mark_time(mark, timeZone) if mark is not None else None
+    if markTime is not None and latest < markTime:
+        return marks
+    responseIds = dataFrame.loc[recorded == latest, 'ResponseId'].tolist()
+    if markTime is not None and latest == markTime:
+        responseIds = mark['responseIds']+responseIds
+    marks[export] = {'recordedDate': latest.strftime('%Y-%m-%dT%H:%M:%SZ'), 'responseIds': responseIds}
+    return marks
+
+
+# Merge the count state new into its stored version (json, see aggregates.py), if any.
+def merge_stored(stored, new):
+    if stored is None:
+        return new.to_dict()
+    return type(new).from_dict(stored).merge(new).to_dict()
+
+
+# Update the count states kept with the dataset (see scrub_records.py) with those of the responses in dataFrame:
+#  - likert: distribution of the answers to each of likertCols (aggregates.ValueCounts, as used by process_likert())
+#  - multi: selections of each of multiCols (aggregates.MultiSelectCounts, as used by select_many_dist())
+#  - serviceUse: services used/considered (as used by get_service_use()), if useCol/servicesCol are given
+# optionsByCol: answer options of multiCols (col -> list of options), if known.
+def update_counts(counts, dataFrame, likertCols=None, multiCols=None, optionsByCol=None, useCol=None, servicesCol=None):
+    optionsByCol = dict() if optionsByCol is None else optionsByCol
+    likert = counts.setdefault('likert', dict())
+    for col in likertCols or []:
+        likert[col] = merge_stored(likert.get(col), ValueCounts.from_column(dataFrame[col]))
+    multi = counts.setdefault('multi', dict())
+    for col in multiCols or []:
+        multi[col] = merge_stored(multi.get(col), MultiSelectCounts.from_column(dataFrame[col], optionsByCol.get(col)))
+    if useCol and servicesCol:
+        uses = dataFrame[useCol].map({'Yes':True, 'No':False}).fillna(False).astype(bool)
+        serviceUse = counts.setdefault('serviceUse', dict())
+        for (group, rows) in (('use', uses), ('consider', ~uses)):
+            groupCounts = MultiSelectCounts.from_column(dataFrame.loc[rows, servicesCol], optionsByCol.get(servicesCol))
+            serviceUse[group] = merge_stored(serviceUse.get(group), groupCounts)
+    return counts
+
+
+# The count states kept by update_counts(), i.e. {'likert': {col: ValueCounts}, 'multi': {col: MultiSelectCounts},
+# 'serviceUse': {'use'/'consider': MultiSelectCounts}}, e.g. for scrub_records.likert_from_counts()
+def load_counts(counts):
+    return {
+            'likert': {col: ValueCounts.from_dict(state) for (col, state) in counts.get('likert', dict()).items()},
+            'multi': {col: MultiSelectCounts.from_dict(state) for (col, state) in counts.get('multi', dict()).items()},
+            'serviceUse': {group: MultiSelectCounts.from_dict(state) for (group, state) in counts.get('serviceUse', dict()).items()}
+            }
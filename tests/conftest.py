@@ -0,0 +1,7 @@
+# The scripts import each other as top-level modules (they're run from scripts/), so the tests do the same.
+
+import sys
+
+from os.path import abspath as os_abspath, dirname as os_dirname, join as os_join
+
+sys.path.insert(0, os_join(os_dirname(os_dirname(os_abspath(__file__))), 'scripts'))
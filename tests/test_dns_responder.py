@@ -0,0 +1,271 @@
+import asyncio
+import socket
+import struct
+
+import pytest
+
+from collections import Counter
+
+from dns_query_storm import build_queries, run_storm
+from dns_responder import (QueryRecorder, Responder, UdpServer, address_bytes, encode_name, headerSize, optionECS, recordSize,
+                           serve_tcp, typeA, typeAAAA, typeNS, typeOPT, typeSOA)
+from resolver_logs import read_query_records, scan_logs, scan_records
+
+
+zone = 'smartdnsstudy.com'
+resolver = address_bytes('192.0.2.53')
+
+
+# (encode_name() lower cases the name, resolvers send it in any case)
+def wire_name(name):
+    return b''.join(bytes([len(label)])+label.encode('ascii') for label in name.split('.') if label)+b'\x00'
+
+
+def make_query(name, qtype=typeA, queryId=0x1234, flags=0x0100, opt=None, qdCount=1):
+    header = struct.pack('>HHHHHH', queryId, flags, qdCount, 0, 0, 0 if opt is None else 1)
+    return header+wire_name(name)+struct.pack('>HH', qtype, 1)+(opt or b'')
+
+
+def opt_record(options=b'', version=0):
+    return b'\x00'+struct.pack('>HHBBHH', typeOPT, 1232, 0, version, 0, len(options))+options
+
+
+def ecs_option(family, sourcePrefix, address):
+    option = struct.pack('>HBB', family, sourcePrefix, 0)+address
+    return struct.pack('>HH', optionECS, len(option))+option
+
+
+def read_name(data, position):
+    labels = list()
+    end = None
+    while data[position]:
+        if data[position] >= 0xc0:
+            end = position+2 if end is None else end
+            position = struct.unpack_from('>H', data, position)[0] & 0x3fff
+            continue
+        labels.append(data[position+1:position+1+data[position]].decode('ascii'))
+        position += 1+data[position]
+    return ('.'.join(labels), position+1 if end is None else end)
+
+
+# Header fields, question and records of a response; the rcode includes the upper bits from the OPT record.
+def decode(data):
+    (queryId, flags, qdCount, anCount, nsCount, arCount) = struct.unpack_from('>HHHHHH', data)
+    response = {'id': queryId, 'flags': flags, 'rcode': flags & 0xf, 'question': None, 'sections': list()}
+    position = 12
+    if qdCount:
+        (name, position) = read_name(data, position)
+        response['question'] = (name, struct.unpack_from('>H', data, position)[0])
+        position += 4
+    for count in (anCount, nsCount, arCount):
+        records = list()
+        for _ in range(count):
+            (name, position) = read_name(data, position)
+            (rtype, rclass, ttl, length) = struct.unpack_from('>HHIH', data, position)
+            position += 10
+            records.append({'name': name, 'type': rtype, 'class': rclass, 'ttl': ttl, 'rdata': data[position:position+length]})
+            if rtype == typeOPT:
+                response['rcode'] |= (ttl >> 24) << 4
+            position += length
+        response['sections'].append(records)
+    assert position == len(data)
+    return response
+
+
+def options(rdata):
+    found = list()
+    while rdata:
+        (code, length) = struct.unpack_from('>HH', rdata)
+        found.append((code, rdata[4:4+length]))
+        rdata = rdata[4+length:]
+    return found
+
+
+@pytest.fixture
+def recordFile(tmp_path):
+    return str(tmp_path/'queries.bin')
+
+
+@pytest.fixture
+def responder(recordFile):
+    recorder = QueryRecorder(recordFile, batchSize=4)
+    yield Responder(zone, '127.0.0.1', '2001:db8::53', 60, recorder)
+    recorder.close()
+
+
+def test_record_size():
+    assert recordSize == 77
+
+
+def test_encoding():
+    assert encode_name('SmartDNSstudy.COM.') == b'\x0dsmartdnsstudy\x03com\x00'
+    assert encode_name('') == b'\x00'
+    assert address_bytes('1.2.3.4') == b'\x00'*10+b'\xff\xff\x01\x02\x03\x04'
+    assert address_bytes('fe80::1%eth0') == b'\xfe\x80'+b'\x00'*13+b'\x01'
+
+
+def test_a_answer(responder):
+    response = decode(responder.respond(make_query('12345.smartdnsstudy.com'), resolver))
+    assert (response['id'], response['rcode'], response['flags'] & 0x8400) == (0x1234, 0, 0x8400)
+    assert response['question'] == ('12345.smartdnsstudy.com', typeA)
+    ([answer], [], []) = response['sections']
+    assert (answer['name'], answer['type'], answer['ttl']) == ('12345.smartdnsstudy.com', typeA, 60)
+    assert socket.inet_ntop(socket.AF_INET, answer['rdata']) == '127.0.0.1'
+
+
+def test_question_case_is_echoed(responder):
+    response = decode(responder.respond(make_query('AbC12.SmartDNSstudy.COM', typeAAAA), resolver))
+    assert response['question'] == ('AbC12.SmartDNSstudy.COM', typeAAAA)
+    assert response['sections'][0][0]['name'] == 'AbC12.SmartDNSstudy.COM'
+    assert socket.inet_ntop(socket.AF_INET6, response['sections'][0][0]['rdata']) == '2001:db8::53'
+
+
+def test_zone_apex_and_nodata(responder):
+    soa = decode(responder.respond(make_query(zone, typeSOA), resolver))
+    assert [record['type'] for record in soa['sections'][0]] == [typeSOA]
+    assert soa['sections'][0][0]['name'] == zone
+    ns = decode(responder.respond(make_query(zone, typeNS), resolver))
+    assert [(record['type'], read_name(record['rdata'], 0)[0]) for record in ns['sections'][0]] == [(typeNS, 'ns1.'+zone)]
+    # no TXT records: NODATA with the SOA in the authority section
+    nodata = decode(responder.respond(make_query('12345.smartdnsstudy.com', 16), resolver))
+    assert (nodata['rcode'], nodata['sections'][0], [record['type'] for record in nodata['sections'][1]]) == (0, [], [typeSOA])
+
+
+@pytest.mark.parametrize('name', ['example.org', 'xsmartdnsstudy.com', 'smartdnsstudy.com.example.org'])
+def test_other_zones_are_refused(responder, name):
+    response = decode(responder.respond(make_query(name), resolver))
+    assert (response['rcode'], response['question']) == (5, (name, typeA))
+    assert responder.counts['refused'] == 1
+
+
+@pytest.mark.parametrize(('data', 'rcode'), [
+        (make_query('12345.smartdnsstudy.com')[:-3], 1),                      # truncated question
+        (make_query('12345.smartdnsstudy.com', qdCount=2), 1),
+        (struct.pack('>HHHHHH', 1, 0x0100, 1, 0, 0, 0)+b'\x40'+b'a'*64+b'\x00\x00\x01\x00\x01', 1),  # label of 64 bytes
+        (make_query('12345.smartdnsstudy.com', flags=0x1100), 4),              # opcode 2 (status)
+        ])
+def test_errors(responder, data, rcode):
+    response = decode(responder.respond(data, resolver))
+    assert (response['rcode'], response['sections']) == (rcode, [[], [], []])
+
+
+def test_dropped(responder):
+    assert responder.respond(b'\x00'*11, resolver) is None
+    assert responder.respond(make_query('12345.smartdnsstudy.com', flags=0x8000), resolver) is None
+
+
+@pytest.mark.parametrize(('family', 'sourcePrefix', 'address', 'recorded'), [
+        (1, 24, b'\xc6\x33\x64', '198.51.100.0'),
+        (2, 56, b'\x20\x01\x0d\xb8\x00\x01\x02', '2001:db8:1:200::'),
+        (1, 0, b'', '0.0.0.0'),
+        ])
+def test_client_subnet(responder, recordFile, family, sourcePrefix, address, recorded):
+    query = make_query('12345.smartdnsstudy.com', opt=opt_record(ecs_option(family, sourcePrefix, address)))
+    response = decode(responder.respond(query, resolver))
+    assert response['rcode'] == 0
+    ([answer], [], [opt]) = response['sections']
+    assert (opt['type'], opt['class']) == (typeOPT, 1232)
+    # echoed with a scope of 0
+    assert options(opt['rdata']) == [(optionECS, struct.pack('>HBB', family, sourcePrefix, 0)+address)]
+    responder.recorder.flush()
+    [record] = read_query_records(recordFile)
+    assert (record['ecsFamily'], record['ecsPrefix']) == (family, sourcePrefix)
+    key = bytes(record['ecs'])
+    assert (socket.inet_ntop(socket.AF_INET, key[12:]) if family == 1 else socket.inet_ntop(socket.AF_INET6, key)) == recorded
+
+
+def test_malformed_client_subnet_is_ignored(responder, recordFile):
+    query = make_query('12345.smartdnsstudy.com', opt=opt_record(ecs_option(1, 33, b'\x01\x02\x03\x04\x05')))
+    ([answer], [], [opt]) = decode(responder.respond(query, resolver))['sections']
+    assert options(opt['rdata']) == []
+    responder.recorder.flush()
+    assert read_query_records(recordFile)['ecsFamily'].tolist() == [0]
+
+
+def test_badvers(responder):
+    query = make_query('12345.smartdnsstudy.com', opt=opt_record(ecs_option(1, 24, b'\x01\x02\x03'), version=1))
+    response = decode(responder.respond(query, resolver))
+    # BADVERS (16): 0 in the header, 1 in the upper bits of the OPT record
+    assert (response['flags'] & 0xf, response['rcode']) == (0, 16)
+    ([], [], [opt]) = response['sections']
+    assert (opt['ttl'] >> 16) & 0xff == 0
+
+
+def test_records_round_trip(responder, recordFile):
+    queries = [('1.2.3.4', 'abcde', typeA), ('1.2.3.4', 'abcde', typeAAAA), ('1.2.3.4', 'ABCDE', typeA),
+               ('2001:db8::1', 'abcde', typeA), ('5.6.7.8', 'x'*32, typeA), ('5.6.7.8', '', typeSOA), ('::ffff:9.9.9.9', '7', typeA)]
+    for (i, (address, nonce, qtype)) in enumerate(queries):
+        name = f'{nonce}.{zone}' if nonce else zone
+        assert responder.respond(make_query(name, qtype), address_bytes(address), i % 2) is not None
+    responder.recorder.close()
+    with open(recordFile, 'rb') as f:
+        assert len(f.read()) == headerSize+len(queries)*recordSize
+    records = read_query_records(recordFile)
+    assert records['qtype'].tolist() == [qtype for (_, _, qtype) in queries]
+    assert records['transport'].tolist() == [i % 2 for i in range(len(queries))]
+    (counts, numRecords, numBytes, _) = scan_records(recordFile, 0, len(queries))
+    assert (numRecords, numBytes) == (len(queries), len(queries)*recordSize)
+    assert counts == Counter({(b'1.2.3.4', b'abcde'): 3, (b'2001:db8::1', b'abcde'): 1, (b'5.6.7.8', b'x'*32): 1,
+                              (b'5.6.7.8', b''): 1, (b'9.9.9.9', b'7'): 1})
+    # in ranges of records, as scan_logs() reads them
+    assert sum((scan_records(recordFile, start, start+2)[0] for start in range(0, len(queries), 2)), start=Counter()) == counts
+    scan = scan_logs([recordFile])
+    assert (scan.lines, scan.queries) == (len(queries), len(queries))
+    assert scan.pairs[scan.pairs['nonce'] == 'abcde'][['resolver', 'queries']].values.tolist() == [['1.2.3.4', 3], ['2001:db8::1', 1]]
+
+
+async def tcp_exchange(responder, chunks, numResponses):
+    server = await asyncio.start_server(lambda r, w: serve_tcp(responder, r, w), '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+    for chunk in chunks:
+        writer.write(chunk)
+        await writer.drain()
+        await asyncio.sleep(0.01)
+    responses = list()
+    for _ in range(numResponses):
+        length = struct.unpack('>H', await asyncio.wait_for(reader.readexactly(2), 5))[0]
+        responses.append(await asyncio.wait_for(reader.readexactly(length), 5))
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    return responses
+
+
+def test_tcp_framing(responder, recordFile):
+    framed = [struct.pack('>H', len(query))+query for query in
+              (make_query(f'{nonce}.{zone}', queryId=queryId) for (queryId, nonce) in enumerate(['aaaaa', 'bbbbb', 'ccccc'], 1))]
+    # two queries in one segment, the third one split within its length and its message
+    chunks = [framed[0]+framed[1], framed[2][:1], framed[2][1:9], framed[2][9:]]
+    responses = asyncio.run(tcp_exchange(responder, chunks, 3))
+    assert [decode(response)['id'] for response in responses] == [1, 2, 3]
+    responder.recorder.flush()
+    records = read_query_records(recordFile)
+    assert records['transport'].tolist() == [1, 1, 1]
+    assert records['nonce'].tolist() == [b'aaaaa', b'bbbbb', b'ccccc']
+
+
+async def storm_against(responder, queries, total):
+    loop = asyncio.get_running_loop()
+    udpServer = UdpServer(responder, '127.0.0.1', 0)
+    udpServer.start(loop)
+    try:
+        return await run_storm(queries, '127.0.0.1', udpServer.socket.getsockname()[1], total, sockets=2, concurrency=16)
+    finally:
+        udpServer.close(loop)
+
+
+def test_storm_round_trip(responder, recordFile):
+    queries = build_queries(50, seed=1)
+    result = asyncio.run(storm_against(responder, queries, 200))
+    assert (result.sent, result.answered, result.lost, dict(result.rcodes)) == (200, 200, 0, {0: 200})
+    responder.recorder.close()
+    records = read_query_records(recordFile)
+    assert len(records) == 200
+    sent = Counter(query[13:13+query[12]] for query in (queries[i % len(queries)] for i in range(200)))
+    (counts, _, _, _) = scan_records(recordFile, 0, len(records))
+    assert Counter({nonce: n for ((_, nonce), n) in counts.items()}) == sent
+    assert {ip for (ip, _) in counts} == {b'127.0.0.1'}
+    # the queries with a client subnet were recorded with it
+    withSubnet = sum(n*(len(query) > 12+query[12]+1+len(encode_name(zone))+4) for (query, n) in Counter(queries[i % len(queries)] for i in range(200)).items())
+    assert (records['ecsFamily'] == 1).sum() == withSubnet
@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+from dns_knowledgeSpearman import matrix_scales
+from likert_encoding import (agreeScale, ascending_scale, descendingScales, dnsKnowledgeScale, familiarityScale,
+                             knowledgeLevelScale, trustScale)
+from rank_correlation import correlation_matrix
+
+
+@pytest.mark.parametrize(('scale', 'lowest', 'highest'), [
+        (agreeScale, 'Strongly disagree', 'Strongly agree'),
+        (trustScale, 'Very untrustworthy', 'Very trustworthy'),
+        (familiarityScale, 'Not familiar at all', 'Extremely familiar'),
+        (dnsKnowledgeScale, 'I definitely do not know', 'I definitely know'),
+        (knowledgeLevelScale, 'Low', 'High'),
+        ])
+def test_ascending_scale(scale, lowest, highest):
+    ascending = ascending_scale(scale)
+    assert (ascending.categories[0], ascending.categories[-1]) == (lowest, highest)
+    assert ascending.ordered
+    assert (ascending is scale) == all(scale != descending for descending in descendingScales)
+
+
+def test_matrix_signs_agree():
+    # answers that are all at the positive (or all at the negative) end of their scales correlate positively
+    high = {' ': 'Strongly agree', 'Q4.5': 'Agree', 'Q9.1': 'Very trustworthy', 'Q3.1': 'Extremely familiar',
+            'Q3.2': 'I definitely know', ' .1': 'Strongly agree', 'simplified_code1': 'High'}
+    low = {' ': 'Strongly disagree', 'Q4.5': 'Disagree', 'Q9.1': 'Very untrustworthy', 'Q3.1': 'Not familiar at all',
+           'Q3.2': 'I definitely do not know', ' .1': 'Disagree', 'simplified_code1': 'Low'}
+    middle = {' ': 'Neither agree nor disagree', 'Q4.5': 'Somewhat agree', 'Q9.1': 'Neither trustworthy nor untrustworthy',
+              'Q3.1': 'Moderately familiar', 'Q3.2': 'I somewhat know', ' .1': 'Somewhat agree', 'simplified_code1': 'Medium'}
+    result = correlation_matrix(pd.DataFrame([high, low, middle, high, low]), matrix_scales())
+    assert (result.coef.to_numpy() > 0.9).all()
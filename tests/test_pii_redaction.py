@@ -0,0 +1,86 @@
+import pandas as pd
+import pytest
+
+from collections import Counter
+
+from pii_redaction import make_pool, redact_frame, redact_text, redact_values, task_size
+
+
+def redact(text):
+    counts = Counter()
+    return (redact_text(text, counts), counts)
+
+
+@pytest.mark.parametrize('text', [
+        'I have used it since 2019 2020 or so',
+        'between 2019-2020 and 2021 2022 2023',
+        'about 1500 2000 times',
+        'the :: operator',
+        'add:: and std::cout',
+        'meeting at 10:30 or 12:30:45',
+        'version 3.14 and 10.5',
+        ])
+def test_ordinary_answers_are_kept(text):
+    assert redact(text) == (text, Counter())
+
+
+@pytest.mark.parametrize(('text', 'redacted', 'kind'), [
+        ('call me at 555-123-4567.', 'call me at [PHONE].', 'PHONE'),
+        ('call me at (555) 123 4567', 'call me at [PHONE]', 'PHONE'),
+        ('or +44 20 7946 0958', 'or [PHONE]', 'PHONE'),
+        ('or 555-0123', 'or [PHONE]', 'PHONE'),
+        ('or 5551234567', 'or [PHONE]', 'PHONE'),
+        ('my resolver is 2001:db8::1', 'my resolver is [IPV6]', 'IPV6'),
+        ('my resolver is fe80::1%eth0', 'my resolver is [IPV6]%eth0', 'IPV6'),
+        ('my resolver is 2001:db8:0:0:0:0:0:1', 'my resolver is [IPV6]', 'IPV6'),
+        ('and 2001:db8::', 'and [IPV6]', 'IPV6'),
+        ('and ::ffff:1', 'and [IPV6]', 'IPV6'),
+        ('I use 1.1.1.1', 'I use [IPV4]', 'IPV4'),
+        ('mail me at jane.doe@example.org', 'mail me at [EMAIL]', 'EMAIL'),
+        ('see https://example.org/a?b=1.2.3.4', 'see [URL]', 'URL'),
+        ('my id is 60d5ec49f1b2c8a1e4f3b2a1', 'my id is [PROLIFIC_ID]', 'PROLIFIC_ID'),
+        ])
+def test_pii_is_redacted(text, redacted, kind):
+    assert redact(text) == (redacted, Counter({kind: 1}))
+
+
+def test_redact_values_counts_every_occurrence():
+    values = ['ip 1.2.3.4', None, 'ip 1.2.3.4', 'no pii', float('nan'), 'ip 1.2.3.4 and 5.6.7.8']
+    (redacted, counts) = redact_values(values)
+    assert redacted[:4] == ['ip [IPV4]', None, 'ip [IPV4]', 'no pii']
+    assert pd.isna(redacted[4])
+    assert redacted[5] == 'ip [IPV4] and [IPV4]'
+    assert counts == Counter({'IPV4': 4})
+
+
+def test_guards_dont_span_texts():
+    # each half of a pattern in one text, the other half in the next one
+    values = ['ends with 1.2', '3.4 starts with', 'ends with 55', '5 1234567', 'www', '.example.org']
+    assert redact_values(values) == (values, Counter())
+
+
+def test_texts_containing_nul_are_checked():
+    (redacted, counts) = redact_values(['a\x00b', 'ip 1.2.3.4'])
+    assert redacted == ['a\x00b', 'ip [IPV4]']
+    assert counts == Counter({'IPV4': 1})
+
+
+def test_redact_frame_chunks():
+    dataFrame = pd.DataFrame({'Q3.3': ['ip 1.2.3.4', None, 'nothing', 'mail a@b.co']*5, 'Q1': range(20)})
+    (dataFrame, redactions) = redact_frame(dataFrame, ['Q3.3'], chunkSize=3)
+    assert dataFrame['Q3.3'].fillna('').tolist()[:4] == ['ip [IPV4]', '', 'nothing', 'mail [EMAIL]']
+    assert redactions == {'Q3.3': Counter({'IPV4': 5, 'EMAIL': 5})}
+
+
+@pytest.mark.parametrize('numValues, workers, expected', [(1000, 4, 63), (10, 4, 1), (0, 2, 1), (10**6, 2, 2**14)])
+def test_task_size(numValues, workers, expected):
+    with make_pool(workers) as pool:
+        assert task_size(numValues, pool) == expected
+
+
+def test_redact_frame_pool():
+    dataFrame = pd.DataFrame({'Q3.3': ['ip 1.2.3.4', None, 'nothing', 'mail a@b.co']*25, 'Q2.2': ['x@y.org']*100})
+    with make_pool(2) as pool:
+        (dataFrame, redactions) = redact_frame(dataFrame, ['Q3.3', 'Q2.2'], pool)
+    assert dataFrame['Q3.3'].fillna('').tolist()[:4] == ['ip [IPV4]', '', 'nothing', 'mail [EMAIL]']
+    assert redactions == {'Q3.3': Counter({'IPV4': 25, 'EMAIL': 25}), 'Q2.2': Counter({'EMAIL': 100})}
@@ -0,0 +1,59 @@
+import json
+
+import pyarrow as pa
+import pytest
+
+from qsf_schema import json_export_batches, json_response_lines
+
+
+responses = [
+        {'responseId': 'R_1', 'values': {'QID1': 1, 'QID2': [1, 3], 'QID3_TEXT': 'plain'}},
+        {'responseId': 'R_2', 'values': {'QID3_TEXT': 'braces } ] { [ and "quotes" inside'},
+         'labels': {'QID1': {'nested': [{'deeper': [[], {}]}]}}},
+        {'responseId': 'R_3', 'values': {'QID3_TEXT': 'ends in a backslash \\', 'QID4_TEXT': '\\\\"}'}},
+        {'responseId': 'R_4', 'values': {'QID3_TEXT': '\\"escaped quote after a backslash\\\\\\"]}'}},
+        {'responseId': 'R_5', 'values': {}, 'displayedFields': [], 'displayedValues': {'QID1': [[1, 2], [3]]}},
+        {'responseId': 'R_6', 'values': {'QID3_TEXT': 'line\nbreaks\r\nand unicode é ✓'}},
+        ]
+
+
+def write_export(path, responses, indent=None):
+    path.write_text(json.dumps({'responses': responses}, indent=indent, ensure_ascii=False), encoding='utf8')
+
+
+def read_lines(path, blockSize):
+    return [json.loads(line) for lines in json_response_lines(path, blockSize) for line in lines.split(b'\n')]
+
+
+@pytest.mark.parametrize('blockSize', [1, 2, 7, 64, 1000, 2**24])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_json_response_lines(tmp_path, blockSize, indent):
+    write_export(tmp_path/'export.json', responses, indent)
+    assert read_lines(tmp_path/'export.json', blockSize) == responses
+
+
+@pytest.mark.parametrize('blockSize', [1, 7, 64])
+def test_json_response_lines_backslash_runs_across_blocks(tmp_path, blockSize):
+    # runs of backslashes of every length before a quote, so the runs are split at every position by some block size
+    texts = ['\\'*n + '"' + '\\'*n for n in range(12)]
+    exported = [{'responseId': f'R_{n}', 'values': {'QID3_TEXT': text}} for (n, text) in enumerate(texts)]
+    write_export(tmp_path/'export.json', exported)
+    assert read_lines(tmp_path/'export.json', blockSize) == exported
+
+
+@pytest.mark.parametrize('blockSize', [1, 64])
+@pytest.mark.parametrize('text', ['{"responses": []}', '{"responses":[]}\n', ''])
+def test_json_response_lines_without_responses(tmp_path, blockSize, text):
+    (tmp_path/'export.json').write_text(text)
+    assert list(json_response_lines(tmp_path/'export.json', blockSize)) == []
+
+
+def test_json_and_ndjson_batches_agree(tmp_path):
+    arrowSchema = pa.schema([('values', pa.struct([('QID1', pa.int64()), ('QID2', pa.list_(pa.int64())), ('QID3_TEXT', pa.string())]))])
+    write_export(tmp_path/'export.json', responses, indent=2)
+    (tmp_path/'export.ndjson').write_text(''.join(json.dumps(response)+'\n' for response in responses), encoding='utf8')
+    tables = [pa.Table.from_batches(list(json_export_batches(tmp_path/name, arrowSchema)), arrowSchema)
+              for name in ('export.json', 'export.ndjson')]
+    assert tables[0].equals(tables[1])
+    assert tables[0].num_rows == len(responses)
+    assert tables[0]['values'].combine_chunks().field('QID3_TEXT')[3].as_py() == responses[3]['values']['QID3_TEXT']
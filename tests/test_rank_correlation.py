@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from scipy import stats
+
+from rank_correlation import (bootstrap_chunk, code_table, factorize, permutation_chunk, permutation_tables,
+                              spearman_from_tables, spearman_resampling)
+
+
+def sample(n, seed=0, noise=2):
+    rng = np.random.default_rng(seed)
+    x = rng.integers(1, 6, n)
+    return (x, np.clip(x + rng.integers(-noise, noise+1, n), 1, 4))
+
+
+def test_code_table_gives_spearman():
+    (x, y) = sample(500)
+    table = code_table(*factorize(x), *factorize(y))
+    assert table.shape == (5, 4) and table.sum() == 500
+    assert np.isclose(spearman_from_tables(table[None])[0][0], stats.spearmanr(x, y)[0])
+
+
+def test_permutation_tables_keep_margins():
+    table = code_table(*factorize(sample(300)[0]), *factorize(sample(300)[1]))
+    tables = permutation_tables(table.sum(axis=1), table.sum(axis=0), 2000, np.random.default_rng(0))
+    assert (tables >= 0).all()
+    assert (tables.sum(axis=2) == table.sum(axis=1)).all()
+    assert (tables.sum(axis=1) == table.sum(axis=0)).all()
+
+
+def test_permutation_tables_match_permutations():
+    # rho of tables w/fixed margins has the distribution of rho of permuted samples
+    (x, y) = sample(60, noise=1)
+    table = code_table(*factorize(x), *factorize(y))
+    rng = np.random.default_rng(1)
+    permuted = np.array([stats.spearmanr(x, rng.permutation(y))[0] for _ in range(4000)])
+    drawn = permutation_chunk(table, 4000, 2)
+    assert stats.ks_2samp(permuted, drawn).pvalue > 0.01
+    # under independence rho has mean 0 and variance 1/(n-1)
+    drawn = permutation_chunk(table, 40000, 3)
+    assert abs(drawn.mean()) < 0.005
+    assert np.isclose(drawn.var(), 1/59, rtol=0.05)
+
+
+def test_bootstrap_matches_resampled_pairs():
+    (x, y) = sample(80)
+    table = code_table(*factorize(x), *factorize(y))
+    rng = np.random.default_rng(1)
+    resampled = list()
+    for _ in range(4000):
+        idx = rng.integers(0, len(x), len(x))
+        resampled.append(stats.spearmanr(x[idx], y[idx])[0])
+    assert stats.ks_2samp(resampled, bootstrap_chunk(table, 4000, 2)).pvalue > 0.01
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_spearman_resampling(workers):
+    (x, y) = sample(2000)
+    result = spearman_resampling(x, y, 2000, seed=0, workers=workers)
+    assert result.ciLow < result.rho < result.ciHigh
+    assert result.permPval == 1/2001
+    assert spearman_resampling(x, y, 2000, seed=0, workers=workers) == result
+    # independent columns
+    (x, y) = (sample(200, seed=1)[0], sample(200, seed=2)[1])
+    result = spearman_resampling(x, y, 2000, seed=0, workers=workers)
+    assert result.ciLow < 0 < result.ciHigh
+    assert result.permPval > 0.05
+    assert abs(result.permPval - result.pval) < 0.05
+
+
+@pytest.mark.filterwarnings('ignore::scipy.stats.ConstantInputWarning')
+def test_spearman_resampling_constant_column():
+    result = spearman_resampling([1, 2, 3, 4, 5], [2, 2, 2, 2, 2], 100, seed=0)
+    assert np.isnan(result.rho) and np.isnan(result.permPval)
+    assert np.isnan(result.ciLow) and np.isnan(result.ciHigh)
@@ -0,0 +1,178 @@
+import ipaddress
+import random
+
+import pandas as pd
+import pytest
+
+from collections import Counter
+
+from resolver_logs import (blockSize, build_prefix_index, classify_addresses, log_ranges, query_pattern, read_blocks,
+                           scan_logs, scan_range)
+
+
+def prefix_frame(rows):
+    return pd.DataFrame(rows, columns=['prefix', 'category', 'provider'])
+
+
+# Row of the longest prefix (the later row among equal ones) matching each address, by brute force.
+def longest_match(prefixes, addresses):
+    networks = [ipaddress.ip_network(prefix, strict=False) for prefix in prefixes['prefix']]
+    rows = list()
+    for text in addresses:
+        address = ipaddress.ip_address(text.split('%')[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        matches = [(network.prefixlen, row) for (row, network) in enumerate(networks) if address.version == network.version and address in network]
+        rows.append(max(matches)[1] if matches else -1)
+    return rows
+
+
+nested = prefix_frame([
+        ('10.0.0.0/8', 'vpn', 'a'),
+        ('10.1.0.0/16', 'sdns', 'b'),
+        ('10.1.2.0/24', 'public', 'c'),
+        ('10.1.2.0/24', 'public', 'd'),
+        ('10.1.2.128/25', 'sdns', 'e'),
+        ('10.1.3.0/24', 'vpn', 'f'),
+        ('2001:db8::/32', 'sdns', 'g'),
+        ('2001:db8:1::/48', 'vpn', 'h'),
+        ('ffff::/16', 'public', 'i'),
+        ('255.255.255.0/24', 'public', 'j'),
+        ('0.0.0.0/32', 'public', 'k'),
+        ])
+
+
+@pytest.mark.parametrize(('address', 'row'), [
+        ('10.0.0.1', 0),
+        ('10.1.0.1', 1),
+        ('10.1.2.1', 3),        # listed twice: the later row
+        ('10.1.2.127', 3),
+        ('10.1.2.128', 4),      # nested in the /24
+        ('10.1.2.255', 4),
+        ('10.1.3.0', 5),        # adjacent to the /24 above
+        ('10.1.4.0', 1),        # back in the /16 after the nested ones
+        ('10.255.255.255', 0),
+        ('11.0.0.0', -1),
+        ('9.255.255.255', -1),
+        ('::ffff:10.1.2.200', 4),  # IPv4-mapped
+        ('::ffff:a01:0201', 3),
+        ('::a01:201', -1),      # IPv4-compatible, not mapped
+        ('2001:db8::1', 6),
+        ('2001:db8:1::1', 7),
+        ('2001:DB8:2::1', 6),
+        ('2001:db9::', -1),
+        ('ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff', 8),  # the end of the address space
+        ('255.255.255.255', 9),
+        ('0.0.0.0', 10),
+        ('::', -1),
+        ('fe80::1%eth0', -1),
+        ('not an address', -1),
+        ('', -1),
+        ])
+def test_classify_nested_prefixes(address, row):
+    index = build_prefix_index(nested)
+    assert classify_addresses(index, [address]).tolist() == [row]
+
+
+def test_index_intervals_are_disjoint_and_cover_everything():
+    index = build_prefix_index(nested)
+    # (the 16 byte starts lose their trailing zero bytes when taken out of the array)
+    assert index.starts[0].ljust(16, b'\x00') == bytes(16)
+    assert (index.starts[1:] > index.starts[:-1]).all()
+    # adjacent intervals have distinct labels
+    assert (index.labels[1:] != index.labels[:-1]).all()
+
+
+def test_classify_matches_brute_force():
+    rng = random.Random(0)
+    rows = list()
+    for _ in range(200):
+        if rng.random() < 0.5:
+            length = rng.randrange(8, 33)
+            prefix = f'{ipaddress.IPv4Address(rng.getrandbits(32) & ~((1 << (32-length))-1) & 0x0fffffff | 0x0a000000)}/{length}'
+        else:
+            length = rng.randrange(16, 65)
+            prefix = f'{ipaddress.IPv6Address((0x20010db8 << 96 | rng.getrandbits(96)) & ~((1 << (128-length))-1))}/{length}'
+        rows.append((prefix, 'sdns', str(len(rows))))
+    prefixes = prefix_frame(rows)
+    index = build_prefix_index(prefixes)
+    addresses = list()
+    for (prefix, _, _) in rows:
+        network = ipaddress.ip_network(prefix)
+        # the first and last address of each prefix and their neighbours outside it
+        (first, last) = (int(network.network_address), int(network.broadcast_address))
+        for address in {max(first-1, 0), first, last, min(last+1, 2**network.max_prefixlen-1)}:
+            address = ipaddress.ip_address(address) if network.version == 6 else ipaddress.IPv4Address(address)
+            addresses.append(str(address))
+            if address.version == 4:
+                addresses.append(f'::ffff:{address}')
+    assert classify_addresses(index, addresses).tolist() == longest_match(prefixes, addresses)
+
+
+def test_empty_index():
+    index = build_prefix_index(prefix_frame([]))
+    assert classify_addresses(index, ['1.2.3.4', '::1']).tolist() == [-1, -1]
+
+
+def log_line(i, nonce, ip='42.137.164.87'):
+    return f'18-Oct-2026 10:00:00.{i % 1000:03d} queries: info: client @0x7f3b2c{i:06x} {ip}#{40000+i % 20000} ({nonce}.smartdnsstudy.com): query: {nonce}.smartdnsstudy.com IN A -E(0)DC (198.51.100.1)\n'.encode('ascii')
+
+
+def write_log(path, lines, newlineAtEnd=True):
+    data = b''.join(lines)
+    path.write_bytes(data if newlineAtEnd else data[:-1])
+    return data
+
+
+@pytest.mark.parametrize('size', [1, 7, 64, 1000, 2**20])
+@pytest.mark.parametrize('newlineAtEnd', [True, False])
+def test_read_blocks_yields_whole_lines(tmp_path, size, newlineAtEnd):
+    lines = [log_line(i, 'x'*(i % 50)) for i in range(300)]
+    data = write_log(tmp_path/'q.log', lines, newlineAtEnd)
+    data = data if newlineAtEnd else data[:-1]
+    with open(tmp_path/'q.log', 'rb') as f:
+        blocks = list(read_blocks(f, size=size))
+    assert b''.join(blocks) == data
+    assert all(block.endswith(b'\n') for block in blocks[:-1])
+
+
+@pytest.mark.parametrize('size', [7, 100, 1000])
+def test_ranges_yield_each_line_once(tmp_path, size):
+    lines = [log_line(i, str(10000+i)) for i in range(200)]
+    data = write_log(tmp_path/'q.log', lines)
+    # range boundaries at, right before and right after the start of lines, and within them
+    offsets = sorted({0, len(data)} | {o for i in range(0, len(data), 173) for o in (i-1, i, i+1) if 0 < o < len(data)})
+    scanned = list()
+    for (start, end) in zip(offsets[:-1], offsets[1:]):
+        with open(tmp_path/'q.log', 'rb') as f:
+            scanned.extend(read_blocks(f, start, end, size))
+    assert b''.join(scanned) == data
+
+
+def test_scan_across_block_and_range_boundaries(tmp_path):
+    # lines straddling the first block boundary (16 MiB) and the boundaries of ranges of 1 MiB
+    lines = list()
+    (size, i) = (0, 0)
+    while size < blockSize+2**20:
+        lines.append(log_line(i, str(10000+i % 5000), f'10.0.{i % 7}.{i % 251}'))
+        size += len(lines[-1])
+        i += 1
+    data = write_log(tmp_path/'q.log', lines)
+    assert data[blockSize-1:blockSize] != b'\n'
+    expected = scan_range(tmp_path/'q.log', 0, None, query_pattern())
+    assert expected[1] == len(lines) == sum(expected[0].values())
+    ranges = log_ranges([tmp_path/'q.log'], size=2**20)
+    assert len(ranges) > 16
+    counts = sum((scan_range(path, start, end, query_pattern())[0] for (path, start, end) in ranges), start=Counter())
+    assert counts == expected[0]
+
+
+def test_scan_logs_pairs(tmp_path):
+    lines = [log_line(0, '12345', '1.2.3.4'), log_line(1, '12345', '1.2.3.4'),
+             log_line(2, 'AbCdE', '2001:DB8::1'),
+             b'18-Oct-2026 10:00:00.003 queries: info: client 5.6.7.8#53 (example.org): query: example.org IN A -E(0)DC (198.51.100.1)\n',
+             b'18-Oct-2026 10:00:00.004 queries: info: client 5.6.7.8#53: query: 777.SmartDNSStudy.com IN AAAA + (198.51.100.1)\n']
+    write_log(tmp_path/'q.log', lines)
+    scan = scan_logs([tmp_path/'q.log'])
+    assert (scan.lines, scan.queries) == (5, 4)
+    assert scan.pairs.values.tolist() == [['12345', '1.2.3.4', 2], ['777', '5.6.7.8', 1], ['abcde', '2001:db8::1', 1]]
@@ -0,0 +1,72 @@
+import os
+import pickle
+import pandas as pd
+
+import result_cache
+
+from result_cache import ResultCache, hash_file
+from sdns_dataset import append_dataset, read_dataset, write_dataset
+
+
+def wave(start, n):
+    return pd.DataFrame({'ResponseId': [f'R_{i}' for i in range(start, start+n)], 'Q16': ['text']*n})
+
+
+def test_hash_file_of_dataset_directory(tmp_path):
+    path = str(tmp_path/'dataset.parquet')
+    write_dataset(wave(0, 3), path)
+    fileDigest = hash_file(path)
+    append_dataset(wave(3, 2), path)
+    digests = [hash_file(path)]
+    assert digests[0] != fileDigest
+    append_dataset(wave(5, 2), path)
+    digests.append(hash_file(path))
+    assert digests[1] != digests[0]
+    # a part that is still being written doesn't count
+    (tmp_path/'dataset.parquet'/'part-00003.parquet.123.tmp').write_bytes(b'partial')
+    assert hash_file(path) == digests[1]
+
+
+def test_cached_on_dataset_directory(tmp_path):
+    path = str(tmp_path/'dataset.parquet')
+    append_dataset(wave(0, 3), path)
+    append_dataset(wave(3, 2), path)
+    cache = ResultCache(str(tmp_path/'cache'))
+    calls = list()
+    def count_rows(path):
+        calls.append(path)
+        return len(read_dataset(path))
+    assert cache.cached('test.count_rows', [path], {}, count_rows, path) == 5
+    assert cache.cached('test.count_rows', [path], {}, count_rows, path) == 5
+    assert len(calls) == 1
+    append_dataset(wave(5, 1), path)
+    assert cache.cached('test.count_rows', [path], {}, count_rows, path) == 6
+    assert len(calls) == 2
+
+
+def test_key_covers_the_code(tmp_path, monkeypatch):
+    (tmp_path/'scripts').mkdir()
+    (tmp_path/'scripts'/'analysis.py').write_text('scale = [1, 2, 3]\n')
+    (tmp_path/'data.csv').write_text('a\n1\n')
+    monkeypatch.setattr(result_cache, 'scriptDir', str(tmp_path/'scripts'))
+    cache = ResultCache(str(tmp_path/'cache'))
+    key = cache.key('test.analysis', [str(tmp_path/'data.csv')], {})
+    assert cache.key('test.analysis', [str(tmp_path/'data.csv')], {}) == key
+    (tmp_path/'scripts'/'analysis.py').write_text('scale = [3, 2, 1]\n')
+    assert cache.key('test.analysis', [str(tmp_path/'data.csv')], {}) != key
+
+
+def test_unloadable_entries_are_recomputed(tmp_path):
+    cache = ResultCache(str(tmp_path/'cache'))
+    key = cache.key('test.value', [], {})
+    # pickles of a class of a module that no longer exists, of a renamed class, and a truncated one
+    entries = [pickle.dumps(pickle.PickleBuffer).replace(b'\x8c\x06pickle', b'\x8c\x06nosuch'),
+               pickle.dumps(pickle.PickleBuffer).replace(b'PickleBuffer', b'RenamedClass'),
+               pickle.dumps(list(range(100)))[:20]]
+    for entry in entries:
+        with open(cache.path(key), 'wb') as f:
+            f.write(entry)
+        assert cache.get(key) == (False, None)
+        assert not os.path.exists(cache.path(key))
+        assert cache.cached('test.value', [], {}, lambda: 42) == 42
+        assert cache.get(key) == (True, 42)
@@ -0,0 +1,43 @@
+import re
+
+import pandas as pd
+import pytest
+
+from sdns_dataset import read_dataset, write_dataset
+from sdns_pipeline import check_combinable, combine_datasets, strip_labels
+
+
+def survey_frame(prefix, n, education=('High school graduate', "Master's Degree")):
+    return pd.DataFrame({'ResponseId': [f'R_{prefix}{i}' for i in range(n)], 'random_id': [str(10000+i) for i in range(n)],
+                         'Q13.2': pd.Categorical([education[i % 2] for i in range(n)], categories=list(education), ordered=True)})
+
+
+def test_combine(tmp_path):
+    reddit = survey_frame('D', 3, ('High school graduate ', "Master's Degree")).assign(Q16='text')
+    prolific = survey_frame('P', 2)
+    write_dataset(reddit, str(tmp_path/'reddit.parquet'))
+    write_dataset(prolific, str(tmp_path/'prolific.parquet'))
+    combine_datasets([str(tmp_path/'reddit.parquet'), str(tmp_path/'prolific.parquet')], str(tmp_path/'full.parquet'))
+    full = read_dataset(str(tmp_path/'full.parquet'))
+    assert full['ResponseId'].tolist() == ['R_D0', 'R_D1', 'R_D2', 'R_P0', 'R_P1']
+    assert list(full['Q13.2'].cat.categories) == ['High school graduate', "Master's Degree"]
+    assert full['Q16'].isna().tolist() == [False]*3 + [True]*2
+
+
+@pytest.mark.parametrize(('change', 'message'), [
+        (lambda frame: frame.drop(columns=['ResponseId']), "no column(s) ['ResponseId']"),
+        (lambda frame: frame.rename(columns={'random_id': 'random_id_x'}).assign(random_id_y='1'), 'duplicated by a merge'),
+        (lambda frame: frame.assign(ResponseId='R_D0'), 'ResponseId(s) appear more than once'),
+        (lambda frame: frame.assign(**{'Q13.2': frame['Q13.2'].cat.reorder_categories(frame['Q13.2'].cat.categories[::-1])}),
+         "column 'Q13.2' has different types"),
+        ])
+def test_check_combinable(change, message):
+    frames = {'reddit': survey_frame('D', 3), 'prolific': change(survey_frame('P', 2))}
+    with pytest.raises(ValueError, match=re.escape(message)):
+        check_combinable(frames)
+
+
+def test_strip_labels_keeps_distinct_labels():
+    frame = pd.DataFrame({'Q': pd.Categorical(['a', 'a '], categories=['a', 'a '])})
+    strip_labels([frame])
+    assert list(frame['Q'].cat.categories) == ['a', 'a ']